@@ -70,22 +70,13 @@ class Pipeline(core.Stack):
         beta_deploy_stage = pipeline.add_stage(self.beta_stage)
 
 
-        # curl beta frontend
-        beta_deploy_stage.add_post(
-            ShellStep(
-                "TestBetaCloudfrontEndpoint",
-                commands=[
-                    "curl https://beta-visit.cumaker.space/",
-                ],
-            )
-        )
-
+        # the canary checks the frontend and the API endpoints in parallel
         beta_deploy_stage.add_post(
             ShellStep(
                 "TestBetaAPIEndpoints",
                 input=codestar_source, # pass entire codestar connection to repo
                 commands=[
-                    "ENV=Beta python3 cdk/visit/lambda_code/test_api/testing_script.py",
+                    "python3 cdk/visit/lambda_code/test_api/canary.py --stage Beta",
                 ],
             )
         )
@@ -96,22 +87,13 @@ class Pipeline(core.Stack):
             pre=[ManualApprovalStep("PromoteBetaToProd")]
         )
 
-        # curl prod frontend
-        prod_deploy_stage.add_post(
-            ShellStep(
-                "TestingProdCloudfrontEndpoint",
-                commands=[
-                    "curl https://visit.cumaker.space/",
-                ],
-            )
-        )
-
+        # the canary checks the frontend and the API endpoints in parallel
         prod_deploy_stage.add_post(
             ShellStep(
                 "TestProdAPIEndpoints",
                 input=codestar_source, # pass entire codestar connection to repo
                 commands=[
-                    "ENV=Prod python3 cdk/visit/lambda_code/test_api/testing_script.py",
+                    "python3 cdk/visit/lambda_code/test_api/canary.py --stage Prod",
                 ],
             )
         )
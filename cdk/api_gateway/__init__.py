@@ -2,6 +2,7 @@
 from aws_cdk import (
     aws_certificatemanager,
     core,
+    aws_iam,
     aws_lambda,
     aws_apigateway,
 )
@@ -34,10 +35,16 @@ class SharedApiGateway(core.Stack):
 
     The user APIs for any user-facing apps could use OAuth, but we haven't gotten
     that far in the design yet.
+
+    GET /visits reads back every visitor's history, so until then it uses IAM
+    authorization: only requests signed with credentials that are allowed
+    execute-api:Invoke on it, like those of a role with the VisitHistoryReaders
+    policy attached, get through. Unsigned calls are rejected with a 403.
     """
 
     def __init__(self, scope: core.Construct, stage: str,
-                visitors: aws_lambda.Function, register: aws_lambda.Function, quiz: aws_lambda.Function, *, env: core.Environment, create_dns: bool, zones: MakerspaceDns = None):
+                visitors: aws_lambda.Function, register: aws_lambda.Function, quiz: aws_lambda.Function,
+                visit_history: aws_lambda.Function, *, env: core.Environment, create_dns: bool, zones: MakerspaceDns = None):
 
         super().__init__(scope, f'SharedApiGateway-{stage}', env=env)
 
@@ -50,10 +57,14 @@ class SharedApiGateway(core.Stack):
         self.route_registration(register)
         self.route_quiz(quiz)
         self.route_quiz_username(quiz)
+        self.route_visit_history(visit_history)
 
     def create_rest_api(self):
 
-        self.api = aws_apigateway.RestApi(self, 'SharedApiGateway')
+        # responses over 1 KB are gzipped for clients that accept it, which
+        # mostly matters for pages of GET /visits
+        self.api = aws_apigateway.RestApi(self, 'SharedApiGateway',
+                                          minimum_compression_size=1024)
 
         if self.create_dns:
             domain_name = self.zones.api.zone_name
@@ -73,6 +84,10 @@ class SharedApiGateway(core.Stack):
 
         self.visit.add_method('POST', log_visit)
 
+        # visits a kiosk queued while it was offline
+        self.visit_batch = self.visit.add_resource('batch')
+        self.visit_batch.add_method('POST', log_visit)
+
     def route_registration(self, register: aws_lambda.Function):
 
         register_user = aws_apigateway.LambdaIntegration(register)
@@ -98,6 +113,22 @@ class SharedApiGateway(core.Stack):
 
         self.quiz_username.add_method('GET', quiz_username)
     
+    def route_visit_history(self, visit_history: aws_lambda.Function):
+
+        get_visits = aws_apigateway.LambdaIntegration(visit_history)
+
+        self.visits = self.api.root.add_resource('visits')
+
+        self.visits.add_method('GET', get_visits,
+                               authorization_type=aws_apigateway.AuthorizationType.IAM)
+
+        # attach to the roles staff export visits with
+        self.visit_history_readers = aws_iam.ManagedPolicy(
+            self, 'VisitHistoryReaders',
+            statements=[aws_iam.PolicyStatement(
+                actions=['execute-api:Invoke'],
+                resources=[self.api.arn_for_execute_api('GET', '/visits')])])
+
     def route_quicksight(self):
         resource_name = 'dashboard'
 
@@ -16,6 +16,9 @@ class Database(core.Stack):
         self.visits_id = 'visits'
         self.quiz_progress_id = 'quiz_progress'
         self.quiz_list_id = "quiz_list"
+        self.visit_counts_id = 'visit_counts'
+        self.idempotency_id = 'idempotency'
+        self.email_sends_id = 'email_sends'
 
         super().__init__(
             scope, self.id, env=env, termination_protection=True)
@@ -25,6 +28,9 @@ class Database(core.Stack):
         self.dynamodb_users_table()
         self.dynamodb_quiz_progress_table()
         self.dynamodb_quiz_list_table()
+        self.dynamodb_visit_counts_table()
+        self.dynamodb_idempotency_table()
+        self.dynamodb_email_sends_table()
 
     def dynamodb_old_table(self):
         """
@@ -110,7 +116,25 @@ class Database(core.Stack):
                                                    name='visit_time',
                                                    type=aws_dynamodb.AttributeType.NUMBER),
                                                 billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
-                                                time_to_live_attribute="last_updated")
+                                                time_to_live_attribute="last_updated",
+                                                # inserts and updates are copied to the legacy
+                                                # table by the back-fill lambda, and new visits
+                                                # are counted by the visit counts lambda
+                                                stream=aws_dynamodb.StreamViewType.NEW_IMAGE)
+
+        # Time range queries: visits are bucketed by UTC day, split into a
+        # few shards so a busy day is not one hot partition
+        # (see lambda_utils.visit_index). Visits written before the index
+        # have no day_bucket until migration_scripts/backfill_day_buckets.py
+        # is run against the stage.
+        self.visits_table.add_global_secondary_index(
+            index_name='visits_by_day',
+            partition_key=aws_dynamodb.Attribute(
+                name='day_bucket',
+                type=aws_dynamodb.AttributeType.STRING),
+            sort_key=aws_dynamodb.Attribute(
+                name='visit_time',
+                type=aws_dynamodb.AttributeType.NUMBER))
 
     def dynamodb_users_table(self):
         self.users_table = aws_dynamodb.Table(self,
@@ -121,7 +145,10 @@ class Database(core.Stack):
                                                   name='username',
                                                   type=aws_dynamodb.AttributeType.STRING),
                                               billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
-                                              time_to_live_attribute="last_updated")
+                                              time_to_live_attribute="last_updated",
+                                              # registrations, new and repeated, are copied
+                                              # to the legacy table by the back-fill lambda
+                                              stream=aws_dynamodb.StreamViewType.NEW_IMAGE)
 
     def dynamodb_quiz_progress_table(self):
         """
@@ -167,4 +194,75 @@ class Database(core.Stack):
                                                       type=aws_dynamodb.AttributeType.STRING
                                                   ),
                                                   billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
-                                                  time_to_live_attribute="last_updated")
\ No newline at end of file
+                                                  time_to_live_attribute="last_updated")
+
+    def dynamodb_visit_counts_table(self):
+        """
+        This table holds visit counters, one per location, day, hour and
+        tool, incremented by the visit counts lambda as visits are written.
+
+        schema:
+        - PK = location
+        - SK = bucket, `{YYYY-MM-DD}#{hour}#{tool}`
+
+        so the counts for a location over a range of days are one query.
+        """
+        self.visit_counts_table = aws_dynamodb.Table(self,
+                                                     self.visit_counts_id,
+                                                     point_in_time_recovery=True,
+                                                     removal_policy=core.RemovalPolicy.RETAIN,
+                                                     partition_key=aws_dynamodb.Attribute(
+                                                         name="location",
+                                                         type=aws_dynamodb.AttributeType.STRING
+                                                     ),
+                                                     sort_key=aws_dynamodb.Attribute(
+                                                         name="bucket",
+                                                         type=aws_dynamodb.AttributeType.STRING
+                                                     ),
+                                                     billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST)
+
+    def dynamodb_idempotency_table(self):
+        """
+        This table holds the responses to POSTs sent with an
+        Idempotency-Key header, so a retried request gets the first response
+        instead of being written again (see lambda_utils.idempotency). It
+        also marks the visits the visit counts lambda has counted.
+
+        schema:
+        - PK = idempotency_key, `{endpoint}#{key}` or
+          `visit_counts#{username}#{visit_time}`
+
+        Items expire through the TTL on expires_at. Nothing in it outlives a
+        day, so it is not backed up or kept when the stack is deleted.
+        """
+        self.idempotency_table = aws_dynamodb.Table(self,
+                                                    self.idempotency_id,
+                                                    removal_policy=core.RemovalPolicy.DESTROY,
+                                                    partition_key=aws_dynamodb.Attribute(
+                                                        name="idempotency_key",
+                                                        type=aws_dynamodb.AttributeType.STRING
+                                                    ),
+                                                    billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                                    time_to_live_attribute="expires_at")
+
+    def dynamodb_email_sends_table(self):
+        """
+        This table records who was sent a registration email, so a user is
+        emailed at most once per dedupe window however many email sender
+        containers run (see lambda_utils.registration_email).
+
+        schema:
+        - PK = recipient, the email address
+
+        Items expire through the TTL on expires_at, at the end of the window,
+        so like the idempotency table it is not backed up or kept.
+        """
+        self.email_sends_table = aws_dynamodb.Table(self,
+                                                    self.email_sends_id,
+                                                    removal_policy=core.RemovalPolicy.DESTROY,
+                                                    partition_key=aws_dynamodb.Attribute(
+                                                        name="recipient",
+                                                        type=aws_dynamodb.AttributeType.STRING
+                                                    ),
+                                                    billing_mode=aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+                                                    time_to_live_attribute="expires_at")
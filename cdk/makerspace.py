@@ -1,5 +1,5 @@
 
-from aws_cdk import core
+from aws_cdk import core, aws_lambda
 from visit import Visit
 from api_gateway import SharedApiGateway
 from database import Database
@@ -14,6 +14,21 @@ class MakerspaceStage(core.Stage):
         self.service = MakerspaceStack(self, stage, env=env)
 
 
+# How each stage keeps the legacy single-table design (see
+# Database.dynamodb_old_table) up to date:
+#
+# - sync: log_visit and register_user write it on every request
+# - async: they only write the new tables, and a lambda on the visits and
+#   users table streams back-fills it
+# - off: nothing writes it
+#
+# Stages that are not listed use sync.
+LEGACY_WRITE_MODES = {
+    'Beta': 'async',
+    'Prod': 'async',
+}
+
+
 class MakerspaceStack(core.Stack):
 
     def __init__(self, app: core.Construct, stage: str, *,
@@ -34,6 +49,8 @@ class MakerspaceStack(core.Stack):
 
         self.create_dns = 'dev' not in self.domains.stage
 
+        self.legacy_write_mode = LEGACY_WRITE_MODES.get(self.stage, 'sync')
+
         self.database_stack()
 
         self.visitors_stack()
@@ -48,6 +65,13 @@ class MakerspaceStack(core.Stack):
         self.database.visits_table.grant_read_write_data(
             self.visit.lambda_visit)
 
+        self.database.visits_table.grant_read_data(
+            self.visit.lambda_visit_history)
+        self.database.visits_table.grant_read_data(
+            self.visit.lambda_analytics_export)
+        self.database.users_table.grant_read_data(
+            self.visit.lambda_analytics_export)
+
         self.database.users_table.grant_read_data(self.visit.lambda_visit)
         self.database.users_table.grant_read_write_data(
             self.visit.lambda_register)
@@ -57,6 +81,19 @@ class MakerspaceStack(core.Stack):
         self.database.quiz_progress_table.grant_read_write_data(
             self.visit.lambda_quiz)
 
+        for post_lambda in (self.visit.lambda_visit, self.visit.lambda_register, self.visit.lambda_quiz):
+            self.database.idempotency_table.grant_read_write_data(post_lambda)
+
+        self.database.email_sends_table.grant_read_write_data(
+            self.visit.lambda_email_sender)
+
+        if self.visit.lambda_legacy_backfill:
+            self.legacy_backfill_streams()
+
+        self.visit_counts_stream()
+
+        self.analytics_export_streams()
+
         self.shared_api_gateway()
 
         if self.create_dns:
@@ -78,16 +115,68 @@ class MakerspaceStack(core.Stack):
             self.database.visits_table.table_name,
             self.database.quiz_list_table.table_name,
             self.database.quiz_progress_table.table_name,
+            self.database.visit_counts_table.table_name,
+            self.database.idempotency_table.table_name,
+            self.database.email_sends_table.table_name,
             create_dns=self.create_dns,
             zones=self.dns,
-            env=self.env)
+            env=self.env,
+            legacy_write_mode=self.legacy_write_mode)
 
         self.add_dependency(self.visit)
 
+    def legacy_backfill_streams(self):
+
+        backfill = self.visit.lambda_legacy_backfill
+
+        self.database.old_table.grant_write_data(backfill)
+
+        for table in (self.database.visits_table, self.database.users_table):
+            table.grant_stream_read(backfill)
+            backfill.add_event_source_mapping(
+                f'{table.node.id}Stream',
+                event_source_arn=table.table_stream_arn,
+                starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
+                batch_size=100,
+                retry_attempts=10)
+
+    def visit_counts_stream(self):
+
+        visit_counts = self.visit.lambda_visit_counts
+
+        self.database.visit_counts_table.grant_write_data(visit_counts)
+        self.database.idempotency_table.grant_read_write_data(visit_counts)
+
+        self.database.visits_table.grant_stream_read(visit_counts)
+        visit_counts.add_event_source_mapping(
+            'VisitCountsStream',
+            event_source_arn=self.database.visits_table.table_stream_arn,
+            starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
+            batch_size=100,
+            # retries start at the first visit that was not counted
+            report_batch_item_failures=True,
+            bisect_batch_on_error=True,
+            retry_attempts=10)
+
+    def analytics_export_streams(self):
+
+        analytics_export = self.visit.lambda_analytics_export
+
+        for table in (self.database.visits_table, self.database.users_table):
+            table.grant_stream_read(analytics_export)
+            # batch up to five minutes of writes into each export file
+            analytics_export.add_event_source_mapping(
+                f'{table.node.id}AnalyticsStream',
+                event_source_arn=table.table_stream_arn,
+                starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
+                batch_size=1000,
+                max_batching_window=core.Duration.minutes(5),
+                retry_attempts=10)
+
     def shared_api_gateway(self):
 
         self.api_gateway = SharedApiGateway(
-            self.app, self.stage, self.visit.lambda_visit, self.visit.lambda_register, self.visit.lambda_quiz, env=self.env, zones=self.dns, create_dns=self.create_dns)
+            self.app, self.stage, self.visit.lambda_visit, self.visit.lambda_register, self.visit.lambda_quiz, self.visit.lambda_visit_history, env=self.env, zones=self.dns, create_dns=self.create_dns)
 
         self.api_gateway.route_quicksight()
 
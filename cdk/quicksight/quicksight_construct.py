@@ -34,7 +34,8 @@ class QuickSightEmbedConstruct(core.Construct):
                 'AWS_ACCOUNT_ID': aws_account_id,
                 'DASHBOARD_ID': dashboard_id,
                 'QUICKSIGHT_USER_ARN': quicksight_user_arn
-            }
+            },
+            timeout=core.Duration.seconds(15)
         )
 
         # Lambda API integration
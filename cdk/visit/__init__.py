@@ -9,6 +9,7 @@ from aws_cdk import (
     aws_lambda,
     aws_s3,
     aws_iam,
+    aws_sqs,
 )
 
 from dns import MakerspaceDns
@@ -23,7 +24,8 @@ class Visit(core.Stack):
     2. An API Gateway routes requests to AWS Lambda
     3. The lambda function checks if the user has registered before
         a. If the user has registered, we just continue
-        b. If the user hasn't registered, we send them an email
+        b. If the user hasn't registered, we queue an email, which a
+           separate lambda sends in batches
     4. The Lambda function records a visit in DynamoDB
     5. The registration email contains a federated link to another webpage
         (register.cumaker.space) which will be a different stack
@@ -37,16 +39,23 @@ class Visit(core.Stack):
                  visits_table_name: str,
                  quiz_list_table_name: str,
                  quiz_progress_table_name: str,
+                 visit_counts_table_name: str,
+                 idempotency_table_name: str,
+                 email_sends_table_name: str,
                  *,
                  env: core.Environment,
                  create_dns: bool,
-                 zones: MakerspaceDns = None):
+                 zones: MakerspaceDns = None,
+                 legacy_write_mode: str = 'sync'):
 
         super().__init__(scope, f'Visitors-{stage}', env=env)
 
         self.stage = stage
         self.create_dns = create_dns
         self.zones = zones
+        self.legacy_write_mode = legacy_write_mode
+        self.idempotency_table_name = idempotency_table_name
+        self.email_sends_table_name = email_sends_table_name
 
         self.source_bucket()
 
@@ -57,6 +66,10 @@ class Visit(core.Stack):
 
         self.domain_name = self.distribution.domain_name if stage == 'Dev' else self.zones.visit.zone_name
 
+        self.shared_layer()
+
+        self.registration_email_queue()
+
         self.log_visit_lambda(
             original_table_name, visits_table_name, users_table_name, ("https://" + self.domain_name))
         self.register_user_lambda(
@@ -64,6 +77,15 @@ class Visit(core.Stack):
         self.quiz_lambda(
             quiz_list_table_name, quiz_progress_table_name, ("https://" + self.domain_name))
         self.test_api_lambda(env=stage)
+        self.email_sender_lambda()
+        self.visit_counts_lambda(visit_counts_table_name)
+        self.visit_history_lambda(visits_table_name, ("https://" + self.domain_name))
+        self.analytics_export_lambda(visits_table_name, users_table_name)
+
+        self.lambda_legacy_backfill = None
+        if legacy_write_mode == 'async':
+            self.legacy_backfill_lambda(
+                original_table_name, visits_table_name, users_table_name)
 
         
 
@@ -112,6 +134,35 @@ class Visit(core.Stack):
         self.distribution = aws_cloudfront.Distribution(
             self, 'VisitorsConsoleCache', **kwargs)
 
+    def shared_layer(self):
+        """
+        Code shared between lambdas (visit/lambda_code/layer/python), which
+        Lambda unpacks onto the path of every function it is attached to.
+        """
+
+        self.layer = aws_lambda.LayerVersion(
+            self,
+            'SharedLambdaLayer',
+            code=aws_lambda.Code.from_asset('visit/lambda_code/layer'),
+            compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_9])
+
+    def registration_email_queue(self):
+        """
+        Registration emails requested by the log visit lambda wait here until
+        the email sender lambda picks them up in batches.
+        """
+
+        self.email_dead_letter_queue = aws_sqs.Queue(
+            self, 'RegistrationEmailDeadLetterQueue',
+            retention_period=core.Duration.days(14))
+
+        self.email_queue = aws_sqs.Queue(
+            self, 'RegistrationEmailQueue',
+            visibility_timeout=core.Duration.seconds(60),
+            dead_letter_queue=aws_sqs.DeadLetterQueue(
+                max_receive_count=3,
+                queue=self.email_dead_letter_queue))
+
     def log_visit_lambda(self, original_table_name: str, visits_table_name: str, users_table_name: str, domain_name: str):
 
         sending_authorization_policy = aws_iam.PolicyStatement(
@@ -129,11 +180,19 @@ class Visit(core.Stack):
                 'DOMAIN_NAME': domain_name,
                 'VISITS_TABLE_NAME': visits_table_name,
                 'USERS_TABLE_NAME': users_table_name,
+                'VISIT_WRITE_MODE': 'transaction',
+                'LEGACY_WRITE_MODE': self.legacy_write_mode,
+                'EMAIL_QUEUE_URL': self.email_queue.queue_url,
+                'IDEMPOTENCY_TABLE_NAME': self.idempotency_table_name,
             },
             handler='log_visit.handler',
+            layers=[self.layer],
+            # a POST /visit/batch writes a few hundred visits
+            timeout=core.Duration.seconds(20),
             runtime=aws_lambda.Runtime.PYTHON_3_9)
 
         self.lambda_visit.role.add_to_policy(sending_authorization_policy)
+        self.email_queue.grant_send_messages(self.lambda_visit)
 
     def register_user_lambda(self, original_table_name: str, users_table_name: str, domain_name: str):
 
@@ -145,9 +204,12 @@ class Visit(core.Stack):
             environment={
                 'ORIGINAL_TABLE_NAME': original_table_name,
                 'DOMAIN_NAME': domain_name,
-                'USERS_TABLE_NAME': users_table_name
+                'USERS_TABLE_NAME': users_table_name,
+                'LEGACY_WRITE_MODE': self.legacy_write_mode,
+                'IDEMPOTENCY_TABLE_NAME': self.idempotency_table_name,
             },
             handler='register_user.handler',
+            layers=[self.layer],
             runtime=aws_lambda.Runtime.PYTHON_3_9)
         
     def quiz_lambda(self, quiz_list_table_name: str, quiz_progress_table_name: str, domain_name: str):
@@ -160,11 +222,144 @@ class Visit(core.Stack):
             environment={
                 'DOMAIN_NAME': domain_name,
                 'QUIZ_LIST_TABLE_NAME': quiz_list_table_name,
-                'QUIZ_PROGRESS_TABLE_NAME': quiz_progress_table_name
+                'QUIZ_PROGRESS_TABLE_NAME': quiz_progress_table_name,
+                # how long a warm container keeps the quiz catalog in memory
+                'QUIZ_CATALOG_TTL_SECONDS': '300',
+                'IDEMPOTENCY_TABLE_NAME': self.idempotency_table_name,
             },
             handler='quiz.handler',
+            layers=[self.layer],
             runtime=aws_lambda.Runtime.PYTHON_3_9)
         
+    def legacy_backfill_lambda(self, original_table_name: str, visits_table_name: str, users_table_name: str):
+        """
+        Copies new and updated rows from the visits and users table streams
+        into the original table. The stream subscriptions are added in MakerspaceStack,
+        which owns the table objects.
+        """
+
+        self.lambda_legacy_backfill = aws_lambda.Function(
+            self,
+            'LegacyBackfillLambda',
+            function_name=core.PhysicalName.GENERATE_IF_NEEDED,
+            code=aws_lambda.Code.from_asset('visit/lambda_code/legacy_backfill'),
+            environment={
+                'ORIGINAL_TABLE_NAME': original_table_name,
+                'VISITS_TABLE_NAME': visits_table_name,
+                'USERS_TABLE_NAME': users_table_name,
+            },
+            handler='legacy_backfill.handler',
+            layers=[self.layer],
+            runtime=aws_lambda.Runtime.PYTHON_3_9)
+
+    def visit_counts_lambda(self, visit_counts_table_name: str):
+        """
+        Counts new visits from the visits table stream into the visit counts
+        table, with a marker per visit in the idempotency table so a retried
+        batch is not counted twice. The stream subscription is added in
+        MakerspaceStack, which owns the table objects.
+        """
+
+        self.lambda_visit_counts = aws_lambda.Function(
+            self,
+            'VisitCountsLambda',
+            function_name=core.PhysicalName.GENERATE_IF_NEEDED,
+            code=aws_lambda.Code.from_asset('visit/lambda_code/visit_counts'),
+            environment={
+                'VISIT_COUNTS_TABLE_NAME': visit_counts_table_name,
+                'IDEMPOTENCY_TABLE_NAME': self.idempotency_table_name,
+                # days and hours are counted in the makerspace's local time
+                'VISIT_COUNTS_TIMEZONE': 'America/New_York',
+            },
+            handler='visit_counts.handler',
+            layers=[self.layer],
+            runtime=aws_lambda.Runtime.PYTHON_3_9)
+
+    def visit_history_lambda(self, visits_table_name: str, domain_name: str):
+
+        self.lambda_visit_history = aws_lambda.Function(
+            self,
+            'VisitHistoryLambda',
+            function_name=core.PhysicalName.GENERATE_IF_NEEDED,
+            code=aws_lambda.Code.from_asset('visit/lambda_code/visit_history'),
+            environment={
+                'DOMAIN_NAME': domain_name,
+                'VISITS_TABLE_NAME': visits_table_name,
+            },
+            handler='visit_history.handler',
+            layers=[self.layer],
+            # a page fans out over the index shards of each day
+            memory_size=256,
+            timeout=core.Duration.seconds(30),
+            runtime=aws_lambda.Runtime.PYTHON_3_9)
+
+    def analytics_export_lambda(self, visits_table_name: str, users_table_name: str):
+        """
+        Exports visits and users as gzipped CSV, partitioned by day, for
+        Athena or QuickSight to read from the analytics bucket. It follows
+        the visits and users table streams; invoked by hand it exports both
+        tables in full. The stream subscriptions and table read access are
+        added in MakerspaceStack.
+        """
+
+        self.analytics_bucket = aws_s3.Bucket(
+            self, 'AnalyticsBucket',
+            block_public_access=aws_s3.BlockPublicAccess.BLOCK_ALL)
+
+        self.lambda_analytics_export = aws_lambda.Function(
+            self,
+            'AnalyticsExportLambda',
+            function_name=core.PhysicalName.GENERATE_IF_NEEDED,
+            code=aws_lambda.Code.from_asset('visit/lambda_code/analytics_export'),
+            environment={
+                'VISITS_TABLE_NAME': visits_table_name,
+                'USERS_TABLE_NAME': users_table_name,
+                'EXPORT_BUCKET': self.analytics_bucket.bucket_name,
+                'EXPORT_PREFIX': 'analytics',
+            },
+            handler='analytics_export.handler',
+            layers=[self.layer],
+            # a full export scans both tables
+            memory_size=1024,
+            timeout=core.Duration.minutes(15),
+            runtime=aws_lambda.Runtime.PYTHON_3_9)
+
+        self.analytics_bucket.grant_read_write(self.lambda_analytics_export)
+
+    def email_sender_lambda(self):
+
+        sending_authorization_policy = aws_iam.PolicyStatement(
+            effect=aws_iam.Effect.ALLOW)
+        sending_authorization_policy.add_actions("ses:SendEmail")
+        sending_authorization_policy.add_all_resources()
+
+        self.lambda_email_sender = aws_lambda.Function(
+            self,
+            'EmailSenderLambda',
+            function_name=core.PhysicalName.GENERATE_IF_NEEDED,
+            code=aws_lambda.Code.from_asset('visit/lambda_code/email_sender'),
+            environment={
+                # a user is sent at most one registration email per window
+                'EMAIL_DEDUPE_WINDOW_SECONDS': '86400',
+                # who was emailed, shared by every container
+                'EMAIL_SENDS_TABLE_NAME': self.email_sends_table_name,
+            },
+            handler='email_sender.handler',
+            layers=[self.layer],
+            runtime=aws_lambda.Runtime.PYTHON_3_9)
+
+        self.lambda_email_sender.role.add_to_policy(
+            sending_authorization_policy)
+
+        self.email_queue.grant_consume_messages(self.lambda_email_sender)
+        self.lambda_email_sender.add_event_source_mapping(
+            'RegistrationEmailQueueSource',
+            event_source_arn=self.email_queue.queue_arn,
+            batch_size=10,
+            max_batching_window=core.Duration.seconds(30),
+            # only the messages that failed are retried
+            report_batch_item_failures=True)
+
     def test_api_lambda(self, env: str):
 
         self.lambda_api_test = aws_lambda.Function(
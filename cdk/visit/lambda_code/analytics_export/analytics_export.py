@@ -0,0 +1,260 @@
+import csv
+import datetime
+import gzip
+import io
+import logging
+import os
+import time
+from collections import defaultdict
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+from lambda_utils import aws_clients
+from lambda_utils.dynamodb import ParallelScanner
+from lambda_utils.instrumentation import instrumented
+
+VISIT_COLUMNS = ['visit_time', 'username', 'location', 'tool']
+USER_COLUMNS = ['username', 'register_time', 'first_name', 'last_name',
+                'gender', 'date_of_birth', 'position', 'grad_semester',
+                'grad_year', 'majors', 'minors']
+
+
+class S3Target():
+    """
+    Writes export files under an S3 prefix.
+    """
+
+    def __init__(self, bucket, prefix, s3_client=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.s3 = s3_client or aws_clients.LazyClient('s3')
+
+    def key(self, name):
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def read(self, name):
+        try:
+            response = self.s3.get_object(
+                Bucket=self.bucket, Key=self.key(name))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'NoSuchKey':
+                raise
+            return None
+        return response['Body'].read()
+
+    def write(self, name, body):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key(name), Body=body)
+
+    def __str__(self):
+        return f's3://{self.bucket}/{self.prefix}'
+
+
+class DirectoryTarget():
+    """
+    Writes export files under a local directory, for running the export
+    outside of AWS.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, name):
+        try:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name, body):
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so readers never see half a file
+        with open(path + '.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(path + '.tmp', path)
+
+    def __str__(self):
+        return self.path
+
+
+def target_from_env():
+    """
+    EXPORT_DIRECTORY if set, otherwise EXPORT_BUCKET and EXPORT_PREFIX.
+    """
+    if os.environ.get('EXPORT_DIRECTORY'):
+        return DirectoryTarget(os.environ['EXPORT_DIRECTORY'])
+    return S3Target(os.environ['EXPORT_BUCKET'],
+                    os.environ.get('EXPORT_PREFIX', 'analytics'))
+
+
+def csv_value(value):
+    if isinstance(value, (list, set)):
+        return ';'.join(sorted(str(v) for v in value))
+    return '' if value is None else str(value)
+
+
+class Partitions():
+    """
+    Gzipped CSV files being built in memory, one per table and day.
+    """
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = columns
+        self.files = {}
+        self.rows = defaultdict(int)
+
+    def add(self, day, item):
+        if day not in self.files:
+            buffer = io.BytesIO()
+            text = io.TextIOWrapper(gzip.GzipFile(fileobj=buffer, mode='wb'),
+                                    encoding='utf-8', newline='')
+            writer = csv.writer(text)
+            writer.writerow(self.columns)
+            self.files[day] = (buffer, text, writer)
+
+        self.files[day][2].writerow(
+            [csv_value(item.get(column)) for column in self.columns])
+        self.rows[day] += 1
+
+    def write(self, target, run_id):
+        """
+        Write each day's file as {table}/date={day}/part-{run_id}.csv.gz.
+        """
+        for day, (buffer, text, _) in sorted(self.files.items()):
+            # closing the text wrapper finishes the gzip stream
+            text.detach().close()
+            target.write(f'{self.table}/date={day}/part-{run_id}.csv.gz',
+                         buffer.getvalue())
+
+
+def utc_day(timestamp):
+    return datetime.datetime.fromtimestamp(
+        float(timestamp), tz=datetime.timezone.utc).date().isoformat()
+
+
+class AnalyticsExportFunction():
+    """
+    Exports the visits and users tables for analytics as gzipped CSV files,
+    partitioned by UTC day:
+
+        {prefix}/visits/date=2022-04-11/part-{run}.csv.gz
+        {prefix}/users/date=2022-04-11/part-{run}.csv.gz
+
+    The export is subscribed to the streams of both tables, so it reads
+    only what was written: each batch of stream records becomes one file
+    per table and day, named after the batch's first sequence number. A
+    batch that is retried writes the same files again rather than new ones.
+    A visit a kiosk queued while offline arrives with an old visit_time and
+    goes into the file of the day it happened.
+
+    Invoked with no records, it exports both tables whole with a scan, to
+    start the export off with what was written before the streams were
+    subscribed.
+
+    Visits a kiosk sends again, and the first export overlapping the
+    stream, export rows again, so readers should keep one row per username
+    and visit_time. A user who registers again gets a new register_time and
+    is exported again, so readers should keep each username's latest row.
+
+    Like the other lambdas, the tables and target can be passed in so it
+    can be tested with moto and a local directory.
+    """
+
+    def __init__(self, visits_table, users_table, target, scan_segments=4):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.INFO)
+
+        self.scan_segments = scan_segments
+        self.deserializer = TypeDeserializer()
+
+        if visits_table is None:
+            VISITS_TABLE_NAME = os.environ["VISITS_TABLE_NAME"]
+            self.visits = aws_clients.LazyTable(VISITS_TABLE_NAME)
+        else:
+            self.visits = visits_table
+
+        if users_table is None:
+            USERS_TABLE_NAME = os.environ["USERS_TABLE_NAME"]
+            self.users = aws_clients.LazyTable(USERS_TABLE_NAME)
+        else:
+            self.users = users_table
+
+        if target is None:
+            self.target = target_from_env()
+        else:
+            self.target = target
+
+    def deserialize(self, image):
+        return {key: self.deserializer.deserialize(value)
+                for key, value in image.items()}
+
+    def source_table_name(self, record):
+        """
+        Stream ARNs look like
+        arn:aws:dynamodb:<region>:<account>:table/<table-name>/stream/<label>
+        """
+        return record['eventSourceARN'].split(':table/')[1].split('/')[0]
+
+    def write(self, visits, users, run_id):
+        visits_partitions = Partitions('visits', VISIT_COLUMNS)
+        for visit in visits:
+            visits_partitions.add(utc_day(visit['visit_time']), visit)
+
+        users_partitions = Partitions('users', USER_COLUMNS)
+        for user in users:
+            users_partitions.add(utc_day(user['register_time']), user)
+
+        visits_partitions.write(self.target, run_id)
+        users_partitions.write(self.target, run_id)
+
+        exported = {'visits': sum(visits_partitions.rows.values()),
+                    'users': sum(users_partitions.rows.values())}
+        self.logger.info('exported %s as part %s to %s',
+                         exported, run_id, self.target)
+        return exported
+
+    def handle_stream_event(self, event, context):
+        """
+        Export the visits and users inserted or modified in a stream batch.
+        Items removed by their TTL stay in the export. Returns the number of
+        rows written per table.
+        """
+        records = event.get('Records', [])
+        visits, users = [], []
+        for record in records:
+            if record['eventName'] not in ('INSERT', 'MODIFY'):
+                continue
+            item = self.deserialize(record['dynamodb']['NewImage'])
+            if self.source_table_name(record) == self.users.name:
+                users.append(item)
+            else:
+                visits.append(item)
+
+        if not records:
+            return {'visits': 0, 'users': 0}
+        return self.write(visits, users, records[0]['dynamodb']['SequenceNumber'])
+
+    def export_all(self, now=None):
+        """
+        Export both tables whole. Returns the number of rows written per
+        table.
+        """
+        now = int(now if now is not None else time.time())
+        return self.write(
+            ParallelScanner(self.visits, total_segments=self.scan_segments).items(),
+            ParallelScanner(self.users, total_segments=self.scan_segments).items(),
+            f'full-{now}')
+
+
+analytics_export_function = AnalyticsExportFunction(None, None, None)
+
+
+@instrumented('analytics_export')
+def handler(event, context):
+    # Triggered by the visits and users table streams, or by hand with no
+    # records to export everything
+    if event and event.get('Records'):
+        return analytics_export_function.handle_stream_event(event, context)
+    return analytics_export_function.export_all()
@@ -0,0 +1,105 @@
+""" Cold-start benchmark for the lambda handlers
+
+    Each lambda builds its handler object when its module is imported, which
+    happens during the lambda's init phase. This starts a fresh interpreter
+    per sample (so nothing is cached between runs) and measures, for every
+    lambda:
+
+        boto3   - importing boto3 itself, which every lambda pays
+        init    - importing the handler module, including building the
+                  handler object
+        clients - building the shared dynamodb resource the first request
+                  will need, which the handlers now defer
+
+    No AWS calls are made, so it needs neither credentials nor moto.
+
+    This is not collected by pytest. Run it from this directory:
+
+        python bench_cold_start.py [--samples N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+LAMBDA_CODE = os.path.dirname(os.path.abspath(__file__))
+
+HANDLER_MODULES = [
+    'log_visit.log_visit',
+    'register_user.register_user',
+    'quiz.quiz',
+    'legacy_backfill.legacy_backfill',
+    'email_sender.email_sender',
+    'visit_counts.visit_counts',
+    'visit_history.visit_history',
+    'analytics_export.analytics_export',
+]
+
+LAMBDA_ENV = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'ORIGINAL_TABLE_NAME': 'original',
+    'USERS_TABLE_NAME': 'users',
+    'VISITS_TABLE_NAME': 'visits',
+    'QUIZ_LIST_TABLE_NAME': 'quiz_list',
+    'QUIZ_PROGRESS_TABLE_NAME': 'quiz_progress',
+    'VISIT_COUNTS_TABLE_NAME': 'visit_counts',
+    'IDEMPOTENCY_TABLE_NAME': 'idempotency',
+    'EXPORT_BUCKET': 'analytics',
+    'DOMAIN_NAME': 'https://visit.cumaker.space',
+}
+
+# Runs in the child interpreter. The lambda's own directory and the layer are
+# on the path, the same as in AWS.
+MEASURE = '''
+import json, sys, time
+sys.path[:0] = [{handler_dir!r}, {layer_dir!r}]
+start = time.perf_counter()
+import boto3
+boto3_done = time.perf_counter()
+import {module}
+init_done = time.perf_counter()
+from lambda_utils import aws_clients
+aws_clients.resource('dynamodb')
+clients_done = time.perf_counter()
+print(json.dumps({{
+    'boto3': boto3_done - start,
+    'init': init_done - boto3_done,
+    'clients': clients_done - init_done,
+}}))
+'''
+
+
+def sample(module):
+    handler_dir, name = module.split('.')
+    code = MEASURE.format(
+        handler_dir=os.path.join(LAMBDA_CODE, handler_dir),
+        layer_dir=os.path.join(LAMBDA_CODE, 'layer', 'python'),
+        module=name)
+    env = dict(os.environ, **LAMBDA_ENV)
+    output = subprocess.run([sys.executable, '-c', code], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=5,
+                        help='fresh interpreters to start per lambda')
+    args = parser.parse_args()
+
+    print(f'{"lambda":>32} {"boto3 ms":>9} {"init ms":>8} {"clients ms":>11}')
+    for module in HANDLER_MODULES:
+        samples = [sample(module) for _ in range(args.samples)]
+        medians = {phase: statistics.median(s[phase] for s in samples) * 1000
+                   for phase in ('boto3', 'init', 'clients')}
+        print(f'{module:>32} {medians["boto3"]:>9.1f} '
+              f'{medians["init"]:>8.1f} {medians["clients"]:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+""" Latency benchmark for LogVisitFunction.handle_log_visit_request
+
+    Compares p50/p95 sign-in latency for registered and unregistered users
+    between the old strictly sequential flow (registration lookup, then the
+    SES email, then the visit write) and the current handler, which looks up
+    the registration while writing the visit, caches registration lookups
+    and leaves the email to the email_sender lambda's queue.
+
+    moto answers in-process in well under a millisecond, which would hide
+    the effect of overlapping calls, so every AWS call is delayed by
+    --latency-ms to stand in for the network round trip.
+
+    This is not collected by pytest. Run it from this directory:
+
+        python bench_log_visit.py [--requests N] [--latency-ms MS]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# the shared layer is on the lambda's path in AWS
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'layer', 'python'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('ORIGINAL_TABLE_NAME', 'original')
+os.environ.setdefault('USERS_TABLE_NAME', 'users')
+os.environ.setdefault('VISITS_TABLE_NAME', 'visits')
+os.environ.setdefault('DOMAIN_NAME', 'https://visit.cumaker.space')
+
+import json  # noqa: E402
+from boto3.dynamodb.conditions import Key  # noqa: E402
+from moto import mock_dynamodb2, mock_ses  # noqa: E402
+
+from test_utils.email_queue import InMemoryEmailQueue  # noqa: E402
+from log_visit.log_visit import LogVisitFunction  # noqa: E402
+from test_utils.test_functions import *  # noqa: E402,F401,F403
+
+REGISTERED_USER = 'registered1'
+
+
+def add_latency(latency_seconds, *clients):
+    """
+    Sleep before every API call made through the given clients.
+    """
+    def sleep(**kwargs):
+        time.sleep(latency_seconds)
+
+    for client in clients:
+        client.meta.events.register('before-call.*.*', sleep)
+
+
+def sequential_log_visit(log_visit_function, request):
+    """
+    The flow the handler had before the lookup and the write overlapped,
+    querying the users table on every sign-in.
+    """
+    body = json.loads(request['body'])
+    username = body['username']
+    users_response = log_visit_function.users.query(
+        KeyConditionExpression=Key('username').eq(username))
+    if users_response['Count'] == 0:
+        log_visit_function.registrationWorkflow(username)
+    log_visit_function.addVisitEntry(
+        username, body.get('location'), body.get('tool'), '')
+
+
+def concurrent_log_visit(log_visit_function, request):
+    log_visit_function.handle_log_visit_request(request, None)
+
+
+def percentile(samples, pct):
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def measure(log_visit, log_visit_function, username, requests):
+    request = {'body': json.dumps({'username': username,
+                                   'location': 'Watt', 'tool': 'Visiting'})}
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        log_visit(log_visit_function, request)
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentile(samples, 50), percentile(samples, 95)
+
+
+@mock_dynamodb2
+@mock_ses
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50,
+                        help='sign-ins to time per scenario')
+    parser.add_argument('--latency-ms', type=float, default=20,
+                        help='simulated round trip added to every AWS call')
+    args = parser.parse_args()
+
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    users_table.put_item(Item={'username': REGISTERED_USER})
+    ses_client = create_ses_client()
+    ses_client.verify_email_identity(
+        EmailAddress='no-reply@visit.cumaker.space')
+
+    add_latency(args.latency_ms / 1000, original_table.meta.client,
+                visits_table.meta.client, users_table.meta.client, ses_client)
+
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, ses_client,
+        email_queue=InMemoryEmailQueue())
+
+    print(f'{"user":>12} {"flow":>10} {"p50 ms":>8} {"p95 ms":>8}')
+    for label, username in [('registered', REGISTERED_USER),
+                            ('unregistered', 'unregistered1')]:
+        for flow, log_visit in [('sequential', sequential_log_visit),
+                                ('concurrent', concurrent_log_visit)]:
+            p50, p95 = measure(log_visit, log_visit_function,
+                               username, args.requests)
+            print(f'{label:>12} {flow:>10} {p50:>8.1f} {p95:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
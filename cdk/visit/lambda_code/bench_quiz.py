@@ -0,0 +1,128 @@
+""" Benchmark for QuizFunction.get_quiz_progress
+
+    Measures the number of DynamoDB round trips and the wall time of a
+    `GET /quiz/{username}` against moto-backed tables for a growing quiz
+    catalog. The old per-quiz lookup is kept here as `legacy_get_quiz_progress`
+    so the two can be compared side by side.
+
+    This is not collected by pytest. Run it from this directory:
+
+        python bench_quiz.py [--repeat N]
+"""
+import argparse
+import os
+import sys
+import time
+
+# the shared layer is on the lambda's path in AWS
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'layer', 'python'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('QUIZ_LIST_TABLE_NAME', 'quiz_list')
+os.environ.setdefault('QUIZ_PROGRESS_TABLE_NAME', 'quiz_progress')
+os.environ.setdefault('DOMAIN_NAME', 'https://visit.cumaker.space')
+
+from boto3.dynamodb.conditions import Key  # noqa: E402
+from moto import mock_dynamodb2  # noqa: E402
+
+from quiz.quiz import QuizFunction  # noqa: E402
+from test_utils.test_functions import *  # noqa: E402,F401,F403
+
+CATALOG_SIZES = [5, 50, 500]
+USERNAME = 'bench_user'
+
+
+class RoundTripCounter():
+    """
+    Counts the DynamoDB API calls made through one or more boto3 clients.
+    """
+
+    def __init__(self, *clients):
+        self.count = 0
+        for client in clients:
+            client.meta.events.register('before-call.dynamodb.*', self._count)
+
+    def _count(self, **kwargs):
+        self.count += 1
+
+
+def legacy_get_quiz_progress(quiz_function, username):
+    """
+    The original N+1 implementation: scan the catalog, then query
+    quiz_progress once per quiz.
+    """
+    all_quizzes = quiz_function.quiz_list.scan()['Items']
+    progress = []
+    for quiz in all_quizzes:
+        response = quiz_function.quiz_progress.query(
+            KeyConditionExpression=Key('username').eq(
+                username) & Key('quiz_id').eq(quiz['quiz_id'])
+        )
+        state = int(response['Items'][0]['state']
+                    ) if response['Items'] else -1
+        progress.append({'quiz_id': quiz['quiz_id'], 'state': state})
+    return progress
+
+
+def seed(quiz_list_table, quiz_progress_table, catalog_size):
+    with quiz_list_table.batch_writer() as batch:
+        for i in range(catalog_size):
+            batch.put_item(Item={'quiz_id': f'quiz{i}'})
+
+    # the user has taken roughly half of the quizzes
+    with quiz_progress_table.batch_writer() as batch:
+        for i in range(0, catalog_size, 2):
+            batch.put_item(Item={'username': USERNAME,
+                                 'quiz_id': f'quiz{i}',
+                                 'state': i % 4 // 2})
+
+
+def measure(get_progress, quiz_function, counter, repeat):
+    counter.count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = get_progress(quiz_function, USERNAME)
+    elapsed = (time.perf_counter() - start) / repeat
+    return result, counter.count // repeat, elapsed
+
+
+@mock_dynamodb2
+def run_catalog(catalog_size, repeat):
+    client = create_dynamodb_client()
+    quiz_list_table = create_test_quiz_list_table(client)
+    quiz_progress_table = create_test_quiz_progress_table(client)
+    seed(quiz_list_table, quiz_progress_table, catalog_size)
+
+    quiz_function = QuizFunction(quiz_list_table, quiz_progress_table, client)
+    counter = RoundTripCounter(quiz_list_table.meta.client,
+                               quiz_progress_table.meta.client)
+
+    legacy, legacy_calls, legacy_time = measure(
+        legacy_get_quiz_progress, quiz_function, counter, repeat)
+    batched, batched_calls, batched_time = measure(
+        QuizFunction.get_quiz_progress, quiz_function, counter, repeat)
+
+    assert sorted(legacy, key=lambda q: q['quiz_id']) == sorted(
+        batched, key=lambda q: q['quiz_id'])
+
+    print(f'{catalog_size:>8} {"legacy":>8} {legacy_calls:>12} {legacy_time * 1000:>10.1f}')
+    print(f'{catalog_size:>8} {"batched":>8} {batched_calls:>12} {batched_time * 1000:>10.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of requests to average over')
+    args = parser.parse_args()
+
+    print(f'{"quizzes":>8} {"mode":>8} {"round trips":>12} {"ms/request":>10}')
+    for catalog_size in CATALOG_SIZES:
+        run_catalog(catalog_size, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
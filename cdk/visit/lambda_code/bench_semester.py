@@ -0,0 +1,427 @@
+""" Load test replaying a synthetic semester of kiosk traffic
+
+    Builds a semester of sign-ins, registrations and quiz submissions and
+    replays it through LogVisitFunction, RegisterUserFunction and
+    QuizFunction in this process, from --workers threads at once, against
+    moto or a local DynamoDB (--endpoint-url, e.g. DynamoDB Local).
+
+    The traffic follows the kiosks:
+
+    - locations and their tools come from the visitor console's
+      constants.ts, with most visits at Watt and 'Visiting' the most common
+      tool (the console does not say how popular each one is, so the
+      weights below are guesses)
+    - most sign-ins land in the few minutes before a class starts, on the
+      Monday/Wednesday/Friday and Tuesday/Thursday class schedules, and the
+      rest are spread over the day
+    - a user who is not registered yet registers a few minutes after their
+      first visit, and some visits to a tool are followed by its quiz and a
+      look at the user's quiz progress
+
+    The semester is replayed --speedup times faster than real time, with
+    quiet stretches cut to at most --max-idle seconds, so a burst before
+    class reaches the handlers as a burst. Latency is measured from when a
+    request was due, so it includes time spent waiting for a free worker.
+
+    moto answers in-process in well under a millisecond, so every AWS call
+    is delayed by --latency-ms to stand in for the network round trip.
+    moto is not thread safe, so it handles one call at a time; with
+    LEGACY_WRITE_MODE=sync each visit is a transaction, which moto rolls
+    back by copying every table, so that mode is best measured against
+    DynamoDB Local. Visits are written as in Beta and Prod unless
+    LEGACY_WRITE_MODE is set.
+
+    This is not collected by pytest. Run it from this directory:
+
+        python bench_semester.py [--visits N] [--workers N] [--latency-ms MS]
+"""
+import argparse
+import os
+import queue
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# the shared layer is on the lambda's path in AWS
+sys.path.insert(0, os.path.join(HERE, 'layer', 'python'))
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('ORIGINAL_TABLE_NAME', 'original')
+os.environ.setdefault('USERS_TABLE_NAME', 'users')
+os.environ.setdefault('VISITS_TABLE_NAME', 'visits')
+os.environ.setdefault('QUIZ_LIST_TABLE_NAME', 'quiz_list')
+os.environ.setdefault('QUIZ_PROGRESS_TABLE_NAME', 'quiz_progress')
+os.environ.setdefault('DOMAIN_NAME', 'https://visit.cumaker.space')
+# as in Beta and Prod, where the back-fill lambda writes the legacy table
+os.environ.setdefault('LEGACY_WRITE_MODE', 'async')
+
+import json  # noqa: E402
+import boto3  # noqa: E402
+from moto import mock_dynamodb2  # noqa: E402
+
+from test_utils.email_queue import InMemoryEmailQueue  # noqa: E402
+from log_visit.log_visit import LogVisitFunction  # noqa: E402
+from quiz.quiz import QuizFunction  # noqa: E402
+from register_user.register_user import RegisterUserFunction  # noqa: E402
+
+CONSTANTS_TS = os.path.join(HERE, '..', '..', '..', 'site', 'visitor-console',
+                            'src', 'library', 'constants.ts')
+
+# how likely a visit is to be at each location, by name
+LOCATION_WEIGHTS = {
+    'Watt Family Innovation Center': 6,
+    'Cooper Library': 3,
+    'Cook Laboratory': 1,
+}
+# 'Visiting' is this many times as likely as any one tool
+VISITING_WEIGHT = 4
+# tools without a quiz
+NO_QUIZ_TOOLS = {'Visiting', 'Part Pickup', 'Hand Tools'}
+
+# class start times, in minutes after midnight
+MWF_CLASSES = [8 * 60 + 0, 9 * 60 + 5, 10 * 60 + 10, 11 * 60 + 15,
+               12 * 60 + 20, 13 * 60 + 25, 14 * 60 + 30, 15 * 60 + 35]
+TR_CLASSES = [8 * 60 + 0, 9 * 60 + 30, 11 * 60 + 0, 12 * 60 + 30,
+              14 * 60 + 0, 15 * 60 + 30, 17 * 60 + 0]
+OPEN, CLOSE = 8 * 60, 20 * 60
+# the share of sign-ins in the rush before a class
+BURST_SHARE = 0.7
+
+QUIZ_SHARE = 0.1
+DAY = 86400
+
+# the table names match the environment set above
+TABLES = {
+    'original': ([('PK', 'S', 'HASH'), ('SK', 'S', 'RANGE')], None),
+    'users': ([('username', 'S', 'HASH')], None),
+    'visits': ([('username', 'S', 'HASH'), ('visit_time', 'N', 'RANGE')],
+               ('visits_by_day', [('day_bucket', 'S', 'HASH'), ('visit_time', 'N', 'RANGE')])),
+    'quiz_list': ([('quiz_id', 'S', 'HASH')], None),
+    'quiz_progress': ([('username', 'S', 'HASH'), ('quiz_id', 'S', 'RANGE')], None),
+}
+
+
+def string_array(source, name):
+    match = re.search(rf'export const {name}\b[^=]*=\s*\[(.*?)\];', source, re.S)
+    return re.findall(r'"([^"]*)"', match.group(1))
+
+
+def read_constants(path):
+    """
+    The locations, with their tools, and the registration form's choices
+    from the visitor console's constants.ts.
+    """
+    with open(path) as f:
+        source = f.read()
+
+    block = re.search(r'export const locations\b.*?=\s*\[(.*?)\n\];', source, re.S).group(1)
+    locations = {
+        name: re.findall(r'"([^"]*)"', tools)
+        for name, tools in re.findall(r'name:\s*"([^"]*)",\s*tools:\s*\[(.*?)\]', block, re.S)
+    }
+    return {
+        'locations': locations,
+        'genders': string_array(source, 'genders'),
+        'positions': string_array(source, 'userPosition'),
+        'semesters': string_array(source, 'gradsemesters'),
+        'majors': string_array(source, 'majors'),
+        'minors': string_array(source, 'minors'),
+    }
+
+
+def quiz_id(tool):
+    return re.sub(r'[^A-Za-z0-9]', '', tool.title())
+
+
+def sign_in_time(rng, day):
+    """
+    A sign-in time on day, in seconds since the semester started.
+    """
+    weekday = day % 7
+    classes = MWF_CLASSES if weekday in (0, 2, 4) else TR_CLASSES
+    if rng.random() < BURST_SHARE:
+        # students arrive in the quarter hour before class
+        minute = rng.choice(classes) - abs(rng.gauss(0, 5))
+    else:
+        minute = rng.uniform(OPEN, CLOSE)
+    return day * DAY + int(minute * 60) + rng.randrange(60)
+
+
+def build_semester(constants, args):
+    """
+    (due, endpoint, request) for every request of the semester, in order.
+    """
+    rng = random.Random(args.seed)
+    locations = list(constants['locations'])
+    location_weights = [LOCATION_WEIGHTS.get(name, 1) for name in locations]
+    users = [f'user{i:05d}' for i in range(args.users)]
+    registered = set(users[:int(args.users * args.registered)])
+
+    # class days only, Monday to Friday
+    days = [day for day in range(args.weeks * 7) if day % 7 < 5]
+
+    requests = []
+    for _ in range(args.visits):
+        due = sign_in_time(rng, rng.choice(days))
+        username = rng.choice(users)
+        location = rng.choices(locations, location_weights)[0]
+        tools = constants['locations'][location]
+        tool = rng.choices(tools, [VISITING_WEIGHT if t == 'Visiting' else 1 for t in tools])[0]
+        requests.append((due, 'POST /visit', {'body': json.dumps(
+            {'username': username, 'location': location, 'tool': tool})}))
+
+        if tool not in NO_QUIZ_TOOLS and rng.random() < QUIZ_SHARE:
+            total = 10
+            score = total if rng.random() < 0.7 else rng.randrange(5, total)
+            requests.append((due + rng.randrange(300, 1800), 'POST /quiz', {
+                'httpMethod': 'POST',
+                'body': json.dumps({'quiz_id': quiz_id(tool), 'username': username,
+                                    'email': f'{username}@clemson.edu',
+                                    'score': f'{score} / {total}'})}))
+            requests.append((due + rng.randrange(1800, 3600), 'GET /quiz/{username}', {
+                'httpMethod': 'GET', 'pathParameters': {'username': username}}))
+
+    # unregistered users register after their first visit's email arrives
+    for due, endpoint, request in sorted(requests, key=lambda r: r[0]):
+        username = json.loads(request.get('body') or '{}').get('username')
+        if endpoint != 'POST /visit' or username in registered:
+            continue
+        registered.add(username)
+        requests.append((due + rng.randrange(120, 900), 'POST /register', {
+            'body': json.dumps({
+                'username': username,
+                'firstName': 'Load', 'lastName': 'Test',
+                'Gender': rng.choice(constants['genders']),
+                'DOB': f'{rng.randrange(1995, 2006)}-0{rng.randrange(1, 10)}-1{rng.randrange(0, 10)}',
+                'UserPosition': rng.choice(constants['positions']),
+                'GradSemester': rng.choice(constants['semesters']),
+                'GradYear': str(rng.randrange(2024, 2031)),
+                'Major': rng.sample(constants['majors'], 1),
+                'Minor': rng.sample(constants['minors'], rng.randrange(0, 2)),
+            })}))
+
+    requests.sort(key=lambda r: r[0])
+    return requests, users[:int(args.users * args.registered)]
+
+
+def create_tables(resource):
+    tables = {}
+    for name, (key_schema, index) in TABLES.items():
+        attributes = dict((attr, kind) for attr, kind, _ in key_schema)
+        kwargs = {
+            'TableName': name,
+            'KeySchema': [{'AttributeName': attr, 'KeyType': key} for attr, _, key in key_schema],
+            'BillingMode': 'PAY_PER_REQUEST',
+        }
+        if index is not None:
+            index_name, index_schema = index
+            attributes.update((attr, kind) for attr, kind, _ in index_schema)
+            kwargs['GlobalSecondaryIndexes'] = [{
+                'IndexName': index_name,
+                'KeySchema': [{'AttributeName': attr, 'KeyType': key} for attr, _, key in index_schema],
+                'Projection': {'ProjectionType': 'ALL'},
+            }]
+        kwargs['AttributeDefinitions'] = [
+            {'AttributeName': attr, 'AttributeType': kind} for attr, kind in attributes.items()]
+        tables[name] = resource.create_table(**kwargs)
+        tables[name].wait_until_exists()
+    return tables
+
+
+def add_latency(latency_seconds, client):
+    """
+    Sleep before every API call made through client.
+    """
+    def sleep(**kwargs):
+        time.sleep(latency_seconds)
+
+    client.meta.events.register('before-call.*.*', sleep)
+
+
+def serialize_moto(lock, client):
+    """
+    moto keeps its tables in plain dicts and copies whole tables to roll
+    back a TransactWriteItems, which is not safe while other threads write
+    to them, so let moto handle one call at a time. The lock is held only
+    while moto handles the call, not for the simulated round trip.
+    """
+    def acquire(**kwargs):
+        lock.acquire()
+
+    def release(**kwargs):
+        lock.release()
+
+    # moto answers in before-send, and response-received follows every
+    # attempt, whether it failed or not
+    client.meta.events.register_first('before-send.dynamodb', acquire)
+    client.meta.events.register('response-received.dynamodb', release)
+
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+class Replay():
+    """
+    Hands each request to the workers when it is due, and records how long
+    each one took.
+    """
+
+    def __init__(self, handlers, workers, speedup, max_idle):
+        self.handlers = handlers
+        self.workers = workers
+        self.speedup = speedup
+        self.max_idle = max_idle
+        self.queue = queue.Queue(maxsize=workers * 4)
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.waits = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_kinds = defaultdict(int)
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            due_at, endpoint, request = job
+            started = time.perf_counter()
+            kind = None
+            try:
+                response = self.handlers[endpoint](request, None)
+                if response.get('statusCode', 200) >= 400:
+                    kind = f'HTTP {response["statusCode"]}'
+            except Exception as e:
+                kind = type(e).__name__
+                if hasattr(e, 'response'):
+                    kind = e.response['Error']['Code']
+            finished = time.perf_counter()
+            with self.lock:
+                if kind is not None:
+                    self.error_kinds[f'{endpoint}: {kind}'] += 1
+                self.latencies[endpoint].append((finished - due_at) * 1000)
+                self.waits[endpoint].append(max(0.0, started - due_at) * 1000)
+                self.errors[endpoint] += kind is not None
+
+    def run(self, requests):
+        threads = [threading.Thread(target=self.work) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        started = time.perf_counter()
+        clock = started
+        previous_due = requests[0][0] if requests else 0
+        for due, endpoint, request in requests:
+            # semester seconds become replay seconds, with long quiet
+            # stretches cut short
+            clock += min((due - previous_due) / self.speedup, self.max_idle)
+            previous_due = due
+            delay = clock - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.queue.put((clock, endpoint, request))
+
+        for _ in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--visits', type=int, default=3000,
+                        help='sign-ins in the semester')
+    parser.add_argument('--users', type=int, default=1500,
+                        help='distinct visitors')
+    parser.add_argument('--registered', type=float, default=0.7,
+                        help='share of visitors registered before the semester')
+    parser.add_argument('--weeks', type=int, default=15,
+                        help='weeks in the semester')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='requests handled at once')
+    parser.add_argument('--speedup', type=float, default=3600,
+                        help='how much faster than real time to replay')
+    parser.add_argument('--max-idle', type=float, default=0.02,
+                        help='longest pause, in seconds, between requests')
+    parser.add_argument('--latency-ms', type=float, default=10,
+                        help='simulated round trip added to every AWS call')
+    parser.add_argument('--endpoint-url',
+                        help='a local DynamoDB to use instead of moto')
+    parser.add_argument('--constants', default=CONSTANTS_TS,
+                        help="path to the visitor console's constants.ts")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    constants = read_constants(args.constants)
+    requests, registered_users = build_semester(constants, args)
+
+    mock = None
+    if args.endpoint_url is None:
+        mock = mock_dynamodb2()
+        mock.start()
+    try:
+        resource = boto3.resource('dynamodb', endpoint_url=args.endpoint_url)
+        # register_user writes with the low-level client's typed values
+        client = boto3.client('dynamodb', endpoint_url=args.endpoint_url)
+        tables = create_tables(resource)
+        with tables['users'].batch_writer() as batch:
+            for username in registered_users:
+                batch.put_item(Item={'username': username})
+        if mock is not None:
+            lock = threading.Lock()
+            serialize_moto(lock, resource.meta.client)
+            serialize_moto(lock, client)
+        add_latency(args.latency_ms / 1000, resource.meta.client)
+        add_latency(args.latency_ms / 1000, client)
+
+        log_visit_function = LogVisitFunction(
+            tables['original'], tables['visits'], tables['users'], None,
+            email_queue=InMemoryEmailQueue())
+        register_user_function = RegisterUserFunction(
+            tables['original'], tables['users'], client)
+        quiz_function = QuizFunction(
+            tables['quiz_list'], tables['quiz_progress'], client)
+        handlers = {
+            'POST /visit': log_visit_function.handle_log_visit_request,
+            'POST /register': register_user_function.handle_register_user_request,
+            'POST /quiz': quiz_function.handle_quiz_request,
+            'GET /quiz/{username}': quiz_function.handle_quiz_request,
+        }
+
+        replay = Replay(handlers, args.workers, args.speedup, args.max_idle)
+        elapsed = replay.run(requests)
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    print(f'{len(requests)} requests from {args.workers} workers in {elapsed:.1f} s, '
+          f'{len(requests) / elapsed:.1f} requests/s')
+    print(f'{"endpoint":>22} {"requests":>9} {"errors":>7} {"req/s":>7} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"wait p95":>9}')
+    for endpoint in handlers:
+        latencies = replay.latencies[endpoint]
+        if not latencies:
+            continue
+        print(f'{endpoint:>22} {len(latencies):>9} {replay.errors[endpoint]:>7} '
+              f'{len(latencies) / elapsed:>7.1f} '
+              f'{percentile(latencies, 50):>8.1f} {percentile(latencies, 95):>8.1f} '
+              f'{percentile(latencies, 99):>8.1f} '
+              f'{percentile(replay.waits[endpoint], 95):>9.1f}')
+    for kind, count in sorted(replay.error_kinds.items()):
+        print(f'{count:>6} x {kind}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# In AWS the shared layer is unpacked to /opt/python, which is on the
+# lambda's path. Put the same directory on the path for the tests.
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'layer', 'python'))
@@ -0,0 +1,60 @@
+import json
+import logging
+
+from lambda_utils import aws_clients
+from lambda_utils.instrumentation import instrumented
+from lambda_utils.registration_email import registration_email_sender_from_env
+
+
+class EmailSenderFunction():
+    """
+    Sends the registration emails log_visit puts on the email queue.
+
+    SQS hands this lambda up to a batch of messages at a time. Who was
+    recently emailed is recorded in the email sends table, so every
+    container skips the same repeats.
+
+    Messages that could not be sent are returned as batchItemFailures, so
+    SQS retries just those, and moves them to the dead letter queue once
+    they have failed too often.
+
+    As with the other lambdas, the SES client and sender can be passed in so
+    this can be tested with moto.
+    """
+
+    def __init__(self, ses_client, sender=None):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.INFO)
+
+        if ses_client is None:
+            ses_client = aws_clients.LazyClient('ses')
+
+        if sender is None:
+            self.sender = registration_email_sender_from_env(ses_client)
+        else:
+            self.sender = sender
+
+    def handle_queue_event(self, event, context):
+        records = event.get('Records', [])
+        failures = []
+        sent = 0
+        for record in records:
+            try:
+                sent += self.sender.send(json.loads(record['body'])['username'])
+            except Exception:
+                self.logger.exception(
+                    'could not send the email for message %s', record.get('messageId'))
+                failures.append({'itemIdentifier': record['messageId']})
+
+        self.logger.info('sent %d of %d registration emails, %d failed (%d skipped so far)',
+                         sent, len(records), len(failures), self.sender.skipped)
+        return {'batchItemFailures': failures}
+
+
+email_sender_function = EmailSenderFunction(None)
+
+
+@instrumented('email_sender')
+def handler(event, context):
+    # Triggered by batches from the registration email queue
+    return email_sender_function.handle_queue_event(event, context)
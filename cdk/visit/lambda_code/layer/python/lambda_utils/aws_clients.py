@@ -0,0 +1,102 @@
+""" One set of boto3 clients per process, built on first use
+
+    Building a boto3 client or resource loads and parses the service model
+    and sets up a connection pool, which is a noticeable part of a lambda's
+    cold start. Every lambda used to build its own for every table at import
+    time. These helpers build each client once per process, the first time
+    something actually needs it, and share it after that.
+
+    Every call they make is timed for the invocation's metrics line (see
+    lambda_utils.instrumentation).
+
+    All of them use CONFIG, which keeps timeouts short enough for an API
+    Gateway request, retries with the standard retry mode and keeps enough
+    pooled connections for the lambdas' thread pools.
+"""
+import threading
+
+import boto3
+from botocore.config import Config
+
+from lambda_utils.instrumentation import instrument_client
+
+config_options = {
+    'connect_timeout': 2,
+    'read_timeout': 5,
+    'max_pool_connections': 16,
+    'retries': {
+        'mode': 'standard',
+        'max_attempts': 3,
+    },
+}
+# keep idle pooled connections alive while the container is frozen, on
+# botocore versions that support it
+if 'tcp_keepalive' in Config.OPTION_DEFAULTS:
+    config_options['tcp_keepalive'] = True
+
+CONFIG = Config(**config_options)
+
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+
+
+def client(service_name):
+    """
+    The shared low-level client for service_name.
+    """
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = instrument_client(
+                boto3.client(service_name, config=CONFIG))
+        return _clients[service_name]
+
+
+def resource(service_name):
+    """
+    The shared resource for service_name.
+    """
+    with _lock:
+        if service_name not in _resources:
+            _resources[service_name] = boto3.resource(
+                service_name, config=CONFIG)
+            instrument_client(_resources[service_name].meta.client)
+        return _resources[service_name]
+
+
+def table(table_name):
+    """
+    A Table from the shared dynamodb resource. Tables themselves are cheap,
+    the expensive part is the resource behind them.
+    """
+    return resource('dynamodb').Table(table_name)
+
+
+class LazyClient():
+    """
+    Stands in for the shared client for service_name and only builds it
+    when one of its methods is first used, for clients that some requests
+    never touch.
+    """
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(client(self.service_name), name)
+
+
+class LazyTable():
+    """
+    Stands in for a dynamodb Table and only builds the shared resource when
+    the table is first used.
+    """
+
+    def __init__(self, table_name):
+        self.name = table_name
+        self._table = None
+
+    def __getattr__(self, name):
+        if self._table is None:
+            self._table = table(self.name)
+        return getattr(self._table, name)
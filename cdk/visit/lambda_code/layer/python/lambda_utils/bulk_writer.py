@@ -0,0 +1,170 @@
+""" Bulk loading into DynamoDB with BatchWriteItem
+
+    BulkWriter is for jobs that write many items to one table, like the
+    migration script and back-fills, where one put_item per item would mean
+    one round trip per item.
+
+    Example:
+
+        with BulkWriter(client, 'visits', threads=4) as writer:
+            for item in items:
+                writer.put(item)
+        print(writer.stats())
+
+    Items are in whatever format `client` expects: a plain dynamodb client
+    takes typed attribute values ({'S': 'jmdanie234'}), while the client of a
+    boto3 Table resource (`table.meta.client`) takes plain python values.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# the most puts a single BatchWriteItem call accepts
+MAX_BATCH_SIZE = 25
+
+
+class BulkWriteError(Exception):
+    pass
+
+
+class BulkWriter():
+    """
+    Groups puts into 25 item BatchWriteItem calls, sent from `threads` writer
+    threads at once. Items DynamoDB returns as UnprocessedItems (usually
+    because of throttling) are resent with exponential backoff and full
+    jitter, up to `max_attempts` calls per batch.
+
+    BatchWriteItem rejects a batch that has two puts for the same key, so if
+    `key_names` is given, a later put for the same key replaces the earlier
+    one in the batch being built.
+    """
+
+    def __init__(self, client, table_name, threads=4, key_names=None,
+                 max_attempts=8, base_delay=0.05, max_delay=5.0):
+        self.logger = logging.getLogger()
+        self.client = client
+        self.table_name = table_name
+        self.key_names = key_names
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # bounds how many batches wait on the executor, and so memory use
+        self.in_flight = threading.BoundedSemaphore(threads * 2)
+        self.futures = []
+        self.batch = {}
+        self.lock = threading.Lock()
+
+        self.written = 0
+        self.calls = 0
+        self.retries = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def batch_key(self, item):
+        if self.key_names is None:
+            return len(self.batch)
+        return json.dumps([item[name] for name in self.key_names],
+                          sort_keys=True, default=str)
+
+    def put(self, item):
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        self.batch[self.batch_key(item)] = item
+        if len(self.batch) == MAX_BATCH_SIZE:
+            self.submit()
+
+    def submit(self):
+        if not self.batch:
+            return
+        items = list(self.batch.values())
+        self.batch = {}
+        self.in_flight.acquire()
+        future = self.executor.submit(self.write_batch, items)
+        future.add_done_callback(lambda _: self.in_flight.release())
+        self.futures.append(future)
+        self.reap()
+
+    def reap(self):
+        """
+        Drop finished batches, raising the first one that failed.
+        """
+        pending = []
+        for future in self.futures:
+            if future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def write_batch(self, items):
+        requests = [{'PutRequest': {'Item': item}} for item in items]
+        for attempt in range(self.max_attempts):
+            if attempt:
+                time.sleep(self.backoff(attempt))
+                with self.lock:
+                    self.retries += 1
+
+            response = self.client.batch_write_item(
+                RequestItems={self.table_name: requests})
+            unprocessed = response.get(
+                'UnprocessedItems', {}).get(self.table_name, [])
+
+            with self.lock:
+                self.calls += 1
+                self.written += len(requests) - len(unprocessed)
+
+            if not unprocessed:
+                return
+            requests = unprocessed
+
+        raise BulkWriteError(
+            f'{len(requests)} items for {self.table_name} were still '
+            f'unprocessed after {self.max_attempts} attempts')
+
+    def flush(self):
+        """
+        Send any partly filled batch and wait for every batch to finish.
+        """
+        self.submit()
+        futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+        self.finished_at = time.perf_counter()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True)
+
+    def rows_per_second(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return {
+            'table': self.table_name,
+            'written': self.written,
+            'calls': self.calls,
+            'retries': self.retries,
+            'rows_per_second': round(self.rows_per_second(), 1),
+        }
@@ -0,0 +1,170 @@
+""" DynamoDB helpers shared by the lambdas and scripts
+"""
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+def item_exists(table, key):
+    """
+    true if table has an item with the given primary key.
+
+    This is a GetItem projected onto the key attributes, so DynamoDB only
+    returns (and we only deserialize) the key rather than the whole item. The
+    read capacity the lookup consumed is logged so the cost can be checked.
+
+    Args:
+        table: a boto3 dynamodb Table resource
+        key: the full primary key, e.g. {'username': 'jmdanie234'}
+    """
+    names = {f'#k{i}': attribute for i, attribute in enumerate(key)}
+
+    response = table.get_item(
+        Key=key,
+        ProjectionExpression=', '.join(names),
+        ExpressionAttributeNames=names,
+        ReturnConsumedCapacity='TOTAL',
+    )
+
+    consumed = response.get('ConsumedCapacity', {})
+    logger.info('GetItem %s consumed %s read capacity units',
+                consumed.get('TableName', table.name),
+                consumed.get('CapacityUnits'))
+
+    return 'Item' in response
+
+
+# the most keys a single BatchGetItem call accepts
+MAX_BATCH_GET_SIZE = 100
+
+
+def existing_keys(table, keys, max_attempts=5):
+    """
+    The keys that table has an item for, out of keys, looked up with
+    BatchGetItem 100 at a time. Like item_exists, only the key attributes
+    are read back.
+
+    Args:
+        table: a boto3 dynamodb Table resource
+        keys: full primary keys, e.g. [{'username': 'jmdanie234'}, ...],
+            with no repeats, which BatchGetItem rejects
+    """
+    found = []
+    if not keys:
+        return found
+
+    names = {f'#k{i}': attribute for i, attribute in enumerate(keys[0])}
+    for start in range(0, len(keys), MAX_BATCH_GET_SIZE):
+        request_items = {table.name: {
+            'Keys': keys[start:start + MAX_BATCH_GET_SIZE],
+            'ProjectionExpression': ', '.join(names),
+            'ExpressionAttributeNames': names,
+        }}
+        for attempt in range(max_attempts):
+            if attempt:
+                time.sleep(0.05 * 2 ** attempt)
+            # the table resource's client accepts plain python values
+            response = table.meta.client.batch_get_item(
+                RequestItems=request_items)
+            found.extend(response['Responses'].get(table.name, []))
+            request_items = response.get('UnprocessedKeys')
+            if not request_items:
+                break
+        else:
+            raise Exception(
+                f'keys of {table.name} were still unprocessed after '
+                f'{max_attempts} attempts')
+    return found
+
+
+class ParallelScanner():
+    """
+    Reads a whole table with a parallel scan, yielding items as they arrive.
+
+    The table is split into `total_segments` segments (the Segment /
+    TotalSegments scan parameters), each read page by page on its own thread,
+    following LastEvaluatedKey until the segment is exhausted. At most a few
+    pages per segment are held in memory at once, so scanning a large table
+    does not mean loading it.
+
+    `cursors` maps each segment to the LastEvaluatedKey of the last page whose
+    items have all been yielded, or DONE once the segment is finished. Passing
+    a saved copy back in as `start_keys` resumes the scan from there.
+    `completed` counts the items behind those cursors.
+
+    Example:
+
+        for item in ParallelScanner(table, total_segments=8).items():
+            ...
+    """
+
+    DONE = 'DONE'
+
+    def __init__(self, table, total_segments=4, start_keys=None, **scan_kwargs):
+        self.table = table
+        self.total_segments = total_segments
+        self.scan_kwargs = scan_kwargs
+        self.cursors = dict(start_keys or {})
+        self.completed = 0
+        self.pages = queue.Queue(maxsize=total_segments * 2)
+        self.stop = threading.Event()
+
+    def put(self, message):
+        # give up if the consumer went away rather than blocking forever
+        while not self.stop.is_set():
+            try:
+                self.pages.put(message, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def scan_segment(self, segment):
+        try:
+            kwargs = dict(self.scan_kwargs)
+            if self.total_segments > 1:
+                kwargs['Segment'] = segment
+                kwargs['TotalSegments'] = self.total_segments
+            start_key = self.cursors.get(segment)
+            if start_key is not None:
+                kwargs['ExclusiveStartKey'] = start_key
+
+            while not self.stop.is_set():
+                response = self.table.scan(**kwargs)
+                last_key = response.get('LastEvaluatedKey')
+                self.put(('page', segment, response['Items'], last_key))
+                if last_key is None:
+                    return
+                kwargs['ExclusiveStartKey'] = last_key
+        except Exception as e:
+            self.put(('error', segment, e, None))
+
+    def items(self):
+        pending = {segment for segment in range(self.total_segments)
+                   if self.cursors.get(segment) != self.DONE}
+        threads = [threading.Thread(target=self.scan_segment, args=(segment,),
+                                    daemon=True)
+                   for segment in pending]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while pending:
+                kind, segment, payload, last_key = self.pages.get()
+                if kind == 'error':
+                    raise payload
+
+                yield from payload
+                self.completed += len(payload)
+
+                if last_key is None:
+                    self.cursors[segment] = self.DONE
+                    pending.discard(segment)
+                else:
+                    self.cursors[segment] = last_key
+        finally:
+            self.stop.set()
+            for thread in threads:
+                thread.join()
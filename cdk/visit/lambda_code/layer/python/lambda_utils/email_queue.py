@@ -0,0 +1,35 @@
+""" The queue for handing work from a request lambda to a background lambda
+
+    A queue has one method, send(message), which enqueues a json
+    serializable message. SqsEmailQueue is what runs in AWS; the email
+    sender lambda is subscribed to the queue, so nothing here receives.
+"""
+import json
+import os
+
+from lambda_utils import aws_clients
+
+
+class SqsEmailQueue():
+
+    def __init__(self, queue_url, sqs_client=None):
+        self.queue_url = queue_url
+        if sqs_client is None:
+            self.client = aws_clients.LazyClient('sqs')
+        else:
+            self.client = sqs_client
+
+    def send(self, message):
+        self.client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(message))
+
+
+def email_queue_from_env():
+    """
+    The SQS queue named by EMAIL_QUEUE_URL, or None when it is not set.
+    """
+    queue_url = os.environ.get('EMAIL_QUEUE_URL')
+    if not queue_url:
+        return None
+    return SqsEmailQueue(queue_url)
@@ -0,0 +1,207 @@
+""" Idempotency-Key support for the POST endpoints
+
+    A client that times out cannot tell whether its request was handled, so
+    it sends it again, and the visit or registration is written twice. A
+    client that sends an `Idempotency-Key` header with a POST gets the first
+    response back for every retry with the same key, without the request
+    being handled again.
+
+    Each key has one item in the idempotency table:
+
+        {'idempotency_key': 'visit#3f2a...', 'fingerprint': '<sha256>',
+         'status': 'COMPLETED', 'response': '{"statusCode": 200, ...}',
+         'expires_at': 1700086400}
+
+    The first request claims the key with a conditional put, so of two
+    copies arriving together exactly one is handled. The other gets a 409
+    and can retry once the first has finished. Reusing a key for a
+    different request body is a 422. Keys expire through the table's TTL.
+
+    Example:
+
+        return idempotent(self.idempotency, 'visit', request, HEADERS,
+                          lambda: self.logVisit(request, HEADERS))
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from lambda_utils import aws_clients
+
+HEADER = 'idempotency-key'
+
+IN_PROGRESS = 'IN_PROGRESS'
+COMPLETED = 'COMPLETED'
+
+# keys can be at most this long, so a key is never most of an item
+MAX_KEY_LENGTH = 255
+
+logger = logging.getLogger()
+
+
+def idempotency_key(request):
+    """
+    The request's Idempotency-Key header, or None. Header names are case
+    insensitive.
+    """
+    for name, value in (request.get('headers') or {}).items():
+        if name.lower() == HEADER:
+            return value or None
+    return None
+
+
+def fingerprint(request):
+    """
+    A hash of what makes two requests the same request.
+    """
+    parts = [request.get('httpMethod') or '', request.get('resource') or '',
+             request.get('body') or '']
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore():
+    """
+    Records the response to each idempotency key in a DynamoDB table.
+
+    `ttl_seconds` is how long a retry gets the stored response. A key still
+    in progress after `in_progress_seconds` is taken to belong to a lambda
+    that died, and the next retry handles the request again.
+    """
+
+    def __init__(self, table, ttl_seconds=86400, in_progress_seconds=30,
+                 clock=time.time):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.in_progress_seconds = in_progress_seconds
+        self.clock = clock
+
+    def claim(self, key, request_fingerprint):
+        """
+        Claim key for this request. Returns None if the request should be
+        handled, and otherwise the stored item of the earlier request.
+        """
+        now = int(self.clock())
+        try:
+            self.table.put_item(
+                Item={
+                    'idempotency_key': key,
+                    'fingerprint': request_fingerprint,
+                    'status': IN_PROGRESS,
+                    'locked_until': now + self.in_progress_seconds,
+                    'expires_at': now + self.ttl_seconds,
+                },
+                # TTL deletes lazily, so an expired item can still be there
+                ConditionExpression='attribute_not_exists(idempotency_key) '
+                                    'OR expires_at < :now '
+                                    'OR (#status = :in_progress AND locked_until < :now)',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':now': now, ':in_progress': IN_PROGRESS},
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        item = self.table.get_item(
+            Key={'idempotency_key': key}, ConsistentRead=True).get('Item')
+        if item is None:
+            # expired and deleted in between, so claim it again
+            return self.claim(key, request_fingerprint)
+        return item
+
+    def complete(self, key, response):
+        """
+        Store the response for retries. Headers are left out, they are
+        rebuilt on every request.
+        """
+        stored = {name: value for name, value in response.items()
+                  if name != 'headers'}
+        self.table.update_item(
+            Key={'idempotency_key': key},
+            UpdateExpression='SET #status = :completed, #response = :response',
+            ExpressionAttributeNames={
+                '#status': 'status', '#response': 'response'},
+            ExpressionAttributeValues={
+                ':completed': COMPLETED, ':response': json.dumps(stored)},
+        )
+
+    def release(self, key):
+        """
+        Let the next retry handle the request again.
+        """
+        self.table.delete_item(Key={'idempotency_key': key})
+
+    def run(self, scope, request, headers, handle):
+        """
+        The response to request, from handle() the first time a key is
+        seen and from the table after that. Requests without an
+        Idempotency-Key are simply handled.
+
+        Args:
+            scope: keeps the same key on two endpoints apart, e.g. 'visit'
+            headers: the endpoint's response headers
+            handle: handles the request and returns its response
+        """
+        key = idempotency_key(request)
+        if key is None:
+            return handle()
+
+        def error(status_code, message):
+            return {'headers': headers, 'statusCode': status_code,
+                    'body': json.dumps({'Message': message})}
+
+        if len(key) > MAX_KEY_LENGTH:
+            return error(400, f'Idempotency-Key is longer than {MAX_KEY_LENGTH} characters')
+
+        key = f'{scope}#{key}'
+        request_fingerprint = fingerprint(request)
+        item = self.claim(key, request_fingerprint)
+
+        if item is not None:
+            if item['fingerprint'] != request_fingerprint:
+                return error(422, 'Idempotency-Key was already used for a different request')
+            if item['status'] != COMPLETED:
+                return error(409, 'A request with this Idempotency-Key is in progress')
+            logger.info('replaying the response for %s', key)
+            return dict(json.loads(item['response']), headers=headers)
+
+        try:
+            response = handle()
+        except Exception:
+            self.release(key)
+            raise
+
+        # a server error may not happen again, so it is not replayed
+        if response.get('statusCode', 200) >= 500:
+            self.release(key)
+        else:
+            self.complete(key, response)
+        return response
+
+
+def idempotent(store, scope, request, headers, handle):
+    """
+    handle() the request, unless it is a retry of one already handled.
+    Without a store (no idempotency table) the request is simply handled.
+    """
+    if store is None:
+        return handle()
+    return store.run(scope, request, headers, handle)
+
+
+def idempotency_store_from_env():
+    """
+    The store on the table named by IDEMPOTENCY_TABLE_NAME, or None when it
+    is not set.
+    """
+    table_name = os.environ.get('IDEMPOTENCY_TABLE_NAME')
+    if not table_name:
+        return None
+    return IdempotencyStore(
+        aws_clients.LazyTable(table_name),
+        ttl_seconds=int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400')))
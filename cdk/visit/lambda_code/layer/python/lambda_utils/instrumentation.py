@@ -0,0 +1,237 @@
+""" One structured log line per lambda invocation
+
+    Decorating a handler with `instrumented` prints one JSON line per
+    invocation, in CloudWatch Embedded Metric Format (EMF). CloudWatch turns
+    the numbers in it into metrics, per function, without any extra API
+    calls, and the line stays searchable in Logs Insights.
+
+    Example:
+
+        @instrumented('log_visit')
+        def handler(request, context):
+            ...
+
+    prints something like
+
+        {"_aws": {...}, "Function": "log_visit", "ColdStart": 0,
+         "Duration": 41.2, "RequestBytes": 42, "ResponseBytes": 37,
+         "DynamoDBCalls": 2, "DynamoDBTime": 30.5, "DynamoDBCapacity": 3.0,
+         "SESCalls": 0, "SESTime": 0,
+         "calls": [{"service": "dynamodb", "operation": "TransactWriteItems",
+                    "ms": 24.1, "request_bytes": 512, "response_bytes": 2,
+                    "capacity": 2.0}, ...]}
+
+    Calls are timed with botocore event hooks on each client, which
+    aws_clients adds to every shared client, so the lambdas do not time their
+    own calls. DynamoDB calls are made to return their ConsumedCapacity.
+    Clients built elsewhere, like the moto clients in tests, can be hooked up
+    with `instrument_client`.
+
+    A lambda container handles one invocation at a time, so calls made from
+    any thread are counted towards the invocation in progress.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Makerspace')
+
+# the most calls listed on one line; the totals still count every call
+MAX_CALLS_LISTED = 50
+
+# operations that return ConsumedCapacity when asked for it
+CAPACITY_OPERATIONS = {
+    'GetItem', 'PutItem', 'UpdateItem', 'DeleteItem', 'Query', 'Scan',
+    'BatchGetItem', 'BatchWriteItem', 'TransactGetItems', 'TransactWriteItems',
+}
+
+# services with their own metrics, as (service id, metric prefix)
+SERVICES = [('dynamodb', 'DynamoDB'), ('ses', 'SES')]
+
+_lock = threading.Lock()
+_current = None
+_cold = True
+
+
+class Invocation():
+    """
+    What one invocation did, built up while it runs.
+    """
+
+    def __init__(self, function_name, cold_start):
+        self.function_name = function_name
+        self.cold_start = cold_start
+        self.started = time.perf_counter()
+        self.calls = []
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.properties = {}
+
+    def add_call(self, call):
+        with _lock:
+            self.calls.append(call)
+
+    def record(self):
+        """
+        The EMF log line for the invocation, as a dict.
+        """
+        metrics = ['Duration', 'RequestBytes', 'ResponseBytes']
+        record = {
+            'Function': self.function_name,
+            'ColdStart': int(self.cold_start),
+            'Duration': round((time.perf_counter() - self.started) * 1000, 2),
+            'RequestBytes': self.request_bytes,
+            'ResponseBytes': self.response_bytes,
+        }
+
+        for service, prefix in SERVICES:
+            calls = [call for call in self.calls if call['service'] == service]
+            record[f'{prefix}Calls'] = len(calls)
+            record[f'{prefix}Time'] = round(sum(call['ms'] for call in calls), 2)
+            metrics += [f'{prefix}Calls', f'{prefix}Time']
+        record['DynamoDBCapacity'] = sum(
+            call.get('capacity', 0) for call in self.calls)
+        metrics.append('DynamoDBCapacity')
+
+        units = {'Duration': 'Milliseconds', 'RequestBytes': 'Bytes',
+                 'ResponseBytes': 'Bytes', 'DynamoDBCapacity': 'Count'}
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [['Function']],
+                'Metrics': [
+                    {'Name': name, 'Unit': units.get(
+                        name, 'Milliseconds' if name.endswith('Time') else 'Count')}
+                    for name in metrics
+                ],
+            }],
+        }
+
+        record['calls'] = self.calls[:MAX_CALLS_LISTED]
+        record.update(self.properties)
+        return record
+
+
+def current_invocation():
+    return _current
+
+
+def capacity_units(consumed):
+    # a dict for single table calls, a list of them for batches
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(entry.get('CapacityUnits', 0) for entry in consumed or [])
+
+
+def _ask_for_capacity(params, model, **kwargs):
+    if model.name in CAPACITY_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+
+def _before_call(model, params, context, **kwargs):
+    body = params.get('body') or b''
+    context['instrumentation'] = {
+        'operation': model.name,
+        'started': time.perf_counter(),
+        'request_bytes': len(body),
+    }
+
+
+def _finish_call(service, context, call):
+    started = context.pop('instrumentation', None)
+    current = _current
+    if started is None or current is None:
+        return
+    call = dict({
+        'service': service,
+        'operation': started['operation'],
+        'ms': round((time.perf_counter() - started['started']) * 1000, 2),
+        'request_bytes': started['request_bytes'],
+    }, **call)
+    current.add_call(call)
+
+
+def instrument_client(client):
+    """
+    Time every call client makes. Returns client.
+    """
+    service = client.meta.service_model.service_id.hyphenize()
+    events = client.meta.events
+
+    def after_call(http_response, parsed, context, **kwargs):
+        call = {
+            'status': http_response.status_code,
+            'response_bytes': len(http_response.content or b''),
+        }
+        if 'ConsumedCapacity' in parsed:
+            call['capacity'] = capacity_units(parsed['ConsumedCapacity'])
+        _finish_call(service, context, call)
+
+    def after_call_error(exception, context, **kwargs):
+        _finish_call(service, context, {'error': type(exception).__name__})
+
+    if service == 'dynamodb':
+        events.register('provide-client-params.dynamodb', _ask_for_capacity)
+    events.register('before-call', _before_call)
+    events.register('after-call', after_call)
+    events.register('after-call-error', after_call_error)
+    return client
+
+
+def payload_size(payload):
+    """
+    The size of an API Gateway request or response body, or of the whole
+    event for other triggers.
+    """
+    if payload is None:
+        return 0
+    if isinstance(payload, dict) and 'body' in payload:
+        return len((payload['body'] or '').encode('utf-8'))
+    return len(json.dumps(payload, default=str).encode('utf-8'))
+
+
+@contextmanager
+def invocation(function_name):
+    """
+    Records the invocation of function_name run inside the block, and prints
+    its line at the end, even if the block raises.
+
+        with invocation('email_sender') as record:
+            record.properties['sent'] = sent
+    """
+    global _current, _cold
+    with _lock:
+        record = Invocation(function_name, _cold)
+        _cold = False
+        _current = record
+
+    try:
+        yield record
+    except Exception as e:
+        record.properties['error'] = type(e).__name__
+        raise
+    finally:
+        with _lock:
+            _current = None
+        print(json.dumps(record.record(), default=str), flush=True)
+
+
+def instrumented(function_name):
+    """
+    Decorates a lambda handler(event, context) to print one line per
+    invocation (see invocation).
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            with invocation(function_name) as record:
+                record.request_bytes = payload_size(event)
+                response = handler(event, context)
+                record.response_bytes = payload_size(response)
+                return response
+        return wrapper
+    return decorate
@@ -0,0 +1,163 @@
+""" Building and sending the registration reminder email
+
+    log_visit asks for this email whenever someone who has not registered
+    signs in. RegistrationEmailSender sends those requests, skipping anyone
+    who was already emailed within the dedupe window so a student who signs
+    in five times in a day gets one email.
+"""
+import os
+import re
+import time
+
+from botocore.exceptions import ClientError
+
+from lambda_utils import aws_clients
+
+# This address must be verified with Amazon SES.
+SENDER = "no-reply@visit.cumaker.space"
+SUBJECT = "Clemson University Makerspace Registration"
+# The character encoding for the email.
+CHARSET = "UTF-8"
+
+EMAIL_REGEX = re.compile(r"[^@]+@[^@]+\.[^@]+")
+
+
+def registration_email_address(username):
+    """
+    Clemson usernames are sent to their @clemson.edu address, anything that
+    already looks like an email address is used as is.
+    """
+    if not EMAIL_REGEX.match(username):
+        return username + "@clemson.edu"
+    return username
+
+
+# This code was written following the example from:
+# https://docs.aws.amazon.com/ses/latest/DeveloperGuide/send-using-sdk-python.html
+def send_registration_email(ses_client, username):
+    recipient = registration_email_address(username)
+
+    body_text = ("Hello " + recipient + ",\n"
+                 "Our records indicate that you have not registered as an existing user.\n"
+                 "Please go to visit.cumaker.space/register to register as an existing user.\n"
+                 )
+
+    # One could consider using a configuration set here.
+    # To learn more about them please visit:
+    # https://docs.aws.amazon.com/ses/latest/DeveloperGuide/using-configuration-sets.html
+    return ses_client.send_email(
+        Destination={
+            'ToAddresses': [
+                recipient,
+            ],
+        },
+        Message={
+            'Body': {
+                'Text': {
+                    'Charset': CHARSET,
+                    'Data': body_text,
+                },
+            },
+            'Subject': {
+                'Charset': CHARSET,
+                'Data': SUBJECT,
+            },
+        },
+        ReplyToAddresses=["makerspace@clemson.edu"],
+        Source=SENDER,
+    )
+
+
+class RegistrationEmailSender():
+    """
+    Sends registration emails, at most one per recipient per
+    `dedupe_window_seconds`.
+
+    Who was emailed is recorded in `sends_table`, one item per recipient:
+
+        {'recipient': 'jmdanie234@clemson.edu', 'sent_at': 1700000000,
+         'expires_at': 1700086400}
+
+    A send is claimed with a conditional put before SES is called, so when
+    two containers get the same recipient only one of them sends, and the
+    table's TTL clears out old items. A failed send gives its claim back, so
+    a retry can send it.
+
+    Without a table the record lives in memory, and lasts as long as the
+    container that owns the sender.
+    """
+
+    def __init__(self, ses_client, dedupe_window_seconds, sends_table=None,
+                 clock=time.time):
+        self.client = ses_client
+        self.dedupe_window_seconds = dedupe_window_seconds
+        self.sends_table = sends_table
+        self.clock = clock
+        self.last_sent = {}
+        self.sent = 0
+        self.skipped = 0
+
+    def claim(self, recipient, now):
+        """
+        Record that recipient is being emailed now. False if they were
+        already emailed within the window.
+        """
+        if self.sends_table is None:
+            sent_at = self.last_sent.get(recipient)
+            if sent_at is not None and now - sent_at < self.dedupe_window_seconds:
+                return False
+            self.last_sent[recipient] = now
+            return True
+
+        try:
+            self.sends_table.put_item(
+                Item={
+                    'recipient': recipient,
+                    'sent_at': int(now),
+                    'expires_at': int(now) + self.dedupe_window_seconds,
+                },
+                # TTL deletes lazily, so an expired item can still be there
+                ConditionExpression='attribute_not_exists(recipient) OR expires_at <= :now',
+                ExpressionAttributeValues={':now': int(now)})
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+        return True
+
+    def release(self, recipient):
+        if self.sends_table is None:
+            self.last_sent.pop(recipient, None)
+        else:
+            self.sends_table.delete_item(Key={'recipient': recipient})
+
+    def send(self, username):
+        """
+        Email username unless they were emailed within the window. Returns
+        whether an email was sent; a failed send raises ClientError.
+        """
+        recipient = registration_email_address(username)
+        if not self.claim(recipient, self.clock()):
+            self.skipped += 1
+            return False
+
+        try:
+            send_registration_email(self.client, recipient)
+        except Exception:
+            self.release(recipient)
+            raise
+
+        self.sent += 1
+        return True
+
+
+def registration_email_sender_from_env(ses_client):
+    """
+    The sender, with its window from EMAIL_DEDUPE_WINDOW_SECONDS and its
+    record in the table named by EMAIL_SENDS_TABLE_NAME, if that is set.
+    """
+    table_name = os.environ.get('EMAIL_SENDS_TABLE_NAME')
+    return RegistrationEmailSender(
+        ses_client,
+        int(os.environ.get('EMAIL_DEDUPE_WINDOW_SECONDS', '86400')),
+        aws_clients.LazyTable(table_name) if table_name else None)
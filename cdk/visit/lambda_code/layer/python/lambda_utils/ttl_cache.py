@@ -0,0 +1,68 @@
+""" A small in-memory cache for warm lambda containers
+
+    Anything kept at module level in a lambda survives between invocations
+    of the same container. TTLCache bounds how much is kept (least recently
+    used entries are evicted first) and how long each entry is trusted, and
+    counts hits, misses, expirations and evictions so they can be logged.
+"""
+import collections
+import threading
+import time
+
+
+class TTLCache():
+
+    def __init__(self, max_size, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns (True, value) for a live entry, (False, None) otherwise.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            value, expires_at = entry
+            if self.clock() >= expires_at:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value, ttl_seconds):
+        with self.lock:
+            self.entries[key] = (value, self.clock() + ttl_seconds)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expirations': self.expirations,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,72 @@
+""" Visit counts per (location, day, hour, tool)
+
+    The visit counts table holds one counter per location, local day, local
+    hour and tool, kept up to date by the visit counts lambda as visits are
+    written. Answering "how many visits per location per day" then reads a
+    few counters per day instead of every visit.
+
+    Items look like
+
+        {'location': 'Watt', 'bucket': '2022-04-11#15#Laser Cutter',
+         'day': '2022-04-11', 'hour': 15, 'tool': 'Laser Cutter',
+         'visit_count': 12}
+
+    so a range of days at one location is a single query on the bucket.
+"""
+import datetime
+from collections import Counter
+
+from boto3.dynamodb.conditions import Key
+
+# stands in for a visit that has no location or tool
+UNKNOWN = 'unknown'
+
+
+def counter_key(visit, timezone):
+    """
+    The counter a visit (an item of the visits table) is counted in.
+
+    Args:
+        visit: has at least visit_time, in seconds since epoch
+        timezone: a tzinfo; days and hours are local to it
+    """
+    visit_time = datetime.datetime.fromtimestamp(
+        int(visit['visit_time']), tz=timezone)
+    day = visit_time.strftime('%Y-%m-%d')
+    tool = visit.get('tool') or UNKNOWN
+    return {
+        'location': visit.get('location') or UNKNOWN,
+        'bucket': f'{day}#{visit_time.hour:02d}#{tool}',
+        'day': day,
+        'hour': visit_time.hour,
+        'tool': tool,
+    }
+
+
+def query_counts(table, location, first_day, last_day):
+    """
+    Every counter at location from first_day to last_day (YYYY-MM-DD),
+    inclusive.
+    """
+    kwargs = {
+        'KeyConditionExpression': Key('location').eq(location) & Key('bucket').between(
+            f'{first_day}#', f'{last_day}#\uffff'),
+    }
+    counts = []
+    while True:
+        response = table.query(**kwargs)
+        counts.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return counts
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def totals(counts, attribute):
+    """
+    Sum counters by one of day, hour or tool, e.g.
+    totals(query_counts(...), 'day') -> {'2022-04-11': 40, ...}
+    """
+    summed = Counter()
+    for count in counts:
+        summed[count[attribute]] += int(count['visit_count'])
+    return dict(summed)
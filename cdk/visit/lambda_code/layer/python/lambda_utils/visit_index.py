@@ -0,0 +1,246 @@
+""" Time range queries on the visits table
+
+    The visits table is keyed on username, so it cannot answer "every visit
+    between T1 and T2" without a scan. Every visit is also written with a
+    `day_bucket` attribute, the partition key of the visits_by_day index,
+    whose sort key is visit_time.
+
+    A busy day would put all of its writes on one index partition, so each
+    day is split into SHARDS buckets, `{YYYY-MM-DD}#{shard}` (UTC day), with
+    the shard picked from the username. query_visits reads every bucket of
+    every day in the range in parallel and merges them back into time order.
+    query_page does the same a page at a time, for callers that cannot hold
+    the whole range in memory.
+
+    Example:
+
+        visits = query_visits(visits_table, start, end, location='Cooper')
+
+    SHARDS can not change without rewriting the day_bucket of every visit,
+    since queries would miss the buckets written with the old count.
+
+    visits_by_day is a sparse index: visits written before day_bucket was
+    added are not in it, and no query finds them until backfill_day_buckets
+    has given them one (see migration_scripts/backfill_day_buckets.py).
+"""
+import datetime
+import heapq
+import itertools
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from functools import lru_cache
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from lambda_utils.bulk_writer import BulkWriter
+from lambda_utils.dynamodb import ParallelScanner
+
+INDEX_NAME = 'visits_by_day'
+SHARDS = 4
+
+DAY = datetime.timedelta(days=1)
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def utc_day(visit_time):
+    return EPOCH + int(float(visit_time) // 86400) * DAY
+
+
+@lru_cache(maxsize=1024)
+def day_name(days_after_epoch):
+    return (EPOCH + days_after_epoch * DAY).isoformat()
+
+
+def day_bucket(username, visit_time, shards=SHARDS):
+    """
+    The day_bucket of a visit. The shard comes from a stable hash of the
+    username, so writing the same visit twice always picks the same bucket.
+    """
+    shard = zlib.crc32(username.encode('utf-8')) % shards
+    # a UTC day is always 86400 seconds, so the migration can bucket
+    # millions of visits without building a date for each
+    return f'{day_name(int(float(visit_time) // 86400))}#{shard}'
+
+
+def day_buckets(start, end, shards=SHARDS):
+    """
+    Every bucket that can hold a visit from start to end (seconds since
+    epoch, inclusive).
+    """
+    day, last_day = utc_day(start), utc_day(end)
+    buckets = []
+    while day <= last_day:
+        buckets.extend(f'{day.isoformat()}#{shard}' for shard in range(shards))
+        day += DAY
+    return buckets
+
+
+def query_bucket(table, bucket, start, end, location=None):
+    """
+    The visits in one bucket from start to end, in time order.
+    """
+    kwargs = {
+        'IndexName': INDEX_NAME,
+        'KeyConditionExpression': Key('day_bucket').eq(bucket) & Key('visit_time').between(start, end),
+    }
+    if location is not None:
+        kwargs['FilterExpression'] = Attr('location').eq(location)
+
+    visits = []
+    while True:
+        response = table.query(**kwargs)
+        visits.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return visits
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def query_visits(table, start, end, location=None, shards=SHARDS, max_workers=8):
+    """
+    Every visit from start to end (seconds since epoch, inclusive), oldest
+    first, optionally only those at location.
+    """
+    buckets = day_buckets(start, end, shards)
+    if not buckets:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(buckets))) as executor:
+        results = executor.map(
+            lambda bucket: query_bucket(table, bucket, start, end, location),
+            buckets)
+        return list(heapq.merge(*results, key=lambda visit: visit['visit_time']))
+
+
+def bucket_page(table, bucket, start, end, location, limit, start_key):
+    """
+    Up to limit visits of one bucket from start to end, in time order,
+    beginning after the index key start_key.
+    """
+    kwargs = {
+        'IndexName': INDEX_NAME,
+        'KeyConditionExpression': Key('day_bucket').eq(bucket) & Key('visit_time').between(start, end),
+        'Limit': limit,
+    }
+    if location is not None:
+        kwargs['FilterExpression'] = Attr('location').eq(location)
+    if start_key is not None:
+        kwargs['ExclusiveStartKey'] = start_key
+
+    visits = []
+    while len(visits) < limit:
+        response = table.query(**kwargs)
+        visits.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return visits[:limit]
+
+
+def index_key(visit):
+    """
+    The ExclusiveStartKey that continues an index query after visit.
+    """
+    return {name: visit[name] for name in ('day_bucket', 'visit_time', 'username')}
+
+
+def check_cursor(cursor, start, end, shards=SHARDS):
+    """
+    Raises ValueError unless cursor has the shape of one query_page returns
+    for start to end, so a cursor that was tampered with, or came from
+    another range, is never sent to DynamoDB.
+    """
+    if not isinstance(cursor, dict) or set(cursor) != {'day', 'after'}:
+        raise ValueError('cursor must have a day and an after')
+    if not isinstance(cursor['day'], str):
+        raise ValueError('cursor day must be a date')
+    day = datetime.date.fromisoformat(cursor['day'])
+    if not utc_day(start) <= day <= utc_day(end):
+        raise ValueError('cursor day is outside the range')
+
+    if not isinstance(cursor['after'], dict):
+        raise ValueError('cursor after must map buckets to keys')
+    buckets = {f'{day.isoformat()}#{shard}' for shard in range(shards)}
+    for bucket, key in cursor['after'].items():
+        if bucket not in buckets:
+            raise ValueError(f'cursor bucket {bucket!r} is not of its day')
+        if not (isinstance(key, dict) and
+                set(key) == {'day_bucket', 'visit_time', 'username'} and
+                key['day_bucket'] == bucket and
+                isinstance(key['username'], str) and
+                isinstance(key['visit_time'], (int, Decimal)) and
+                not isinstance(key['visit_time'], bool)):
+            raise ValueError(f'cursor key of {bucket!r} is not an index key')
+
+
+def query_page(table, start, end, location=None, limit=100, cursor=None,
+               shards=SHARDS, max_workers=8):
+    """
+    The next page of at most limit visits from start to end, oldest first.
+
+    Each bucket of a day is read only as far as the page needs, so a page
+    costs about limit items per shard however long the range is.
+
+    Returns:
+        (visits, cursor), where cursor is None after the last page, and
+        otherwise is passed back in to read the next page. It holds the day
+        being read and, for each of its shards, the index key of the last
+        visit returned from it. Cursors from callers should be checked with
+        check_cursor first.
+    """
+    cursor = cursor or {'day': utc_day(start).isoformat(), 'after': {}}
+    day = datetime.date.fromisoformat(cursor['day'])
+    after = dict(cursor['after'])
+    last_day = utc_day(end)
+
+    visits = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, shards)) as executor:
+        while day <= last_day:
+            needed = limit - len(visits)
+            buckets = [f'{day.isoformat()}#{shard}' for shard in range(shards)]
+            pages = list(executor.map(
+                lambda bucket: bucket_page(table, bucket, start, end, location,
+                                           needed, after.get(bucket)),
+                buckets))
+
+            # tag each visit with its bucket, to know where each shard got to
+            merged = heapq.merge(
+                *[[(bucket, visit) for visit in page]
+                  for bucket, page in zip(buckets, pages)],
+                key=lambda tagged: tagged[1]['visit_time'])
+            taken = list(itertools.islice(merged, needed))
+
+            for bucket, visit in taken:
+                visits.append(visit)
+                after[bucket] = index_key(visit)
+
+            if len(taken) == needed:
+                return visits, {'day': day.isoformat(), 'after': after}
+
+            # every shard of the day ran out before the page filled up
+            day += DAY
+            after = {}
+
+    return visits, None
+
+
+def backfill_day_buckets(table, total_segments=4, threads=4, shards=SHARDS):
+    """
+    Give every visit in table that has no day_bucket its bucket, so it is
+    found by time range queries.
+
+    Only visits without a day_bucket are read, so running it again after
+    an interruption picks up where it stopped. The visits are written back
+    whole, which the table's stream sees as a MODIFY of each.
+
+    Returns:
+        The number of visits written.
+    """
+    scanner = ParallelScanner(table, total_segments=total_segments,
+                              FilterExpression=Attr('day_bucket').not_exists())
+    # the table's client takes plain python values
+    with BulkWriter(table.meta.client, table.name, threads=threads,
+                    key_names=['username', 'visit_time']) as writer:
+        for visit in scanner.items():
+            writer.put(dict(visit, day_bucket=day_bucket(
+                visit['username'], visit['visit_time'], shards)))
+    return writer.written
@@ -0,0 +1,132 @@
+import datetime
+import logging
+import os
+
+from boto3.dynamodb.types import TypeDeserializer
+
+from lambda_utils import aws_clients
+from lambda_utils.bulk_writer import BulkWriter
+from lambda_utils.instrumentation import instrumented
+
+
+class LegacyBackfillFunction():
+    """
+    Copies new and updated visits and registrations into the old combined
+    table.
+
+    When a stage runs with LEGACY_WRITE_MODE=async, the log_visit and
+    register_user lambdas only write the visits and users tables. This lambda
+    is subscribed to the streams of those tables and writes the matching
+    PK/SK items to the original table, so anything still reading that table
+    keeps working without the request path paying for a second write.
+
+    Like the other lambdas, the tables can be passed in so it can be tested
+    with moto.
+    """
+
+    def __init__(self, original_table):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.INFO)
+
+        self.deserializer = TypeDeserializer()
+
+        self.VISITS_TABLE_NAME = os.environ["VISITS_TABLE_NAME"]
+        self.USERS_TABLE_NAME = os.environ["USERS_TABLE_NAME"]
+
+        if original_table is None:
+            ORIGINAL_TABLE_NAME = os.environ['ORIGINAL_TABLE_NAME']
+            self.original = aws_clients.LazyTable(ORIGINAL_TABLE_NAME)
+        else:
+            self.original = original_table
+
+    def deserialize(self, image):
+        return {key: self.deserializer.deserialize(value)
+                for key, value in image.items()}
+
+    def source_table_name(self, record):
+        """
+        Stream ARNs look like
+        arn:aws:dynamodb:<region>:<account>:table/<table-name>/stream/<label>
+        """
+        return record['eventSourceARN'].split(':table/')[1].split('/')[0]
+
+    def original_visit_item(self, visit):
+        """
+        The old table stores a visit as PK = visit time, SK = username,
+        the same layout log_visit wrote when it wrote both tables.
+        """
+        return {
+            'PK': str(visit['visit_time']),
+            'SK': visit['username'],
+            'tool': visit.get('tool') or ' ',
+            'location': visit.get('location') or ' ',
+            'last_updated': visit.get('last_updated', ''),
+        }
+
+    def original_user_item(self, user):
+        """
+        The old table stores a registration as PK = username,
+        SK = registration time, with the attribute names register_user
+        used for it.
+
+        The SK is str() of a naive UTC datetime, as register_user writes
+        it, which leaves out the microseconds when they are zero.
+        """
+        register_time = datetime.datetime.fromtimestamp(
+            int(user['register_time']), tz=datetime.timezone.utc)
+        return {
+            'PK': user['username'],
+            'SK': str(register_time.replace(tzinfo=None)),
+            'firstName': user.get('first_name', ' '),
+            'lastName': user.get('last_name', ' '),
+            'Gender': user.get('gender', ' '),
+            'DOB': user.get('date_of_birth', ' '),
+            'Position': user.get('position', ' '),
+            'GradSemester': user.get('grad_semester', ' '),
+            'GradYear': user.get('grad_year', ' '),
+            'Major': ', '.join(sorted(user.get('majors', []))),
+            'Minor': ', '.join(sorted(user.get('minors', []))),
+            'last_updated': user.get('last_updated', ''),
+        }
+
+    def handle_stream_event(self, event, context):
+        """
+        Write one original table item for every inserted or modified visit
+        or user in the stream batch, as sync mode would have written it.
+        A user who registers again is a MODIFY. Returns the number of items
+        written.
+        """
+        items = []
+        for record in event.get('Records', []):
+            if record['eventName'] not in ('INSERT', 'MODIFY'):
+                continue
+
+            new_image = self.deserialize(record['dynamodb']['NewImage'])
+            table_name = self.source_table_name(record)
+
+            if table_name == self.VISITS_TABLE_NAME:
+                items.append(self.original_visit_item(new_image))
+            elif table_name == self.USERS_TABLE_NAME:
+                items.append(self.original_user_item(new_image))
+            else:
+                self.logger.warning(
+                    'ignoring stream record from table %s', table_name)
+
+        # the table's own client takes plain python items
+        writer = BulkWriter(self.original.meta.client, self.original.name,
+                            threads=2, key_names=['PK', 'SK'])
+        with writer:
+            for item in items:
+                writer.put(item)
+
+        self.logger.info('back-filled legacy items: %s', writer.stats())
+        return len(items)
+
+
+legacy_backfill_function = LegacyBackfillFunction(None)
+
+
+@instrumented('legacy_backfill')
+def handler(event, context):
+    # Triggered by the visits and users table streams
+    return legacy_backfill_function.handle_stream_event(event, context)
@@ -1,5 +1,6 @@
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pydoc import cli
 import boto3
 from boto3.dynamodb.conditions import Key
@@ -10,6 +11,22 @@ import sys
 import os
 import re
 
+from lambda_utils import aws_clients
+from lambda_utils.bulk_writer import BulkWriteError, BulkWriter
+from lambda_utils.dynamodb import existing_keys, item_exists
+from lambda_utils.email_queue import email_queue_from_env
+from lambda_utils.idempotency import idempotent, idempotency_store_from_env
+from lambda_utils.instrumentation import instrumented
+from lambda_utils.registration_email import send_registration_email
+from lambda_utils.ttl_cache import TTLCache
+from lambda_utils.visit_index import day_bucket
+
+# the most visits one POST /visit/batch may carry
+MAX_BATCH_VISITS = 500
+
+# how far ahead of our clock a kiosk's visit_time may be
+MAX_CLOCK_SKEW_SECONDS = 300
+
 
 class LogVisitFunction():
     """
@@ -17,141 +34,380 @@ class LogVisitFunction():
     so we can more easily test with pytest.
     """
 
-    def __init__(self, original_table, visits_table, users_table, ses_client):
+    def __init__(self, original_table, visits_table, users_table, ses_client, email_queue=None, registration_cache=None, idempotency_store=None):
         self.logger = logging.getLogger()
         self.logger.setLevel(logging.INFO)
 
+        # Runs the registration lookup next to the visit write. Each task
+        # only touches its own table; the clients underneath are thread safe.
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+        # The shared clients are only built when a request first uses them
         if original_table is None:
-            dynamodb = boto3.resource('dynamodb')
             ORIGINAL_TABLE_NAME = os.environ['ORIGINAL_TABLE_NAME']
-            self.original = dynamodb.Table(ORIGINAL_TABLE_NAME)
+            self.original = aws_clients.LazyTable(ORIGINAL_TABLE_NAME)
         else:
             self.original = original_table
 
         if visits_table is None:
-            # Get the service resource.
-            dynamodb = boto3.resource('dynamodb')
-            # Get the table name.
             VISITS_TABLE_NAME = os.environ["VISITS_TABLE_NAME"]
-            # Get table objects
-            self.visits = dynamodb.Table(VISITS_TABLE_NAME)
+            self.visits = aws_clients.LazyTable(VISITS_TABLE_NAME)
         else:
             self.visits = visits_table
 
         if users_table is None:
-            # Get the service resource.
-            dynamodb = boto3.resource('dynamodb')
-            # Get the table name.
             USERS_TABLE_NAME = os.environ["USERS_TABLE_NAME"]
-            # Get table objects
-            self.users = dynamodb.Table(USERS_TABLE_NAME)
+            self.users = aws_clients.LazyTable(USERS_TABLE_NAME)
         else:
             self.users = users_table
 
         if ses_client is None:
-            AWS_REGION = os.environ['AWS_REGION']
-            self.client = boto3.client('ses', region_name=AWS_REGION)
+            # only used when there is no email queue
+            self.client = aws_clients.LazyClient('ses')
         else:
             self.client = ses_client
 
+        # Kiosks see the same people many times a day, so registration lookups
+        # are cached per container. A registration is almost never undone, so
+        # "registered" is trusted for much longer than "not registered", which
+        # has to notice a new registration quickly.
+        if registration_cache is None:
+            self.registration_cache = TTLCache(
+                int(os.environ.get('REGISTRATION_CACHE_SIZE', '2048')))
+        else:
+            self.registration_cache = registration_cache
+        self.registered_ttl = int(
+            os.environ.get('REGISTERED_TTL_SECONDS', '21600'))
+        self.not_registered_ttl = int(
+            os.environ.get('NOT_REGISTERED_TTL_SECONDS', '60'))
+
+        # Registration emails go on this queue for the email_sender lambda.
+        # Without a queue they are sent from the request.
+        if email_queue is None:
+            self.email_queue = email_queue_from_env()
+        else:
+            self.email_queue = email_queue
+
+        # Responses to requests with an Idempotency-Key, so a retried POST
+        # does not log the visit or send the email twice. Off without a table.
+        if idempotency_store is None:
+            self.idempotency = idempotency_store_from_env()
+        else:
+            self.idempotency = idempotency_store
+
+        # How visits reach the legacy single-table design. 'sync' writes it on
+        # every request, 'async' leaves it to the stream-driven back-fill
+        # lambda and 'off' stops writing it. Read once per container.
+        self.legacy_write_mode = os.environ.get('LEGACY_WRITE_MODE', 'sync')
+        if self.legacy_write_mode not in ('off', 'sync', 'async'):
+            raise ValueError(
+                f'Unknown LEGACY_WRITE_MODE: {self.legacy_write_mode}')
+
+        # 'transaction' writes both visit records atomically with
+        # TransactWriteItems, 'batch' falls back to a single BatchWriteItem
+        self.visit_write_mode = os.environ.get(
+            'VISIT_WRITE_MODE', 'transaction')
+        if self.visit_write_mode not in ('transaction', 'batch'):
+            raise ValueError(
+                f'Unknown VISIT_WRITE_MODE: {self.visit_write_mode}')
+
     def isUserRegistered(self, current_user):
         """
         true if the user has registered
         """
-        user_table_response = self.users.query(
-            KeyConditionExpression=Key('username').eq(current_user)
-        )
-        return user_table_response['Count'] != 0
-
-    # This code was written following the example from:
-    # https://docs.aws.amazon.com/ses/latest/DeveloperGuide/send-using-sdk-python.html
-    def registrationWorkflow(self, current_user):
-        # This address must be verified with Amazon SES.
-        SENDER = "no-reply@visit.cumaker.space"
+        cached, registered = self.registration_cache.get(current_user)
+        if cached:
+            return registered
 
-        email_regex = re.compile(r"[^@]+@[^@]+\.[^@]+")
-        if not email_regex.match(current_user):
-            current_user = current_user + "@clemson.edu"
+        registered = item_exists(self.users, {'username': current_user})
 
-        RECIPIENT = current_user
+        self.registration_cache.put(
+            current_user, registered,
+            self.registered_ttl if registered else self.not_registered_ttl)
+        return registered
 
-        # One could consider using a configuration set here.
-        # To learn more about them please visit:
-        # https://docs.aws.amazon.com/ses/latest/DeveloperGuide/using-configuration-sets.html
-
-        SUBJECT = "Clemson University Makerspace Registration"
-        BODY_TEXT = ("Hello " + current_user + ",\n"
-                     "Our records indicate that you have not registered as an existing user.\n"
-                     "Please go to visit.cumaker.space/register to register as an existing user.\n"
-                     )
-        # The character encoding for the email.
-        CHARSET = "UTF-8"
-        # Create a new SES resource and specify a region.
-
-        # Try to send the email.
+    def registrationWorkflow(self, current_user):
+        """
+        Email the user a link to the registration page.
+        """
         try:
-            response = self.client.send_email(
-                Destination={
-                    'ToAddresses': [
-                        RECIPIENT,
-                    ],
-                },
-                Message={
-                    'Body': {
-                        'Text': {
-                            'Charset': CHARSET,
-                            'Data': BODY_TEXT,
-                        },
-                    },
-                    'Subject': {
-                        'Charset': CHARSET,
-                        'Data': SUBJECT,
-                    },
-                },
-                ReplyToAddresses=["makerspace@clemson.edu"],
-                Source=SENDER,
-                # If we were using a configuration set we would need the following line.
-                # ConfigurationSetName=CONFIGURATION_SET,
-            )
+            send_registration_email(self.client, current_user)
 
         # Display an error if something goes wrong.
         except ClientError as e:
             self.logger.error(e.response['Error']['Message'])
 
-    def addVisitEntry(self, current_user, location, tool, last_updated):
+    def requestRegistrationEmail(self, current_user):
+        """
+        Queue the registration email for the email_sender lambda, which
+        batches the sends and drops repeats. Without a queue the email is
+        sent before the response: Lambda freezes the container once the
+        handler returns, so a send left running then could be lost.
+        """
+        if self.email_queue is not None:
+            self.email_queue.send({'username': current_user})
+        else:
+            self.registrationWorkflow(current_user)
 
-        timestamp = int(time.time())
+    def registeredUsers(self, usernames):
+        """
+        The subset of usernames that have registered. Cached answers are
+        used as they are, and the rest are looked up together.
+        """
+        registered = set()
+        uncached = []
+        for username in usernames:
+            cached, is_registered = self.registration_cache.get(username)
+            if not cached:
+                uncached.append(username)
+            elif is_registered:
+                registered.add(username)
+
+        found = {key['username'] for key in existing_keys(
+            self.users, [{'username': username} for username in uncached])}
+
+        for username in uncached:
+            is_registered = username in found
+            self.registration_cache.put(
+                username, is_registered,
+                self.registered_ttl if is_registered else self.not_registered_ttl)
+        return registered | found
+
+    def visitItems(self, current_user, location, tool, last_updated, timestamp):
+        """
+        The items recording one visit in the old combined table and in the
+        visits table.
+        """
 
         # record the visit in the old combined table
-        original_response = self.original.put_item(
-            Item={
-                'PK': str(timestamp),
-                'SK': current_user,
-                'tool': tool or ' ',
-                'location': location or ' ',
-                'last_updated': last_updated,
-            },
-        )
+        original_item = {
+            'PK': str(timestamp),
+            'SK': current_user,
+            'tool': tool or ' ',
+            'location': location or ' ',
+            'last_updated': last_updated,
+        }
 
         # record the visit in the visits table
-        visit_response = self.visits.put_item(
+        visit_item = {
             # PK / Partition Key = Visit Date
             # SK / Sort Key = Username or Email Address
+            'visit_time': timestamp,
+            'username': current_user,
+            'location': location,
+            'tool': tool,
+            'last_updated': last_updated,
+            # partition key of the visits_by_day index
+            'day_bucket': day_bucket(current_user, timestamp),
+        }
+
+        return original_item, visit_item
+
+    def addVisitEntry(self, current_user, location, tool, last_updated):
+        """
+        Record the visit in the visits table. When legacy writes are 'sync'
+        the old combined table is written in the same request, so there is
+        never a visit in one table but not the other.
+        """
+
+        timestamp = int(time.time())
+        original_item, visit_item = self.visitItems(
+            current_user, location, tool, last_updated, timestamp)
 
-            Item={
-                'visit_time': timestamp,
-                'username': current_user,
-                'location': location,
-                'tool': tool,
-                'last_updated': last_updated,
-            },
+        if self.legacy_write_mode != 'sync':
+            response = self.visits.put_item(Item=visit_item)
+        elif self.visit_write_mode == 'batch':
+            response = self.batchWriteVisit(original_item, visit_item)
+        else:
+            response = self.transactWriteVisit(original_item, visit_item)
+
+        return response['ResponseMetadata']['HTTPStatusCode']
+
+    def transactWriteVisit(self, original_item, visit_item):
+        """
+        Write both items in a single TransactWriteItems call. Either both
+        puts succeed or neither does; a cancelled transaction raises.
+        """
+        # the table resource's client accepts plain python values
+        return self.visits.meta.client.transact_write_items(
+            TransactItems=[
+                {'Put': {'TableName': self.original.name, 'Item': original_item}},
+                {'Put': {'TableName': self.visits.name, 'Item': visit_item}},
+            ]
         )
 
-        if original_response['ResponseMetadata']['HTTPStatusCode'] != visit_response['ResponseMetadata']['HTTPStatusCode']:
-            raise Exception(
-                "One of Original Table or Visit Table update failed.")
+    def batchWriteVisit(self, original_item, visit_item, max_attempts=5):
+        """
+        Write both items in a single BatchWriteItem call. This is cheaper than
+        a transaction but not atomic, so any UnprocessedItems are resent until
+        they are written or we run out of attempts.
+        """
+        request_items = {
+            self.original.name: [{'PutRequest': {'Item': original_item}}],
+            self.visits.name: [{'PutRequest': {'Item': visit_item}}],
+        }
+        for attempt in range(max_attempts):
+            response = self.visits.meta.client.batch_write_item(
+                RequestItems=request_items)
+            request_items = response.get('UnprocessedItems')
+            if not request_items:
+                return response
+            time.sleep(0.05 * 2 ** attempt)
+
+        raise Exception(
+            "One of Original Table or Visit Table update failed.")
+
+    def parseBatchVisit(self, visit, now):
+        """
+        (username, location, tool, last_updated, visit_time) of one visit of
+        a batch. Raises ValueError if the visit can not be logged.
+        """
+        if not isinstance(visit, dict):
+            raise ValueError('visit must be an object')
+
+        username = visit.get('username')
+        if not isinstance(username, str) or not username:
+            raise ValueError('Missing parameter: username')
+
+        # Queued visits keep the time they happened at the kiosk. There is
+        # no default: two visits of a user defaulted to the same second
+        # would have the same key, and one would overwrite the other.
+        if 'visit_time' not in visit:
+            raise ValueError('Missing parameter: visit_time')
+        visit_time = visit['visit_time']
+        if isinstance(visit_time, bool) or not isinstance(visit_time, int):
+            raise ValueError('visit_time must be seconds since epoch')
+        if visit_time <= 0 or visit_time > now + MAX_CLOCK_SKEW_SECONDS:
+            raise ValueError('visit_time is out of range')
+
+        return (username, visit.get('location'), visit.get('tool'),
+                visit.get('last_updated', ''), visit_time)
+
+    def logVisitBatch(self, visits):
+        """
+        Log a batch of visits. Returns one result per visit, in order.
 
-        return original_response['ResponseMetadata']['HTTPStatusCode']
+        Registration is looked up once per distinct username, and the items
+        are written with BatchWriteItem. The writes are puts keyed on the
+        username and visit time, so if the batch fails part way the kiosk
+        can send the whole batch again without logging anything twice.
+        """
+        now = int(time.time())
+        results = []
+        parsed = {}
+        for index, visit in enumerate(visits):
+            try:
+                parsed[index] = self.parseBatchVisit(visit, now)
+            except ValueError as e:
+                results.append(
+                    {'index': index, 'status': 'rejected', 'message': str(e)})
+                continue
+            results.append({'index': index, 'status': 'logged'})
+
+        usernames = list(dict.fromkeys(
+            visit[0] for visit in parsed.values()))
+        registered_future = self.executor.submit(
+            self.registeredUsers, usernames)
+
+        # the batch is written together, so legacy 'sync' writes are not
+        # transactional here; a retry rewrites both tables
+        client = self.visits.meta.client
+        visits_writer = BulkWriter(client, self.visits.name,
+                                   key_names=['username', 'visit_time'])
+        writers = [visits_writer]
+        original_writer = None
+        if self.legacy_write_mode == 'sync':
+            original_writer = BulkWriter(client, self.original.name,
+                                         key_names=['PK', 'SK'])
+            writers.append(original_writer)
+        # each writer is closed even if the other one fails to flush, so
+        # neither leaves its threads behind in the container
+        try:
+            try:
+                for username, location, tool, last_updated, visit_time in parsed.values():
+                    original_item, visit_item = self.visitItems(
+                        username, location, tool, last_updated, visit_time)
+                    visits_writer.put(visit_item)
+                    if original_writer is not None:
+                        original_writer.put(original_item)
+            finally:
+                visits_writer.close()
+        finally:
+            if original_writer is not None:
+                original_writer.close()
+
+        registered = registered_future.result()
+        for index, visit in parsed.items():
+            results[index]['was_user_registered'] = visit[0] in registered
+
+        for username in usernames:
+            if username not in registered:
+                self.requestRegistrationEmail(username)
+
+        self.logger.info('logged %d of %d visits, %s', len(parsed),
+                         len(visits), json.dumps([w.stats() for w in writers]))
+        return results
+
+    def handle_log_visit_batch_request(self, request, context):
+        """
+        Log visits a kiosk queued while it was offline, for
+        `POST /visit/batch`. The body is
+
+            {"visits": [{"username": ..., "location": ..., "tool": ...,
+                         "visit_time": ...}, ...]}
+
+        with at most MAX_BATCH_VISITS visits. visit_time is required, and is
+        when the visit happened, in seconds since epoch. Visits that can not be logged are
+        rejected without failing the rest.
+        """
+
+        HEADERS = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Headers': 'Content-Type,Idempotency-Key',
+            'Access-Control-Allow-Origin': os.environ["DOMAIN_NAME"],
+            'Access-Control-Allow-Methods': 'OPTIONS,POST'
+        }
+
+        def response(status_code, body):
+            return {
+                'headers': HEADERS,
+                'statusCode': status_code,
+                'body': json.dumps(body)
+            }
+
+        if (request is None):
+            return response(400, {'Message': 'No request provided'})
+
+        return idempotent(self.idempotency, 'visit_batch', request, HEADERS,
+                          lambda: self.logVisitBatchRequest(request, response))
+
+    def logVisitBatchRequest(self, request, response):
+        """
+        Log the visits in request and build the response.
+        """
+        try:
+            visits = json.loads(request.get('body') or '{}').get('visits')
+        except (ValueError, AttributeError):
+            return response(400, {'Message': 'Body must be a JSON object'})
+
+        if not isinstance(visits, list):
+            return response(400, {'Message': 'Missing parameter: visits'})
+        if len(visits) > MAX_BATCH_VISITS:
+            return response(400, {
+                'Message': f'At most {MAX_BATCH_VISITS} visits per batch'})
+
+        try:
+            results = self.logVisitBatch(visits)
+        except (BulkWriteError, ClientError) as e:
+            # nothing tells which visits were written, so the kiosk should
+            # send the batch again later
+            self.logger.error('visit batch failed: %s', e)
+            return response(503, {'Message': 'Visits could not be written, retry the batch'})
+
+        return response(200, {
+            'logged': sum(result['status'] == 'logged' for result in results),
+            'results': results,
+        })
 
     def handle_log_visit_request(self, request, context):
         """
@@ -165,11 +421,27 @@ class LogVisitFunction():
 
         HEADERS = {
             'Content-Type': 'application/json',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type,Idempotency-Key',
             'Access-Control-Allow-Origin': os.environ["DOMAIN_NAME"],
             'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
         }
 
+        # if no request is provided (should never be the case because of gateway invocation)
+        if (request is None):
+            return {
+                'headers': HEADERS,
+                'statusCode': 400,
+                'body': json.dumps({'Message': 'No request provided'})
+            }
+
+        return idempotent(self.idempotency, 'visit', request, HEADERS,
+                          lambda: self.logVisitRequest(request, HEADERS))
+
+    def logVisitRequest(self, request, HEADERS):
+        """
+        Log the visit in request and build the response.
+        """
+
         def bad_request(body):
             return {
                 'headers': HEADERS,
@@ -177,10 +449,6 @@ class LogVisitFunction():
                 'body': json.dumps(body)
             }
 
-        # if no request is provided (should never be the case because of gateway invocation)
-        if (request is None):
-            return bad_request({'Message': 'No request provided'})
-
         # get the body of the request
         body = json.loads(request.get('body', "{}"))
 
@@ -209,15 +477,23 @@ class LogVisitFunction():
         except:
             last_updated = ""
 
-        # send user the registration link if not registered
-        user_registered = self.isUserRegistered(username)
-        if not user_registered:
-            self.registrationWorkflow(username)
+        # look up the registration while the visit entry is being written,
+        # the two do not depend on each other
+        registered_future = self.executor.submit(
+            self.isUserRegistered, username)
 
         # add the visit entry
         status_code = self.addVisitEntry(
             username, location, tool, last_updated)
 
+        user_registered = registered_future.result()
+        self.logger.info('registration cache: %s',
+                         json.dumps(self.registration_cache.stats()))
+
+        # send user the registration link if not registered
+        if not user_registered:
+            self.requestRegistrationEmail(username)
+
         # Send response
         return {
             'headers': HEADERS,
@@ -231,7 +507,10 @@ class LogVisitFunction():
 log_visit_function = LogVisitFunction(None, None, None, None)
 
 
+@instrumented('log_visit')
 def handler(request, context):
     # This will be hit in prod, and will connect to the stood-up dynamodb
     # and Simple Email Service clients.
+    if request is not None and request.get('resource') == '/visit/batch':
+        return log_visit_function.handle_log_visit_batch_request(request, context)
     return log_visit_function.handle_log_visit_request(request, context)
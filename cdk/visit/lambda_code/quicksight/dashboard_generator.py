@@ -1,54 +1,104 @@
 import boto3
+import logging
 import os
 
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
 HEADERS = {
             'Access-Control-Allow-Headers': 'Content-Type',
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'OPTIONS, GET'
         }
 
-def lambda_handler(event, context):
-    # Set up the QuickSight client
-    quicksight_client = boto3.client('quicksight')
+# how long QuickSight is asked to keep an embed URL's session valid
+SESSION_LIFETIME_MINUTES = 15
+
+# the control-plane call is slow, but should not hold a page load for long
+CONFIG = Config(connect_timeout=2, read_timeout=10,
+                retries={'mode': 'standard', 'max_attempts': 3})
+
+
+class DashboardGeneratorFunction():
+    """
+    Returns the embed URL of the QuickSight dashboard, for `GET /dashboard`.
+
+    An embed URL can only be opened once, and only within five minutes of
+    being made, so every page load gets a new one. What is kept between
+    requests is the QuickSight client, built once per container so a warm
+    container skips building it and reuses its connection.
+
+    Like the other lambdas, the client can be passed in for tests.
+    """
+
+    def __init__(self, quicksight_client):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.INFO)
+
+        # Retrieve the AWS Account ID and Dashboard ID from environment variables
+        self.aws_account_id = os.environ.get('AWS_ACCOUNT_ID')
+        self.dashboard_id = os.environ.get('DASHBOARD_ID')
+
+        # Retrieve the User ARN from environment variables
+        self.user_arn = os.environ.get('QUICKSIGHT_USER_ARN')
 
-    # Retrieve the AWS Account ID and Dashboard ID from environment variables
-    aws_account_id = os.environ.get('AWS_ACCOUNT_ID')
-    dashboard_id = os.environ.get('DASHBOARD_ID')
+        self._quicksight = quicksight_client
 
-    # Retrieve the User ARN from environment variables
-    user_arn = os.environ.get('QUICKSIGHT_USER_ARN') 
+    @property
+    def quicksight(self):
+        # built on first use, then kept for the life of the container
+        if self._quicksight is None:
+            self._quicksight = boto3.client('quicksight', config=CONFIG)
+        return self._quicksight
 
-    try:
-        # Attempt to get the QuickSight dashboard embed URL with session context
-        response = quicksight_client.get_dashboard_embed_url(
-            AwsAccountId=aws_account_id,
-            DashboardId=dashboard_id,
+    def embed_url(self):
+        # Get the QuickSight dashboard embed URL with session context
+        response = self.quicksight.get_dashboard_embed_url(
+            AwsAccountId=self.aws_account_id,
+            DashboardId=self.dashboard_id,
             IdentityType='QUICKSIGHT',
-            SessionLifetimeInMinutes=15,
+            SessionLifetimeInMinutes=SESSION_LIFETIME_MINUTES,
             UndoRedoDisabled=False,
             ResetDisabled=False,
             StatePersistenceEnabled=True,
-            UserArn=user_arn  
+            UserArn=self.user_arn
         )
-        
-        # If the call is successful, return a success message with the embed URL
+        return response['EmbedUrl']
+
+    def handle_dashboard_request(self, event, context):
+        try:
+            url = self.embed_url()
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'QuickSightUserNotFoundException':
+                # Handle the case where the QuickSight user is not found
+                return {
+                    'headers': HEADERS,
+                    'statusCode': 404,
+                    'body': 'QuickSight user not found.'
+                }
+            return self.error_response(e)
+        except Exception as e:
+            # Handle any other exceptions that might occur
+            return self.error_response(e)
+
+        # Return the embed URL
         return {
             'headers': HEADERS,
             'statusCode': 200,
-            'body': response['EmbedUrl']  # Sending back the actual embed URL
+            'body': url
         }
 
-    except quicksight_client.exceptions.QuickSightUserNotFoundException:
-        # Handle the case where the QuickSight user is not found
-        return {
-            'headers': HEADERS,
-            'statusCode': 404,
-            'body': 'QuickSight user not found.'
-        }
-    except Exception as e:
-        # Handle any other exceptions that might occur
+    def error_response(self, e):
+        self.logger.exception('could not get an embed URL')
         return {
             'headers': HEADERS,
             'statusCode': 500,
             'body': f'An error occurred: {str(e)}'
         }
+
+
+dashboard_generator_function = DashboardGeneratorFunction(None)
+
+
+def lambda_handler(event, context):
+    return dashboard_generator_function.handle_dashboard_request(event, context)
@@ -1,10 +1,93 @@
 import json
 import boto3
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+import logging
 import os
 import time
 from typing import Tuple
 
+from lambda_utils import aws_clients
+from lambda_utils.idempotency import idempotent, idempotency_store_from_env
+from lambda_utils.instrumentation import instrumented
+
+
+class QuizCatalogCache():
+    """
+    Keeps the quiz catalog (the items of quiz_list) in memory for as long as
+    the lambda container is warm, so most requests never read quiz_list.
+
+    The cached catalog is reloaded once it is older than `ttl_seconds`. A
+    quiz_id the cache has not seen is looked up on its own rather than by
+    reloading the catalog (see QuizFunction.does_quiz_exist). Hit and miss
+    counts are kept so they can be logged.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.logger = logging.getLogger()
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.invalidate()
+
+    def invalidate(self):
+        """
+            drop the cached catalog so the next lookup reloads it
+        """
+        self.quizzes = []
+        self.quiz_ids = set()
+        self.loaded_at = None
+        # quiz_id -> when this container last wrote it to quiz_list
+        self.written_at = {}
+
+    def is_fresh(self):
+        return (self.loaded_at is not None and
+                time.monotonic() - self.loaded_at < self.ttl_seconds)
+
+    def refresh(self, load_quizzes):
+        self.misses += 1
+        self.quizzes = load_quizzes()
+        self.quiz_ids = {quiz['quiz_id'] for quiz in self.quizzes}
+        self.loaded_at = time.monotonic()
+        self.logger.info('quiz catalog reloaded: %d quizzes, %s',
+                         len(self.quizzes), self.stats())
+
+    def get_quizzes(self, load_quizzes):
+        """
+            input: a function returning every item in quiz_list
+            return: the cached catalog, reloading it first if it is stale
+        """
+        if self.is_fresh():
+            self.hits += 1
+        else:
+            self.refresh(load_quizzes)
+        return self.quizzes
+
+    def knows(self, quiz_id):
+        """
+            true if quiz_id is in the fresh cached catalog or this container
+            wrote or found it within the ttl. This never reads quiz_list
+        """
+        written_at = self.written_at.get(quiz_id)
+        if ((self.is_fresh() and quiz_id in self.quiz_ids) or
+                (written_at is not None and
+                 time.monotonic() - written_at < self.ttl_seconds)):
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, quiz_id):
+        """
+            record a quiz_id that was just written to or found in quiz_list
+        """
+        self.written_at[quiz_id] = time.monotonic()
+        if quiz_id not in self.quiz_ids:
+            self.quiz_ids.add(quiz_id)
+            self.quizzes.append({'quiz_id': quiz_id})
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
 
 class QuizFunction():
     """
@@ -15,35 +98,85 @@ class QuizFunction():
     dynamodb table.
     """
 
-    def __init__(self, quiz_list_table, quiz_progress_table, dynamodbclient):
+    def __init__(self, quiz_list_table, quiz_progress_table, dynamodbclient, catalog_cache=None, idempotency_store=None):
         if dynamodbclient is None:
-            self.dynamodbclient = boto3.client('dynamodb')
+            self.dynamodbclient = aws_clients.LazyClient('dynamodb')
         else:
             self.dynamodbclient = dynamodbclient
 
         self.QUIZ_LIST_TABLE_NAME = os.environ["QUIZ_LIST_TABLE_NAME"]
         if quiz_list_table is None:
-            dynamodbresource = boto3.resource('dynamodb')
-            self.quiz_list = dynamodbresource.Table(self.QUIZ_LIST_TABLE_NAME)
+            self.quiz_list = aws_clients.LazyTable(self.QUIZ_LIST_TABLE_NAME)
         else:
             self.quiz_list = quiz_list_table
 
         self.QUIZ_PROGRESS_TABLE_NAME = os.environ["QUIZ_PROGRESS_TABLE_NAME"]
         if quiz_progress_table is None:
-            dynamodbresource = boto3.resource('dynamodb')
-            self.quiz_progress = dynamodbresource.Table(
+            self.quiz_progress = aws_clients.LazyTable(
                 self.QUIZ_PROGRESS_TABLE_NAME)
         else:
             self.quiz_progress = quiz_progress_table
 
+        if catalog_cache is None:
+            self.catalog_cache = QuizCatalogCache(
+                int(os.environ.get("QUIZ_CATALOG_TTL_SECONDS", "300")))
+        else:
+            self.catalog_cache = catalog_cache
+
+        # Responses to POSTs with an Idempotency-Key, so a retried quiz
+        # result is not written twice. Off without a table.
+        if idempotency_store is None:
+            self.idempotency = idempotency_store_from_env()
+        else:
+            self.idempotency = idempotency_store
+
     def does_quiz_exist(self, quiz_id):
         """
-            true if the quiz is in the quiz list
+            true if the quiz is in the quiz list. A quiz the cache does not
+            know is a single read of its item, not a reload of the catalog
         """
-        quiz_list_response = self.quiz_list.query(
-            KeyConditionExpression=Key('quiz_id').eq(quiz_id)
-        )
-        return quiz_list_response['Count'] != 0
+        if self.catalog_cache.knows(quiz_id):
+            return True
+
+        self.catalog_cache.misses += 1
+        item = self.quiz_list.get_item(Key={'quiz_id': quiz_id}).get('Item')
+        if item is None:
+            return False
+        self.catalog_cache.add(quiz_id)
+        return True
+
+    def get_all_quizzes(self):
+        """
+            returns every item in quiz_list, following LastEvaluatedKey
+            so catalogs larger than one scan page are not truncated
+        """
+        scan_kwargs = {}
+        all_quizzes = []
+        while True:
+            quiz_list_response = self.quiz_list.scan(**scan_kwargs)
+            all_quizzes.extend(quiz_list_response['Items'])
+            if 'LastEvaluatedKey' not in quiz_list_response:
+                return all_quizzes
+            scan_kwargs['ExclusiveStartKey'] = quiz_list_response['LastEvaluatedKey']
+
+    def get_user_progress_items(self, username):
+        """
+            returns every quiz_progress item for the user. The table is
+            partitioned on username, so this is one query per result page
+            rather than one query per quiz
+        """
+        query_kwargs = {
+            'KeyConditionExpression': Key('username').eq(username),
+            'ProjectionExpression': 'quiz_id, #state',
+            'ExpressionAttributeNames': {'#state': 'state'},
+        }
+        progress_items = []
+        while True:
+            quiz_progress_response = self.quiz_progress.query(**query_kwargs)
+            progress_items.extend(quiz_progress_response['Items'])
+            if 'LastEvaluatedKey' not in quiz_progress_response:
+                return progress_items
+            query_kwargs['ExclusiveStartKey'] = quiz_progress_response['LastEvaluatedKey']
 
     def get_username(self, email):
         userName = email.split('@')
@@ -66,26 +199,46 @@ class QuizFunction():
         else:
             return 0
 
+    def add_quiz_to_list(self, quiz_id, last_updated=None):
+        """
+            Insert quiz_id into quiz_list unless it is already there.
+
+            This is a single conditional write rather than a read followed by
+            a write, so two submissions for a new quiz arriving at once cannot
+            race. A failed condition means the quiz already exists, which is
+            the outcome we wanted anyway.
+        """
+        quiz_list_item = {
+            'quiz_id': quiz_id
+        }
+        # if the json is from a test request it will have this ttl attribute
+        if last_updated is not None:
+            quiz_list_item['last_updated'] = last_updated
+
+        try:
+            self.quiz_list.put_item(
+                Item=quiz_list_item,
+                ConditionExpression='attribute_not_exists(quiz_id)'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        self.catalog_cache.add(quiz_id)
+
     def add_quiz_info(self, quiz_info):
         """
             Steps for adding quiz info to db:
-                1. Check if quiz_id exist in quiz_list
-                    - if not -> add quiz_id to quiz_list
+                1. Make sure quiz_id is in quiz_list
+                    - skipped if this container already knows the quiz
+                    - otherwise a conditional write adds it if missing
                 2. Format incoming data for db
                 3. Insert quiz_info into quiz_progress_table
         """
 
-        if not self.does_quiz_exist(quiz_info['quiz_id']):
-            quiz_list_item = {
-                'quiz_id': quiz_info['quiz_id']
-            }
-            # if the json is from a test request it will have this ttl attribute
-            if "last_updated" in quiz_info:
-                quiz_list_item['last_updated'] = quiz_info['last_updated']
-
-            quiz_list_response = self.quiz_list.put_item(
-                Item=quiz_list_item
-            )
+        if not self.catalog_cache.knows(quiz_info['quiz_id']):
+            self.add_quiz_to_list(
+                quiz_info['quiz_id'], quiz_info.get('last_updated'))
 
         timestamp = int(time.time())
         username = self.get_username(quiz_info['email'])
@@ -111,29 +264,19 @@ class QuizFunction():
     def get_quiz_progress(self, username):
         """
             Steps for getting user quiz progress:
-                1. Get all quiz_id's from quiz_list
+                1. Get all quiz_id's from quiz_list (cached per container)
                 2. Retrieve all quiz entries for the user from quiz_progress
+                   with a single (paginated) query on the username partition
                 3. Return list of all quizzes with quiz state
         """
 
         # Step 1
-        quiz_list_response = self.quiz_list.scan()
-        all_quizzes = quiz_list_response['Items']
+        all_quizzes = self.catalog_cache.get_quizzes(self.get_all_quizzes)
 
         # Step 2
         user_quiz_states = {}
-        for quiz in all_quizzes:
-            quiz_id = quiz['quiz_id']
-            quiz_progress_response = self.quiz_progress.query(
-                KeyConditionExpression=Key('username').eq(
-                    username) & Key('quiz_id').eq(quiz_id)
-            )
-            if quiz_progress_response['Items']:
-                quiz_data = quiz_progress_response['Items'][0]
-                user_quiz_states[quiz_id] = int(quiz_data['state'])
-            else:
-                # User has not taken this quiz
-                user_quiz_states[quiz_id] = -1
+        for quiz_data in self.get_user_progress_items(username):
+            user_quiz_states[quiz_data['quiz_id']] = int(quiz_data['state'])
 
         # Step 3
         user_quiz_progress = []
@@ -141,16 +284,25 @@ class QuizFunction():
             quiz_id = quiz['quiz_id']
             quiz_info = {
                 'quiz_id': quiz_id,
-                'state': user_quiz_states.get(quiz_id)
+                # -1 means the user has not taken this quiz
+                'state': user_quiz_states.get(quiz_id, -1)
             }
             user_quiz_progress.append(quiz_info)
 
         return user_quiz_progress
 
+    def post_quiz_info(self, request, HEADERS):
+        quiz_info = json.loads(request["body"])
+        response = self.add_quiz_info(quiz_info)
+        return {
+            'headers': HEADERS,
+            'statusCode': response
+        }
+
     def handle_quiz_request(self, request, context):
         HEADERS = {
             'Content-Type': 'application/json',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type,Idempotency-Key',
             'Access-Control-Allow-Origin': os.environ["DOMAIN_NAME"],
             'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
         }
@@ -166,12 +318,8 @@ class QuizFunction():
         method = request.get('httpMethod')
 
         if method == 'POST':
-            quiz_info = json.loads(request["body"])
-            response = self.add_quiz_info(quiz_info)
-            return {
-                'headers': HEADERS,
-                'statusCode': response
-            }
+            return idempotent(self.idempotency, 'quiz', request, HEADERS,
+                              lambda: self.post_quiz_info(request, HEADERS))
         elif method == 'GET':
             username = request.get('pathParameters', {}).get('username')
             if not username:
@@ -199,9 +347,14 @@ class QuizFunction():
             }
 
 
-quiz_function = QuizFunction(None, None, None)
+# Module level so the catalog survives between invocations of a warm container
+quiz_catalog_cache = QuizCatalogCache(
+    int(os.environ.get("QUIZ_CATALOG_TTL_SECONDS", "300")))
+
+quiz_function = QuizFunction(None, None, None, quiz_catalog_cache)
 
 
+@instrumented('quiz')
 def handler(request, context):
     # Register quiz information from the makerspace/register console
     # Since this will be hit in prod, it will go ahead and hit our prod
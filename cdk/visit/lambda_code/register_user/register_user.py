@@ -8,6 +8,10 @@ import datetime
 import time
 from typing import Tuple
 
+from lambda_utils import aws_clients
+from lambda_utils.idempotency import idempotent, idempotency_store_from_env
+from lambda_utils.instrumentation import instrumented
+
 
 def process_grad_date(grad_date: str) -> Tuple[str, int]:
     """
@@ -19,7 +23,6 @@ def process_grad_date(grad_date: str) -> Tuple[str, int]:
     """
     year = grad_date[:4]
     month = grad_date[5:7]
-    print(month)
     if month in ['04', '05', '06']:
         semester = 'Spring'
     elif month in ['07', '08', '09']:
@@ -42,30 +45,44 @@ class RegisterUserFunction():
     dynamodb table.
     """
 
-    def __init__(self, original_table, users_table, dynamodbclient):
+    def __init__(self, original_table, users_table, dynamodbclient, idempotency_store=None):
         if dynamodbclient is None:
-            self.dynamodbclient = boto3.client('dynamodb')
+            self.dynamodbclient = aws_clients.LazyClient('dynamodb')
         else:
             self.dynamodbclient = dynamodbclient
 
         self.USERS_TABLE_NAME = os.environ["USERS_TABLE_NAME"]
         if users_table is None:
-            dynamodbresource = boto3.resource('dynamodb')
-            self.users = dynamodbresource.Table(self.USERS_TABLE_NAME)
+            self.users = aws_clients.LazyTable(self.USERS_TABLE_NAME)
         else:
             self.users = users_table
 
         self.ORIGINAL_TABLE_NAME = os.environ["ORIGINAL_TABLE_NAME"]
         if original_table is None:
-            self.original = dynamodbresource.Table(
-                self.ORIGINAL_TABLE_NAME)
+            self.original = aws_clients.LazyTable(self.ORIGINAL_TABLE_NAME)
         else:
             self.original = original_table
 
-    def add_user_info(self, user_info):
-
-        # register the user in the old combined table
-        original_response = self.original.put_item(
+        # Responses to requests with an Idempotency-Key, so a retried
+        # registration is not written twice. Off without a table.
+        if idempotency_store is None:
+            self.idempotency = idempotency_store_from_env()
+        else:
+            self.idempotency = idempotency_store
+
+        # How registrations reach the legacy single-table design. 'sync'
+        # writes it on every request, 'async' leaves it to the stream-driven
+        # back-fill lambda and 'off' stops writing it. Read once per container.
+        self.legacy_write_mode = os.environ.get('LEGACY_WRITE_MODE', 'sync')
+        if self.legacy_write_mode not in ('off', 'sync', 'async'):
+            raise ValueError(
+                f'Unknown LEGACY_WRITE_MODE: {self.legacy_write_mode}')
+
+    def add_original_user_info(self, user_info):
+        """
+        Register the user in the old combined table.
+        """
+        return self.original.put_item(
             Item={
                 'PK': user_info['username'],
                 'SK': str(datetime.datetime.now()),
@@ -82,6 +99,12 @@ class RegisterUserFunction():
             },
         )
 
+    def add_user_info(self, user_info):
+
+        # register the user in the old combined table
+        if self.legacy_write_mode == 'sync':
+            original_response = self.add_original_user_info(user_info)
+
         # format Grad_Date if the frontend does not provide the new format
         if 'Grad_Date' in user_info:
             # Add the user to the original table
@@ -123,7 +146,8 @@ class RegisterUserFunction():
             Item=user_table_item
             )
 
-
+        if self.legacy_write_mode != 'sync':
+            return user_table_response['ResponseMetadata']['HTTPStatusCode']
 
         if original_response['ResponseMetadata']['HTTPStatusCode'] != user_table_response['ResponseMetadata']['HTTPStatusCode']:
             raise Exception("One of Original Table or User Table update failed.")
@@ -133,7 +157,7 @@ class RegisterUserFunction():
     def handle_register_user_request(self, request, context):
         HEADERS = {
             'Content-Type': 'application/json',
-            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Headers': 'Content-Type,Idempotency-Key',
             'Access-Control-Allow-Origin': os.environ["DOMAIN_NAME"],
             'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
         }
@@ -146,6 +170,10 @@ class RegisterUserFunction():
                 })
             }
 
+        return idempotent(self.idempotency, 'register', request, HEADERS,
+                          lambda: self.register_user(request, HEADERS))
+
+    def register_user(self, request, HEADERS):
         # Get all of the user information from the json file
         user_info = json.loads(request["body"])
         # Call Function
@@ -160,6 +188,7 @@ class RegisterUserFunction():
 register_user_function = RegisterUserFunction(None, None, None)
 
 
+@instrumented('register_user')
 def handler(request, context):
     # Register user information from the makerspace/register console
     # Since this will be hit in prod, it will go ahead and hit our prod
@@ -0,0 +1,142 @@
+from analytics_export.analytics_export import AnalyticsExportFunction, DirectoryTarget, S3Target
+from lambda_utils.visit_index import day_bucket
+import boto3
+import csv
+import gzip
+import io
+import pytest
+from moto import mock_dynamodb2, mock_s3
+
+from test_utils.test_functions import *
+
+# 2023-11-14 22:13:20 UTC
+VISIT_TIME = 1700000000
+
+
+def add_visit(visits_table, visit_time, username):
+    visits_table.put_item(Item={
+        'visit_time': visit_time,
+        'username': username,
+        'location': 'Watt',
+        'tool': 'Laser Cutter',
+        'day_bucket': day_bucket(username, visit_time),
+    })
+
+
+def add_user(users_table, register_time, username):
+    users_table.put_item(Item={
+        'username': username,
+        'register_time': register_time,
+        'first_name': 'John',
+        'majors': ['Mathematical Sciences', 'Art'],
+    })
+
+
+def stream_record(table_name, event_name, sequence_number, new_image):
+    record = {
+        'eventName': event_name,
+        'eventSourceARN': f'arn:aws:dynamodb:us-east-1:123456789012:table/{table_name}/stream/2024-01-01T00:00:00.000',
+        'dynamodb': {'SequenceNumber': str(sequence_number)},
+    }
+    if new_image is not None:
+        record['dynamodb']['NewImage'] = new_image
+    return record
+
+
+def visit_record(sequence_number, visit_time, username, event_name='INSERT'):
+    return stream_record('visits', event_name, sequence_number, {
+        'visit_time': {'N': str(visit_time)},
+        'username': {'S': username},
+        'location': {'S': 'Watt'},
+        'tool': {'NULL': True},
+    })
+
+
+def user_record(sequence_number, register_time, username, event_name='INSERT'):
+    return stream_record('users', event_name, sequence_number, {
+        'username': {'S': username},
+        'register_time': {'N': str(register_time)},
+        'majors': {'L': [{'S': 'Art'}]},
+    })
+
+
+def read_rows(body):
+    return list(csv.DictReader(io.StringIO(gzip.decompress(body).decode())))
+
+
+@mock_dynamodb2
+def test_full_export_to_a_directory(tmp_path):
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    users_table = create_test_users_table(client)
+    target = DirectoryTarget(str(tmp_path))
+    export_function = AnalyticsExportFunction(
+        visits_table, users_table, target, scan_segments=1)
+
+    add_visit(visits_table, VISIT_TIME, 'user1')
+    add_visit(visits_table, VISIT_TIME + 7200, 'user2')  # the next UTC day
+    add_user(users_table, VISIT_TIME - 100, 'user1')
+
+    assert export_function.export_all(now=VISIT_TIME + 7200) == {
+        'visits': 2, 'users': 1}
+
+    run = f'full-{VISIT_TIME + 7200}'
+    first_day = read_rows(target.read(f'visits/date=2023-11-14/part-{run}.csv.gz'))
+    assert [(r['username'], r['visit_time']) for r in first_day] == [
+        ('user1', str(VISIT_TIME))]
+    assert target.read(f'visits/date=2023-11-15/part-{run}.csv.gz')
+    users = read_rows(target.read(f'users/date=2023-11-14/part-{run}.csv.gz'))
+    assert users[0]['majors'] == 'Art;Mathematical Sciences'
+
+
+@mock_dynamodb2
+def test_stream_batches_export_only_what_was_written(tmp_path):
+    client = create_dynamodb_client()
+    target = DirectoryTarget(str(tmp_path))
+    export_function = AnalyticsExportFunction(
+        create_test_visit_table(client), create_test_users_table(client), target)
+
+    event = {'Records': [
+        visit_record(100, VISIT_TIME + 7200, 'user2'),
+        # queued by a kiosk that was offline, and written days later
+        visit_record(101, VISIT_TIME - 3 * 86400, 'user3'),
+        # registered again
+        user_record(102, VISIT_TIME, 'user1', event_name='MODIFY'),
+        # expired by its TTL
+        stream_record('visits', 'REMOVE', 103, None),
+    ]}
+    assert export_function.handle_stream_event(event, None) == {
+        'visits': 2, 'users': 1}
+
+    assert sorted(str(path.relative_to(tmp_path)) for path in tmp_path.rglob('*.gz')) == [
+        'users/date=2023-11-14/part-100.csv.gz',
+        'visits/date=2023-11-11/part-100.csv.gz',
+        'visits/date=2023-11-15/part-100.csv.gz']
+    late = read_rows(target.read('visits/date=2023-11-11/part-100.csv.gz'))
+    assert [(r['username'], r['visit_time']) for r in late] == [
+        ('user3', str(VISIT_TIME - 3 * 86400))]
+    assert read_rows(target.read('users/date=2023-11-14/part-100.csv.gz'))[0]['majors'] == 'Art'
+
+    # a retried batch writes the same files again
+    export_function.handle_stream_event(event, None)
+    assert len(list(tmp_path.rglob('*.gz'))) == 3
+
+    assert export_function.handle_stream_event({'Records': []}, None) == {
+        'visits': 0, 'users': 0}
+
+
+@mock_dynamodb2
+@mock_s3
+def test_export_to_s3():
+    client = create_dynamodb_client()
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='analytics')
+    export_function = AnalyticsExportFunction(
+        create_test_visit_table(client), create_test_users_table(client),
+        S3Target('analytics', 'exports', s3))
+
+    assert export_function.handle_stream_event(
+        {'Records': [visit_record(7, VISIT_TIME, 'user1')]}, None) == {
+        'visits': 1, 'users': 0}
+    keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket='analytics')['Contents']]
+    assert keys == ['exports/visits/date=2023-11-14/part-7.csv.gz']
@@ -0,0 +1,240 @@
+""" Post-deploy canary for the visitor console and the visit API
+
+    Runs each check against a deployed stage, several at once, and prints
+    how long each one took. Exits with 1 if any check failed, which fails
+    the pipeline's post-deploy step.
+
+    Checks do not depend on each other, so they run in parallel from a
+    thread pool, and all of them share one connection pool per host, so a
+    check reuses a connection another check has already opened.
+
+    The canary's items carry a `last_updated` TTL a few minutes ahead, so
+    they are cleaned up after the run.
+
+    Run against a stage (ENV is read if --stage is not given):
+
+        python canary.py --stage Beta
+
+    or against anything else that serves the API, like the local stub in
+    stub_api.py:
+
+        python stub_api.py --port 8080 &
+        python canary.py --frontend-url http://localhost:8080/ --api-url http://localhost:8080/
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3
+
+# (frontend_url, api_url) of each stage
+STAGES = {
+    'Beta': ('https://beta-visit.cumaker.space/', 'https://beta-api.cumaker.space/'),
+    'Prod': ('https://visit.cumaker.space/', 'https://api.cumaker.space/'),
+}
+
+# the visitor console's page title
+FRONTEND_TITLE = b'Makerspace Sign-in'
+
+CheckResult = namedtuple('CheckResult', ['name', 'passed', 'ms', 'error'])
+
+
+def pool_manager(maxsize=8, timeout=10):
+    """
+    Keeps up to maxsize open connections to each host. Only failed
+    connections are retried; a POST that reached the API is not sent again.
+    """
+    return urllib3.PoolManager(
+        maxsize=maxsize, timeout=urllib3.Timeout(connect=5, read=timeout),
+        retries=urllib3.Retry(total=2, read=0, status=0, backoff_factor=0.2))
+
+
+class CheckFailed(Exception):
+    pass
+
+
+class Canary():
+    """
+    The checks, as methods named check_*. Each raises CheckFailed, or any
+    other exception, if the stage does not behave.
+
+    The usernames and emails are unique to the run, so two runs, or two
+    checks in one run, never see each other's items.
+    """
+
+    def __init__(self, frontend_url, api_url, http=None, run_id=None,
+                 ttl_seconds=120):
+        self.frontend_url = frontend_url
+        self.api_url = api_url.rstrip('/') + '/'
+        self.http = http or pool_manager()
+        self.run_id = run_id or time.strftime('%d-%m-%Y_%H:%M:%S')
+        # Triggers ttl removal a few minutes in future
+        self.last_updated = int(time.time() + ttl_seconds)
+
+    @property
+    def username(self):
+        return 'CANARY_TEST_' + self.run_id
+
+    def request(self, method, path, body=None):
+        """
+        Call the API, and return the response if it is a 200.
+        """
+        response = self.http.request(
+            method, self.api_url + path,
+            body=None if body is None else json.dumps(body),
+            headers={'Content-Type': 'application/json'})
+        if response.status != 200:
+            raise CheckFailed(f'{method} /{path} returned {response.status}: '
+                              f'{response.data[:200]!r}')
+        return response
+
+    def visit(self, username):
+        return {'username': username, 'location': 'Watt Family Innovation Center',
+                'tool': 'Visiting', 'last_updated': self.last_updated}
+
+    def quiz(self, quiz_id, score):
+        return {'quiz_id': quiz_id, 'email': self.username + '@clemson.edu',
+                'score': score, 'last_updated': self.last_updated}
+
+    def check_frontend(self):
+        response = self.http.request('GET', self.frontend_url)
+        if response.status != 200:
+            raise CheckFailed(f'the frontend returned {response.status}')
+        if FRONTEND_TITLE not in response.data:
+            raise CheckFailed('the frontend is not the visitor console')
+
+    def check_visit(self):
+        self.request('POST', 'visit', self.visit(self.username))
+
+    def check_unregistered_visit(self):
+        self.request('POST', 'visit', self.visit(
+            'CANARY_TEST_UNREGISTERED' + self.run_id))
+
+    def check_register(self):
+        self.request('POST', 'register', {
+            'username': self.username,
+            'firstName': 'TEST',
+            'lastName': 'USER',
+            'Gender': 'Male',
+            'DOB': '01/01/2000',
+            'UserPosition': 'Undergraduate Student',
+            'GradSemester': 'Fall',
+            'GradYear': '2023',
+            'Major': ['Mathematical Sciences'],
+            'Minor': ['Business Administration'],
+            'last_updated': self.last_updated,
+        })
+
+    def check_quiz(self):
+        self.request('POST', 'quiz', self.quiz('3dPrinterTesting', '10 / 10'))
+
+    def check_quiz_progress(self):
+        expected = [
+            {'quiz_id': '3dPrinterTesting1', 'state': 1},
+            {'quiz_id': '3dPrinterTesting2', 'state': 1},
+            {'quiz_id': '3dPrinterTesting3', 'state': 0},
+        ]
+        scores = ['10 / 10', '10 / 10', '5 / 10']
+
+        # the submissions are independent of each other too
+        with ThreadPoolExecutor(max_workers=len(expected)) as executor:
+            list(executor.map(
+                lambda quiz, score: self.request(
+                    'POST', 'quiz', self.quiz(quiz['quiz_id'], score)),
+                expected, scores))
+
+        progress = json.loads(self.request('GET', 'quiz/' + self.username).data)
+        missing = [quiz for quiz in expected if quiz not in progress]
+        if missing:
+            raise CheckFailed(f'quiz progress is missing {missing}')
+
+    def check_visit_history_requires_auth(self):
+        # staff read visits with signed requests; anyone else is turned away
+        response = self.http.request(
+            'GET', self.api_url + 'visits?start=0&end=86400')
+        if response.status != 403:
+            raise CheckFailed(f'unsigned GET /visits returned {response.status}')
+
+    def checks(self):
+        return {name[len('check_'):]: getattr(self, name)
+                for name in dir(self) if name.startswith('check_')}
+
+
+def run_check(name, check):
+    started = time.perf_counter()
+    error = None
+    try:
+        check()
+    except CheckFailed as e:
+        error = str(e)
+    except Exception:
+        error = traceback.format_exc(limit=3).strip()
+    return CheckResult(name, error is None,
+                       (time.perf_counter() - started) * 1000, error)
+
+
+def run_checks(canary, workers=8, names=None):
+    """
+    Run canary's checks, or the ones in names, workers at a time. Returns
+    a CheckResult per check, in the order the checks are listed.
+    """
+    checks = canary.checks()
+    names = sorted(checks) if names is None else names
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_check, name, checks[name])
+                   for name in names]
+        return [future.result() for future in futures]
+
+
+def report(results, elapsed, out=None):
+    out = out or sys.stdout
+    for result in results:
+        status = 'PASS' if result.passed else 'FAIL'
+        print(f'{status}  {result.name:<20} {result.ms:>8.1f} ms', file=out)
+        if result.error:
+            for line in result.error.splitlines():
+                print(f'      {line}', file=out)
+    passed = sum(result.passed for result in results)
+    serial = sum(result.ms for result in results) / 1000
+    print(f'{passed}/{len(results)} checks passed in {elapsed:.2f} s '
+          f'({serial:.2f} s one after another)', file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stage', choices=sorted(STAGES),
+                        default=os.environ.get('ENV'),
+                        help='the stage to check, ENV by default')
+    parser.add_argument('--frontend-url', help="overrides the stage's frontend")
+    parser.add_argument('--api-url', help="overrides the stage's API")
+    parser.add_argument('--workers', type=int, default=8,
+                        help='checks run at once')
+    parser.add_argument('--check', action='append', dest='checks',
+                        help='run only this check, may be repeated')
+    args = parser.parse_args(argv)
+
+    frontend_url, api_url = STAGES.get(args.stage, (None, None))
+    frontend_url = args.frontend_url or frontend_url
+    api_url = args.api_url or api_url
+    if frontend_url is None or api_url is None:
+        parser.error("Couldn't find Stage: pass --stage, or both "
+                     "--frontend-url and --api-url")
+
+    canary = Canary(frontend_url, api_url, http=pool_manager(args.workers))
+    unknown = set(args.checks or []) - set(canary.checks())
+    if unknown:
+        parser.error(f"unknown checks: {', '.join(sorted(unknown))}")
+
+    started = time.perf_counter()
+    results = run_checks(canary, args.workers, args.checks)
+    report(results, time.perf_counter() - started)
+    return 0 if all(result.passed for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
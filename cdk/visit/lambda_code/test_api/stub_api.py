@@ -0,0 +1,177 @@
+""" A local stand-in for the visitor console and the visit API
+
+    Serves just enough of both for the canary: the console's page at /,
+    and POST /visit, POST /register, POST /quiz and GET /quiz/{username},
+    which keep what they are sent in memory, and GET /visits, which like
+    API Gateway turns away requests that are not signed. It checks requests
+    about as strictly as the lambdas do, so the canary can be run, and
+    tested, without AWS:
+
+        python stub_api.py --port 8080
+
+    Connections are kept open between requests, like API Gateway's.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FRONTEND_PAGE = (b'<!DOCTYPE html><html><head>'
+                 b'<title>Makerspace Sign-in</title></head><body></body></html>')
+
+
+class StubApi():
+    """
+    The API's state, and how it answers each request.
+
+    `failures` maps 'METHOD /path' to a status code to answer with instead,
+    and `delay` is added to every request, to stand in for the lambdas.
+    """
+
+    def __init__(self, failures=None, delay=0):
+        self.failures = failures or {}
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.visits = []
+        self.users = {}
+        self.quizzes = set()
+        self.progress = {}
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.requests = 0
+
+    def handle(self, method, path, body, headers=None):
+        """
+        (status, content type, body) for a request.
+        """
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            return self.route(method, path, body, headers or {})
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def route(self, method, path, body, headers):
+        endpoint = f'{method} {path}'
+        if path.startswith('/quiz/'):
+            endpoint = f'{method} /quiz/{{username}}'
+        if endpoint in self.failures:
+            return self.json(self.failures[endpoint], {'Message': 'stub failure'})
+
+        if endpoint == 'GET /':
+            return 200, 'text/html', FRONTEND_PAGE
+        if endpoint == 'GET /visits':
+            # IAM authorization, checked before the lambda is called
+            if 'Authorization' not in headers:
+                return self.json(403, {'message': 'Missing Authentication Token'})
+            return self.json(200, {'visits': [], 'count': 0, 'next_cursor': None})
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            return self.json(400, {'Message': 'body is not JSON'})
+
+        if endpoint == 'POST /visit':
+            return self.log_visit(data)
+        if endpoint == 'POST /register':
+            return self.register(data)
+        if endpoint == 'POST /quiz':
+            return self.add_quiz(data)
+        if endpoint == 'GET /quiz/{username}':
+            return self.quiz_progress(path[len('/quiz/'):])
+        return self.json(404, {'Message': f'no route for {method} {path}'})
+
+    def json(self, status, body):
+        return status, 'application/json', json.dumps(body).encode('utf-8')
+
+    def log_visit(self, data):
+        if not all(data.get(field) for field in ('username', 'location', 'tool')):
+            return self.json(400, {'Message': 'Missing username, location or tool'})
+        with self.lock:
+            self.visits.append(data)
+            registered = data['username'] in self.users
+        return self.json(200, {'Message': 'visit logged', 'registered': registered})
+
+    def register(self, data):
+        if not data.get('username'):
+            return self.json(400, {'Message': 'Missing username'})
+        with self.lock:
+            self.users[data['username']] = data
+        return self.json(200, {'Message': 'user registered'})
+
+    def add_quiz(self, data):
+        try:
+            score, total = (int(part) for part in data['score'].split('/'))
+            quiz_id, username = data['quiz_id'], data['email'].split('@')[0]
+        except (KeyError, ValueError, AttributeError):
+            return self.json(400, {'Message': 'Missing or malformed quiz fields'})
+        with self.lock:
+            self.quizzes.add(quiz_id)
+            self.progress[(username, quiz_id)] = int(score == total)
+        return self.json(200, {'Message': 'quiz saved'})
+
+    def quiz_progress(self, username):
+        with self.lock:
+            progress = [{'quiz_id': quiz_id,
+                         'state': self.progress.get((username, quiz_id), -1)}
+                        for quiz_id in sorted(self.quizzes)]
+        return self.json(200, progress)
+
+
+def handler_class(api):
+    class Handler(BaseHTTPRequestHandler):
+        # keep connections open between requests
+        protocol_version = 'HTTP/1.1'
+
+        def answer(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            status, content_type, payload = api.handle(
+                self.command, self.path.split('?')[0], body, self.headers)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = answer
+        do_POST = answer
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(api, host='127.0.0.1', port=0):
+    """
+    Serve api from a background thread. Returns the server; its URL is
+    f'http://{host}:{server.server_port}/', and server.shutdown() stops it.
+    """
+    server = ThreadingHTTPServer((host, port), handler_class(api))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--delay', type=float, default=0,
+                        help='seconds added to every request')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port),
+                                 handler_class(StubApi(delay=args.delay)))
+    server.daemon_threads = True
+    print(f'serving on http://{args.host}:{server.server_port}/')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,151 +1,99 @@
-import os
-import logging
-from botocore.vendored import requests
-import boto3
-from datetime import datetime
-import json
-import urllib3
-import time
+import io
+
 import pytest
 
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-env = os.environ["ENV"]
-http = urllib3.PoolManager()
+from canary import Canary, pool_manager, report, run_checks
+from stub_api import StubApi, serve
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        api = StubApi(**kwargs)
+        server = serve(api)
+        servers.append(server)
+        return api, f'http://127.0.0.1:{server.server_port}/'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_canary_passes_against_stub(stub):
+    api, url = stub()
+    canary = Canary(url, url, run_id='test')
 
-# Triggers ttl removal 2 minutes in future
-unix_timestamp_for_ttl = int(time.time()+120)
-now = datetime.now()
+    results = run_checks(canary)
 
-dt_string = now.strftime("%d-%m-%Y_%H:%M:%S")
-
-frontend_url = ""
-api_url = ""
-
-if env == "Beta":
-    frontend_url = "https://beta-visit.cumaker.space/"
-    api_url = "https://beta-api.cumaker.space/"
-elif env == "Prod":
-    frontend_url = "https://visit.cumaker.space/"
-    api_url = "https://api.cumaker.space/"
-else:
-    raise Exception("Couldn't find Stage")
-
-
-def test_frontend():
-    # Simulates "curl <makerspace_frontend_url> | grep Makerspace Visitor Console" command
-    frontend_response = http.request('GET', str(frontend_url))
-
-    assert frontend_response.status == 200
-    assert b"Makerspace Sign-in" in frontend_response.data
+    assert [result.name for result in results] == [
+        'frontend', 'quiz', 'quiz_progress', 'register', 'unregistered_visit', 'visit',
+        'visit_history_requires_auth']
+    assert all(result.passed for result in results), results
+    assert all(result.ms > 0 for result in results)
+    assert 'CANARY_TEST_test' in api.users
+    assert len(api.visits) == 2
 
 
-def test_visit_api():
-    visit_data = {"username": "CANARY_TEST_"+dt_string, "location": "Watt Family Innovation Center",
-                  "tool": "Visiting", "last_updated": (unix_timestamp_for_ttl)}
-    visit_data = json.dumps(visit_data)
+def test_checks_run_in_parallel(stub):
+    api, url = stub(delay=0.2)
+    canary = Canary(url, url, http=pool_manager(maxsize=8))
 
-    visit_response = http.request(
-        'POST', str(api_url)+"visit", body=visit_data)
+    results = run_checks(canary, workers=8)
 
-    visit_data_unregistered = {"username": "CANARY_TEST_UNREGISTERED"+dt_string,
-                               "location": "Watt Family Innovation Center", "tool": "Visiting", "last_updated": (unix_timestamp_for_ttl)}
-    visit_data_unregistered = json.dumps(visit_data_unregistered)
+    assert all(result.passed for result in results), results
+    assert api.most_in_flight > 1
+    # one after another, the eleven requests would take at least 2 s
+    assert max(result.ms for result in results) < 1500
 
-    visit_response = http.request(
-        'POST', str(api_url)+"visit", body=visit_data)
-    visit_response_unregistered = http.request(
-        'POST', str(api_url)+"visit", body=visit_data_unregistered)
 
-    assert visit_response.status == 200
-    assert visit_response_unregistered.status == 200
+def test_failed_check_is_reported(stub):
+    api, url = stub(failures={'POST /register': 500})
+    canary = Canary(url, url)
 
+    results = {result.name: result for result in run_checks(canary)}
 
-def test_register_api():
-    register_data_dict = {
-        "username": "CANARY_TEST_"+dt_string,
-        "firstName": "TEST",
-        "lastName": "USER",
-        "Gender": "Male",
-        "DOB": "01/01/2000",
-        "UserPosition": "Undergraduate Student",
-        "GradSemester": "Fall",
-        "GradYear": "2023",
-        "Major": ["Mathematical Sciences"],
-        "Minor": ["Business Administration"],
-        "last_updated": (unix_timestamp_for_ttl)
-    }
+    assert not results['register'].passed
+    assert '500' in results['register'].error
+    # the other checks still ran
+    assert results['visit'].passed
+    assert results['quiz_progress'].passed
 
-    register_data = json.dumps(register_data_dict)
+    out = io.StringIO()
+    report(list(results.values()), 0.1, out)
+    assert 'FAIL  register' in out.getvalue()
+    assert '6/7 checks passed' in out.getvalue()
 
-    reg_response = http.request('POST', str(
-        api_url)+"register", body=register_data)
 
-    print("Canary Successful for Canary test with username: " +
-          str(register_data_dict["username"]))
+def test_wrong_frontend_fails(stub):
+    api, url = stub(failures={'GET /': 404})
+    canary = Canary(url, url)
 
-    assert reg_response.status == 200
+    [result] = run_checks(canary, names=['frontend'])
 
+    assert not result.passed
+    assert '404' in result.error
 
-def test_quiz_api_post():
-    quiz_data_dict = {
-        "quiz_id": "3dPrinterTesting",
-        "email": "CANARY_TEST_" + dt_string + "@clemson.edu",
-        "score": "10 / 10",
-        "last_updated": (unix_timestamp_for_ttl),
-    }
 
-    quiz_data = json.dumps(quiz_data_dict)
+def test_unsigned_visit_history_is_rejected(stub):
+    api, url = stub()
+    canary = Canary(url, url)
 
-    quiz_post_response = http.request(
-        'POST', str(api_url) + "quiz", body=quiz_data)
+    [result] = run_checks(canary, names=['visit_history_requires_auth'])
+    assert result.passed, result
 
-    assert quiz_post_response.status == 200
+    signed = canary.http.request('GET', url + 'visits?start=0&end=86400',
+                                 headers={'Authorization': 'AWS4-HMAC-SHA256 ...'})
+    assert signed.status == 200
 
 
-def test_quiz_api_get():
-    quiz_data_dict_1 = {
-        "quiz_id": "3dPrinterTesting1",
-        "email": "CANARY_TEST_"+dt_string + "@clemson.edu",
-        "score": "10 / 10",
-        "last_updated": (unix_timestamp_for_ttl),
-    }
-    quiz_data_dict_2 = {
-        "quiz_id": "3dPrinterTesting2",
-        "email": "CANARY_TEST_"+dt_string + "@clemson.edu",
-        "score": "10 / 10",
-        "last_updated": (unix_timestamp_for_ttl),
-    }
-    quiz_data_dict_3 = {
-        "quiz_id": "3dPrinterTesting3",
-        "email": "CANARY_TEST_"+dt_string + "@clemson.edu",
-        "score": "5 / 10",
-        "last_updated": (unix_timestamp_for_ttl),
-    }
-
-    username = "CANARY_TEST_" + dt_string
-
-    quiz_post_response_1 = http.request(
-        'POST', str(api_url) + "quiz", body=json.dumps(quiz_data_dict_1))
-    quiz_post_response_2 = http.request(
-        'POST', str(api_url) + "quiz", body=json.dumps(quiz_data_dict_2))
-    quiz_post_response_3 = http.request(
-        'POST', str(api_url) + "quiz", body=json.dumps(quiz_data_dict_3))
+def test_open_visit_history_fails(stub):
+    api, url = stub(failures={'GET /visits': 200})
+    canary = Canary(url, url)
 
-    assert quiz_post_response_1.status == 200 and quiz_post_response_2.status == 200 and quiz_post_response_3.status == 200
-
-    quiz_get_response = http.request(
-        'GET', str(api_url) + "quiz/" + username)
-
-    assert quiz_get_response.status == 200
+    [result] = run_checks(canary, names=['visit_history_requires_auth'])
 
-    expected_response = [
-        {"quiz_id": "3dPrinterTesting1", "state": 1},
-        {"quiz_id": "3dPrinterTesting2", "state": 1},
-        {"quiz_id": "3dPrinterTesting3", "state": 0}
-    ]
-
-    quiz_progress = json.loads(quiz_get_response.data)
-
-    assert expected_response[0] in quiz_progress and expected_response[
-        1] in quiz_progress and expected_response[2] in quiz_progress
+    assert not result.passed
+    assert '200' in result.error
@@ -0,0 +1,58 @@
+from quicksight.dashboard_generator import DashboardGeneratorFunction
+from botocore.exceptions import ClientError
+
+import quicksight.dashboard_generator as dashboard_generator
+
+
+class FakeQuickSight():
+    """
+    Hands out numbered embed URLs, since moto does not mock embedding.
+    """
+
+    def __init__(self, error_code=None):
+        self.calls = 0
+        self.error_code = error_code
+
+    def get_dashboard_embed_url(self, **kwargs):
+        if self.error_code:
+            raise ClientError({'Error': {'Code': self.error_code}},
+                              'GetDashboardEmbedUrl')
+        self.calls += 1
+        return {'EmbedUrl': f'https://quicksight/embed/{self.calls}'}
+
+
+def test_every_page_load_gets_a_new_url():
+    # embed URLs are single use, so none is ever handed out twice
+    quicksight = FakeQuickSight()
+    generator = DashboardGeneratorFunction(quicksight)
+
+    assert generator.embed_url() == 'https://quicksight/embed/1'
+    assert generator.embed_url() == 'https://quicksight/embed/2'
+    assert quicksight.calls == 2
+
+
+def test_client_is_built_once(monkeypatch):
+    built = []
+    monkeypatch.setattr(dashboard_generator.boto3, 'client',
+                        lambda *args, **kwargs: built.append(args) or FakeQuickSight())
+    generator = DashboardGeneratorFunction(None)
+
+    generator.embed_url()
+    generator.embed_url()
+
+    assert built == [('quicksight',)]
+
+
+def test_handler_responses():
+    generator = DashboardGeneratorFunction(FakeQuickSight())
+    response = generator.handle_dashboard_request({}, None)
+    assert response['statusCode'] == 200
+    assert response['body'] == 'https://quicksight/embed/1'
+
+    missing_user = DashboardGeneratorFunction(
+        FakeQuickSight('QuickSightUserNotFoundException'))
+    assert missing_user.handle_dashboard_request({}, None)['statusCode'] == 404
+
+    throttled = DashboardGeneratorFunction(
+        FakeQuickSight('ThrottlingException'))
+    assert throttled.handle_dashboard_request({}, None)['statusCode'] == 500
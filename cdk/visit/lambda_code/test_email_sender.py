@@ -0,0 +1,123 @@
+from email_sender.email_sender import EmailSenderFunction
+from lambda_utils.email_queue import SqsEmailQueue
+from lambda_utils.registration_email import RegistrationEmailSender
+import pytest
+import json
+import boto3
+from moto import mock_dynamodb2, mock_ses, mock_sqs
+
+from test_utils.test_functions import *
+
+
+def queue_event(*usernames):
+    return {'Records': [{'messageId': f'message{i}',
+                         'body': json.dumps({'username': username})}
+                        for i, username in enumerate(usernames)]}
+
+
+@mock_ses
+def test_queue_event_dedupes_recipients():
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+    email_sender_function = EmailSenderFunction(client)
+
+    response = email_sender_function.handle_queue_event(
+        queue_event('jmdanie234', 'jmdanie234@clemson.edu', 'leejohn'), None)
+    assert response == {'batchItemFailures': []}
+    assert client.get_send_quota()['SentLast24Hours'] == 2
+
+    # the same people signing in again later in the window get nothing
+    email_sender_function.handle_queue_event(
+        queue_event('jmdanie234', 'leejohn'), None)
+    assert client.get_send_quota()['SentLast24Hours'] == 2
+
+
+@mock_ses
+def test_queue_event_after_window(monkeypatch):
+    monkeypatch.setenv('EMAIL_DEDUPE_WINDOW_SECONDS', '0')
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+    email_sender_function = EmailSenderFunction(client)
+
+    email_sender_function.handle_queue_event(queue_event('jmdanie234'), None)
+    email_sender_function.handle_queue_event(queue_event('jmdanie234'), None)
+    assert client.get_send_quota()['SentLast24Hours'] == 2
+
+
+@mock_ses
+@mock_sqs
+def test_sends_what_log_visit_queued():
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+    sqs_client = boto3.client('sqs', region_name='us-east-1')
+    queue_url = sqs_client.create_queue(QueueName='emails')['QueueUrl']
+    email_queue = SqsEmailQueue(queue_url, sqs_client)
+
+    for i in range(8):
+        email_queue.send({'username': f'user{i % 4}'})
+
+    # the event source hands the lambda what it receives from the queue
+    email_sender_function = EmailSenderFunction(client)
+    messages = sqs_client.receive_message(
+        QueueUrl=queue_url, MaxNumberOfMessages=10)['Messages']
+    assert len(messages) == 8
+    response = email_sender_function.handle_queue_event({'Records': [
+        {'messageId': message['MessageId'], 'body': message['Body']}
+        for message in messages]}, None)
+    assert response == {'batchItemFailures': []}
+    assert client.get_send_quota()['SentLast24Hours'] == 4
+
+
+@mock_dynamodb2
+@mock_ses
+def test_sends_table_dedupes_across_containers():
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+    sends_table = create_test_email_sends_table(create_dynamodb_client())
+
+    # two containers, each with its own sender, share the table
+    containers = [EmailSenderFunction(client, RegistrationEmailSender(
+        client, dedupe_window_seconds=3600, sends_table=sends_table))
+        for _ in range(2)]
+    for container in containers:
+        container.handle_queue_event(queue_event('jmdanie234'), None)
+
+    assert client.get_send_quota()['SentLast24Hours'] == 1
+    item = sends_table.get_item(
+        Key={'recipient': 'jmdanie234@clemson.edu'})['Item']
+    assert item['expires_at'] == item['sent_at'] + 3600
+
+
+@mock_dynamodb2
+@mock_ses
+def test_sends_table_window_expires():
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+    sends_table = create_test_email_sends_table(create_dynamodb_client())
+    now = [1700000000]
+    sender = RegistrationEmailSender(client, dedupe_window_seconds=60,
+                                     sends_table=sends_table, clock=lambda: now[0])
+
+    assert sender.send('jmdanie234')
+    assert not sender.send('jmdanie234')
+    # the item is still there, TTL has not deleted it yet
+    now[0] += 60
+    assert sender.send('jmdanie234')
+
+
+@mock_dynamodb2
+@mock_ses
+def test_failed_send_is_reported_and_released():
+    # the sender address is not verified, so SES rejects the email
+    client = create_ses_client()
+    sends_table = create_test_email_sends_table(create_dynamodb_client())
+    email_sender_function = EmailSenderFunction(client, RegistrationEmailSender(
+        client, dedupe_window_seconds=3600, sends_table=sends_table))
+
+    response = email_sender_function.handle_queue_event(
+        queue_event('jmdanie234', 'leejohn'), None)
+
+    # both are retried by SQS, and the retry is not taken for a repeat
+    assert response == {'batchItemFailures': [
+        {'itemIdentifier': 'message0'}, {'itemIdentifier': 'message1'}]}
+    assert sends_table.scan()['Count'] == 0
@@ -0,0 +1,405 @@
+from lambda_utils.bulk_writer import BulkWriter, BulkWriteError
+from lambda_utils.dynamodb import existing_keys, item_exists, ParallelScanner
+from lambda_utils.idempotency import IdempotencyStore, idempotent
+from lambda_utils.instrumentation import instrument_client, instrumented, invocation
+from lambda_utils.visit_index import (backfill_day_buckets, day_bucket,
+                                      day_buckets, query_visits)
+import json
+import logging
+import pytest
+from moto import mock_dynamodb2
+
+from test_utils.test_functions import *
+
+
+@mock_dynamodb2
+def test_item_exists_reads_only_the_key(caplog):
+    client = create_dynamodb_client()
+    users_table = create_test_users_table(client)
+    users_table.put_item(Item={'username': 'jmdanie234',
+                               'first_name': 'John',
+                               'majors': ['Mathematical Sciences']})
+
+    responses = []
+    users_table.meta.client.meta.events.register(
+        'after-call.dynamodb.GetItem',
+        lambda parsed, **kwargs: responses.append(parsed))
+
+    with caplog.at_level(logging.INFO):
+        assert item_exists(users_table, {'username': 'jmdanie234'})
+        assert not item_exists(users_table, {'username': 'leejohn'})
+
+    assert set(responses[0]['Item']) == {'username'}
+    assert 'read capacity units' in caplog.text
+
+
+class SegmentedTable():
+    """
+    moto ignores Segment/TotalSegments, so this stands in for a table that
+    splits its items across segments and pages them the way DynamoDB does.
+    """
+
+    def __init__(self, count):
+        self.items = [{'visit_time': i} for i in range(count)]
+
+    def scan(self, Segment=0, TotalSegments=1, Limit=10, ExclusiveStartKey=None):
+        segment = [item for item in self.items
+                   if item['visit_time'] % TotalSegments == Segment]
+        start = 0 if ExclusiveStartKey is None else ExclusiveStartKey['index']
+        response = {'Items': segment[start:start + Limit]}
+        if start + Limit < len(segment):
+            response['LastEvaluatedKey'] = {'index': start + Limit}
+        return response
+
+
+@mock_dynamodb2
+def test_parallel_scan_reads_every_page():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    with visits_table.batch_writer() as batch:
+        for i in range(300):
+            batch.put_item(Item={'visit_time': i, 'username': f'user{i}'})
+
+    # a small page size forces the scan to follow LastEvaluatedKey
+    scanner = ParallelScanner(visits_table, total_segments=1, Limit=7)
+    visit_times = sorted(int(item['visit_time']) for item in scanner.items())
+
+    assert visit_times == list(range(300))
+    assert scanner.cursors == {0: ParallelScanner.DONE}
+
+
+def test_parallel_scan_reads_every_segment():
+    scanner = ParallelScanner(SegmentedTable(1000), total_segments=4, Limit=9)
+    visit_times = sorted(item['visit_time'] for item in scanner.items())
+
+    assert visit_times == list(range(1000))
+    assert scanner.cursors == {segment: ParallelScanner.DONE
+                               for segment in range(4)}
+
+
+def test_parallel_scan_raises_segment_errors():
+    class BrokenTable(SegmentedTable):
+        def scan(self, Segment=0, **kwargs):
+            if Segment == 2:
+                raise RuntimeError('throttled')
+            return super().scan(Segment=Segment, **kwargs)
+
+    with pytest.raises(RuntimeError):
+        list(ParallelScanner(BrokenTable(100), total_segments=4).items())
+
+
+@mock_dynamodb2
+def test_parallel_scan_resumes_from_cursors():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    with visits_table.batch_writer() as batch:
+        for i in range(100):
+            batch.put_item(Item={'visit_time': i, 'username': f'user{i}'})
+
+    scanner = ParallelScanner(visits_table, total_segments=1, Limit=10)
+    items = scanner.items()
+    first = [next(items) for _ in range(25)]
+    items.close()
+
+    # the cursor only covers pages that were read completely
+    assert scanner.completed == 20
+    resumed = ParallelScanner(visits_table, total_segments=1,
+                              start_keys=scanner.cursors, Limit=10)
+    rest = list(resumed.items())
+    assert len(first[:20]) + len(rest) == 100
+
+
+@mock_dynamodb2
+def test_bulk_writer_writes_every_item():
+    client = create_dynamodb_client()
+    create_test_visit_table(client)
+
+    with BulkWriter(client, 'visits', threads=3,
+                    key_names=['username', 'visit_time']) as writer:
+        for i in range(60):
+            writer.put({'username': {'S': f'user{i}'},
+                        'visit_time': {'N': str(i)},
+                        'location': {'S': 'watt'}})
+
+    assert client.scan(TableName='visits')['Count'] == 60
+    # 25 + 25 + 10
+    assert writer.stats()['calls'] == 3
+    assert writer.stats()['written'] == 60
+
+
+@mock_dynamodb2
+def test_bulk_writer_drops_duplicate_keys_in_a_batch():
+    client = create_dynamodb_client()
+    create_test_visit_table(client)
+
+    with BulkWriter(client, 'visits', key_names=['username', 'visit_time']) as writer:
+        for location in ['watt', 'cooper']:
+            writer.put({'username': {'S': 'user'},
+                        'visit_time': {'N': '1'},
+                        'location': {'S': location}})
+
+    items = client.scan(TableName='visits')['Items']
+    assert [item['location']['S'] for item in items] == ['cooper']
+
+
+class ThrottlingClient():
+    """
+    Leaves the first item of each call unprocessed for `throttled_calls`
+    calls, the way BatchWriteItem does when the table is throttled.
+    """
+
+    def __init__(self, throttled_calls):
+        self.throttled_calls = throttled_calls
+        self.calls = 0
+        self.written = []
+
+    def batch_write_item(self, RequestItems):
+        (table_name, requests), = RequestItems.items()
+        self.calls += 1
+        if self.calls <= self.throttled_calls:
+            self.written.extend(requests[1:])
+            return {'UnprocessedItems': {table_name: requests[:1]}}
+        self.written.extend(requests)
+        return {'UnprocessedItems': {}}
+
+
+def test_bulk_writer_retries_unprocessed_items():
+    client = ThrottlingClient(throttled_calls=2)
+
+    with BulkWriter(client, 'visits', threads=1, base_delay=0) as writer:
+        for i in range(10):
+            writer.put({'id': i})
+
+    assert sorted(r['PutRequest']['Item']['id'] for r in client.written) == list(range(10))
+    assert writer.stats()['retries'] == 2
+
+
+def test_bulk_writer_gives_up_after_max_attempts():
+    client = ThrottlingClient(throttled_calls=100)
+
+    writer = BulkWriter(client, 'visits', max_attempts=3, base_delay=0)
+    writer.put({'id': 1})
+    writer.put({'id': 2})
+
+    with pytest.raises(BulkWriteError):
+        writer.close()
+    assert client.calls == 3
+
+
+# 2023-11-14 22:13:20 UTC
+VISIT_TIME = 1700000000
+
+
+def test_day_buckets_cover_every_shard_of_every_day():
+    assert day_bucket('jmdanie234', VISIT_TIME) in day_buckets(
+        VISIT_TIME, VISIT_TIME)
+    assert day_buckets(VISIT_TIME, VISIT_TIME + 86400, shards=2) == [
+        '2023-11-14#0', '2023-11-14#1', '2023-11-15#0', '2023-11-15#1']
+    assert day_buckets(VISIT_TIME, VISIT_TIME - 86400) == []
+
+
+@mock_dynamodb2
+def test_query_visits_merges_shards_in_time_order():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+
+    # three days of visits from enough users to land in every shard
+    with visits_table.batch_writer() as batch:
+        for i in range(90):
+            visit_time = VISIT_TIME + i * 3000
+            username = f'user{i % 7}'
+            batch.put_item(Item={
+                'visit_time': visit_time,
+                'username': username,
+                'location': 'Cooper' if i % 3 else 'Watt',
+                'day_bucket': day_bucket(username, visit_time),
+            })
+
+    start, end = VISIT_TIME + 10 * 3000, VISIT_TIME + 80 * 3000
+    visits = query_visits(visits_table, start, end)
+    assert [int(v['visit_time']) for v in visits] == [
+        VISIT_TIME + i * 3000 for i in range(10, 81)]
+
+    watt = query_visits(visits_table, start, end, location='Watt')
+    assert [int(v['visit_time']) for v in watt] == [
+        VISIT_TIME + i * 3000 for i in range(10, 81) if i % 3 == 0]
+
+
+@mock_dynamodb2
+def test_backfill_puts_old_visits_in_range_queries():
+    visits_table = create_test_visit_table(create_dynamodb_client())
+    # written before visits had a day_bucket
+    visits_table.put_item(Item={'visit_time': VISIT_TIME,
+                                'username': 'jmdanie234',
+                                'location': 'Watt'})
+    visits_table.put_item(Item={'visit_time': VISIT_TIME + 60,
+                                'username': 'leejohn',
+                                'location': 'Cooper',
+                                'day_bucket': day_bucket('leejohn', VISIT_TIME + 60)})
+    start, end = VISIT_TIME - 60, VISIT_TIME + 120
+    assert [v['username'] for v in query_visits(visits_table, start, end)] == [
+        'leejohn']
+
+    assert backfill_day_buckets(visits_table, total_segments=2) == 1
+
+    visits = query_visits(visits_table, start, end)
+    assert [v['username'] for v in visits] == ['jmdanie234', 'leejohn']
+    assert visits[0]['location'] == 'Watt'
+    # nothing is left to back-fill
+    assert backfill_day_buckets(visits_table) == 0
+
+
+@mock_dynamodb2
+def test_existing_keys_looks_up_in_batches():
+    users_table = create_test_users_table(create_dynamodb_client())
+    for i in range(0, 150, 3):
+        users_table.put_item(Item={'username': f'user{i}', 'first_name': 'A'})
+
+    found = existing_keys(
+        users_table, [{'username': f'user{i}'} for i in range(150)])
+    assert sorted(key['username'] for key in found) == sorted(
+        f'user{i}' for i in range(0, 150, 3))
+    # only the key is read back
+    assert all(set(key) == {'username'} for key in found)
+    assert existing_keys(users_table, []) == []
+
+
+class Clock():
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def idempotent_request(key, body='{"username": "a"}'):
+    return {'httpMethod': 'POST', 'resource': '/visit', 'body': body,
+            'headers': {'Idempotency-Key': key}}
+
+
+@mock_dynamodb2
+def test_idempotency_store_replays_the_first_response():
+    clock = Clock(1700000000)
+    store = IdempotencyStore(create_test_idempotency_table(
+        create_dynamodb_client()), ttl_seconds=3600, clock=clock)
+    calls = []
+
+    def handle():
+        calls.append(1)
+        return {'headers': {'h': 'first'}, 'statusCode': 200,
+                'body': str(len(calls))}
+
+    first = store.run('visit', idempotent_request('k1'), {'h': 'x'}, handle)
+    retry = store.run('visit', idempotent_request('k1'), {'h': 'y'}, handle)
+    assert first['body'] == retry['body'] == '1'
+    assert retry['headers'] == {'h': 'y'}
+    assert len(calls) == 1
+
+    # the same key on another endpoint is another request
+    store.run('quiz', idempotent_request('k1'), {}, handle)
+    # as is a request without a key
+    store.run('visit', {'body': '{}'}, {}, handle)
+    assert len(calls) == 3
+
+    # a different body with the same key is refused
+    conflict = store.run('visit', idempotent_request('k1', '{"username": "b"}'),
+                         {}, handle)
+    assert conflict['statusCode'] == 422
+
+    # once the key expires the request is handled again
+    clock.now += 3601
+    assert store.run('visit', idempotent_request('k1'), {}, handle)['body'] == '4'
+
+
+@mock_dynamodb2
+def test_idempotency_store_in_progress_and_failures():
+    clock = Clock(1700000000)
+    store = IdempotencyStore(create_test_idempotency_table(
+        create_dynamodb_client()), in_progress_seconds=30, clock=clock)
+
+    def handle_retry():
+        # a retry arriving while the first copy is still being handled
+        return store.run('visit', idempotent_request('k1'), {},
+                         lambda: {'statusCode': 200, 'body': 'retry'})
+
+    first = store.run('visit', idempotent_request('k1'), {},
+                      lambda: {'statusCode': 200, 'body': handle_retry()['statusCode']})
+    assert first['body'] == 409
+
+    # server errors and exceptions are not replayed
+    assert store.run('visit', idempotent_request('k2'), {},
+                     lambda: {'statusCode': 503})['statusCode'] == 503
+    assert store.run('visit', idempotent_request('k2'), {},
+                     lambda: {'statusCode': 200})['statusCode'] == 200
+
+    def fail():
+        raise RuntimeError('boom')
+    with pytest.raises(RuntimeError):
+        store.run('visit', idempotent_request('k3'), {}, fail)
+    assert store.run('visit', idempotent_request('k3'), {},
+                     lambda: {'statusCode': 201})['statusCode'] == 201
+
+
+@mock_dynamodb2
+def test_idempotent_without_a_store_handles_every_request():
+    calls = []
+
+    def handle():
+        calls.append(1)
+        return {'statusCode': 200, 'body': str(len(calls))}
+
+    assert idempotent(None, 'visit', idempotent_request('k1'), {}, handle)['body'] == '1'
+    assert idempotent(None, 'visit', idempotent_request('k1'), {}, handle)['body'] == '2'
+
+    store = IdempotencyStore(create_test_idempotency_table(create_dynamodb_client()))
+    assert idempotent(store, 'visit', idempotent_request('k1'), {}, handle)['body'] == '3'
+    assert idempotent(store, 'visit', idempotent_request('k1'), {}, handle)['body'] == '3'
+
+
+@mock_dynamodb2
+def test_instrumented_handler_prints_one_emf_line(capsys):
+    users_table = create_test_users_table(create_dynamodb_client())
+    instrument_client(users_table.meta.client)
+
+    @instrumented('test_function')
+    def handler(event, context):
+        users_table.put_item(Item={'username': 'jmdanie234'})
+        item_exists(users_table, {'username': 'jmdanie234'})
+        return {'statusCode': 200, 'body': '{"ok": true}'}
+
+    handler({'body': '{"username": "jmdanie234"}'}, None)
+    handler({'body': '{}'}, None)
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(lines) == 2
+    first, second = lines
+    assert first['Function'] == 'test_function'
+    assert second['ColdStart'] == 0
+    assert first['RequestBytes'] == 26 and first['ResponseBytes'] == 12
+    assert first['DynamoDBCalls'] == 2 and first['SESCalls'] == 0
+    assert [call['operation'] for call in first['calls']] == ['PutItem', 'GetItem']
+    assert all(call['ms'] >= 0 and call['request_bytes'] > 0
+               for call in first['calls'])
+
+    metrics = first['_aws']['CloudWatchMetrics'][0]
+    assert metrics['Dimensions'] == [['Function']]
+    # every metric named is a number on the line
+    assert all(isinstance(first[metric['Name']], (int, float))
+               for metric in metrics['Metrics'])
+
+
+@mock_dynamodb2
+def test_invocation_records_failed_calls(capsys):
+    client = instrument_client(create_dynamodb_client())
+
+    with pytest.raises(RuntimeError):
+        with invocation('test_function') as record:
+            with pytest.raises(Exception):
+                client.get_item(TableName='missing', Key={'username': {'S': 'a'}})
+            raise RuntimeError('boom')
+
+    line = json.loads(capsys.readouterr().out)
+    assert line['error'] == 'RuntimeError'
+    assert line['DynamoDBCalls'] == 1
+    assert line['calls'][0]['status'] == 400
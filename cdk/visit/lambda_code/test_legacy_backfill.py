@@ -0,0 +1,90 @@
+from legacy_backfill.legacy_backfill import LegacyBackfillFunction
+import datetime
+import pytest
+from moto import mock_dynamodb2
+
+from test_utils.test_functions import *
+
+
+def stream_record(table_name, event_name, new_image):
+    return {
+        'eventName': event_name,
+        'eventSourceARN': f'arn:aws:dynamodb:us-east-1:123456789012:table/{table_name}/stream/2024-01-01T00:00:00.000',
+        'dynamodb': {'NewImage': new_image},
+    }
+
+
+test_visit_insert = stream_record('visits', 'INSERT', {
+    'visit_time': {'N': '1700000000'},
+    'username': {'S': 'jmdanie234'},
+    'location': {'S': 'Watt'},
+    'tool': {'NULL': True},
+    'last_updated': {'S': ''},
+})
+
+test_user_insert = stream_record('users', 'INSERT', {
+    'username': {'S': 'jmdanie234'},
+    'register_time': {'N': '1700000000'},
+    'first_name': {'S': 'John'},
+    'last_name': {'S': 'Doe'},
+    'gender': {'S': 'Male'},
+    'date_of_birth': {'S': '01/02/2002'},
+    'position': {'S': 'Undergraduate Student'},
+    'grad_semester': {'S': 'Fall'},
+    'grad_year': {'S': '2023'},
+    'majors': {'L': [{'S': 'Mathematical Sciences'}, {'S': 'Art'}]},
+    'minors': {'L': []},
+})
+
+test_visit_remove = stream_record('visits', 'REMOVE', {})
+
+test_user_modify = stream_record('users', 'MODIFY', dict(
+    test_user_insert['dynamodb']['NewImage'],
+    register_time={'N': '1710000000'},
+    first_name={'S': 'Johnny'},
+))
+
+
+@mock_dynamodb2
+def test_backfill_visits_and_users():
+    client = create_dynamodb_client()
+    original_table = create_original_table(client)
+
+    written = LegacyBackfillFunction(original_table).handle_stream_event(
+        {'Records': [test_visit_insert, test_user_insert, test_visit_remove]}, None)
+    assert written == 2
+
+    visit = original_table.get_item(
+        Key={'PK': '1700000000', 'SK': 'jmdanie234'})['Item']
+    assert visit['location'] == 'Watt'
+    assert visit['tool'] == ' '
+
+    user = original_table.get_item(
+        Key={'PK': 'jmdanie234', 'SK': '2023-11-14 22:13:20'})['Item']
+    assert user['firstName'] == 'John'
+    assert user['Major'] == 'Art, Mathematical Sciences'
+    assert user['Minor'] == ''
+
+
+@mock_dynamodb2
+def test_backfill_reregistration():
+    client = create_dynamodb_client()
+    original_table = create_original_table(client)
+
+    written = LegacyBackfillFunction(original_table).handle_stream_event(
+        {'Records': [test_user_modify]}, None)
+    assert written == 1
+
+    # written under the new registration time, as sync mode does
+    user = original_table.get_item(
+        Key={'PK': 'jmdanie234', 'SK': '2024-03-09 16:00:00'})['Item']
+    assert user['firstName'] == 'Johnny'
+
+
+def test_registration_sk_matches_register_user():
+    # register_user writes str(datetime.now()), which has no fraction when
+    # the microseconds are zero, and register_time is whole seconds
+    item = LegacyBackfillFunction(None).original_user_item(
+        {'username': 'jmdanie234', 'register_time': 1700000000})
+    assert item['SK'] == str(datetime.datetime(2023, 11, 14, 22, 13, 20))
+    assert item['SK'] == '2023-11-14 22:13:20'
@@ -1,9 +1,17 @@
 from log_visit.log_visit import LogVisitFunction
+from lambda_utils.bulk_writer import BulkWriteError, BulkWriter
+from test_utils.email_queue import InMemoryEmailQueue, drain
+from lambda_utils.idempotency import IdempotencyStore
+from lambda_utils.registration_email import RegistrationEmailSender
+from lambda_utils.ttl_cache import TTLCache
+from lambda_utils.visit_index import day_bucket
 from moto import mock_dynamodb2, mock_ses
 import boto3
 import pytest
 import os
 import logging
+import json
+import time
 from test_utils.test_functions import *
 
 test_log_visit_with_no_location = {
@@ -24,17 +32,305 @@ def test_visit_with_location():
     users_table = create_test_users_table(dynamodbclient)
     client = create_ses_client()
 
-    response = LogVisitFunction(original_table, visits_table, users_table, client).handle_log_visit_request(
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, client)
+    response = log_visit_function.handle_log_visit_request(
         test_log_visit_with_location, None)
     assert response['statusCode'] == 200
 
 
 @mock_dynamodb2
+@mock_ses
 def test_visit_with_no_location():
     dynamodbclient = create_dynamodb_client()
     original_table = create_original_table(dynamodbclient)
     visits_table = create_test_visit_table(dynamodbclient)
     users_table = create_test_users_table(dynamodbclient)
-    response = LogVisitFunction(original_table, visits_table, users_table, None).handle_log_visit_request(
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, None)
+    response = log_visit_function.handle_log_visit_request(
         test_log_visit_with_no_location, None)
     assert response['statusCode'] == 200
+
+
+@mock_dynamodb2
+@mock_ses
+@pytest.mark.parametrize('write_mode', ['transaction', 'batch'])
+def test_visit_written_to_both_tables(write_mode, monkeypatch):
+    monkeypatch.setenv('VISIT_WRITE_MODE', write_mode)
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    client = create_ses_client()
+
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, client)
+    response = log_visit_function.handle_log_visit_request(
+        test_log_visit_with_location, None)
+    assert response['statusCode'] == 200
+
+    original_items = original_table.scan()['Items']
+    visit_items = visits_table.scan()['Items']
+    assert len(original_items) == 1 and len(visit_items) == 1
+    assert original_items[0]['SK'] == 'jmdanie234'
+    assert original_items[0]['PK'] == str(visit_items[0]['visit_time'])
+    assert visit_items[0]['location'] == 'Watt'
+    assert visit_items[0]['day_bucket'] == day_bucket(
+        'jmdanie234', visit_items[0]['visit_time'])
+
+
+@mock_dynamodb2
+@mock_ses
+@pytest.mark.parametrize('legacy_write_mode', ['off', 'async'])
+def test_visit_skips_legacy_table(legacy_write_mode, monkeypatch):
+    monkeypatch.setenv('LEGACY_WRITE_MODE', legacy_write_mode)
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    client = create_ses_client()
+
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, client)
+    response = log_visit_function.handle_log_visit_request(
+        test_log_visit_with_location, None)
+    assert response['statusCode'] == 200
+
+    assert original_table.scan()['Count'] == 0
+    assert visits_table.scan()['Count'] == 1
+
+
+@mock_dynamodb2
+@mock_ses
+def test_unregistered_visit_sends_email():
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, client)
+    response = log_visit_function.handle_log_visit_request(
+        test_log_visit_with_location, None)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == {'was_user_registered': False}
+
+    assert client.get_send_quota()['SentLast24Hours'] == 1
+
+
+@mock_dynamodb2
+@mock_ses
+def test_registered_visit_sends_no_email():
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    users_table.put_item(Item={'username': 'jmdanie234'})
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, client)
+    response = log_visit_function.handle_log_visit_request(
+        test_log_visit_with_location, None)
+    assert json.loads(response['body']) == {'was_user_registered': True}
+
+    assert client.get_send_quota()['SentLast24Hours'] == 0
+
+
+@mock_dynamodb2
+@mock_ses
+def test_unregistered_visit_queues_one_email_per_user():
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    client = create_ses_client()
+    client.verify_email_identity(EmailAddress="no-reply@visit.cumaker.space")
+    email_queue = InMemoryEmailQueue()
+
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, client, email_queue)
+    for _ in range(5):
+        response = log_visit_function.handle_log_visit_request(
+            test_log_visit_with_location, None)
+        assert response['statusCode'] == 200
+
+    # nothing is sent from the request path when there is a queue
+    assert client.get_send_quota()['SentLast24Hours'] == 0
+    assert len(email_queue) == 5
+
+    sender = RegistrationEmailSender(client, dedupe_window_seconds=3600)
+    assert drain(sender, email_queue, batch_size=2) == 1
+    assert len(email_queue) == 0
+    assert client.get_send_quota()['SentLast24Hours'] == 1
+
+
+@mock_dynamodb2
+@mock_ses
+def test_registration_cache_skips_users_table():
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    users_table.put_item(Item={'username': 'jmdanie234'})
+    client = create_ses_client()
+
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, client)
+
+    lookups = []
+    users_table.meta.client.meta.events.register(
+        'before-call.dynamodb.GetItem', lambda **kwargs: lookups.append(1))
+
+    for _ in range(3):
+        assert log_visit_function.isUserRegistered('jmdanie234')
+    assert not log_visit_function.isUserRegistered('leejohn')
+    assert not log_visit_function.isUserRegistered('leejohn')
+
+    assert len(lookups) == 2
+    assert log_visit_function.registration_cache.stats()['hits'] == 3
+
+
+def test_ttl_cache_expires_and_evicts():
+    now = [0]
+    cache = TTLCache(max_size=2, clock=lambda: now[0])
+
+    cache.put('registered', True, 100)
+    cache.put('unregistered', False, 10)
+    assert cache.get('unregistered') == (True, False)
+
+    now[0] = 50
+    assert cache.get('unregistered') == (False, None)
+    assert cache.get('registered') == (True, True)
+
+    cache.put('a', True, 100)
+    cache.put('b', True, 100)
+    assert cache.get('registered') == (False, None)
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 2,
+                             'expirations': 1, 'evictions': 1}
+
+
+@mock_dynamodb2
+def test_visit_batch_logs_each_visit():
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    users_table.put_item(Item={'username': 'registered'})
+    email_queue = InMemoryEmailQueue()
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, None, email_queue=email_queue)
+
+    # queued by a kiosk that was offline for a day
+    queued_at = int(time.time()) - 86400
+    visits = [{'username': 'registered', 'location': 'Watt',
+               'visit_time': queued_at + i} for i in range(60)]
+    visits += [
+        {'username': 'new_user', 'location': 'Cooper', 'visit_time': queued_at + 100},
+        {'username': 'new_user', 'location': 'Cooper', 'visit_time': queued_at + 200},
+        {'location': 'Watt'},
+        {'username': 'registered', 'visit_time': 'yesterday'},
+        {'username': 'registered', 'location': 'Watt'},
+    ]
+    response = log_visit_function.handle_log_visit_batch_request(
+        {'body': json.dumps({'visits': visits})}, None)
+    assert response['statusCode'] == 200
+
+    body = json.loads(response['body'])
+    assert body['logged'] == 62
+    results = body['results']
+    assert [r['index'] for r in results] == list(range(65))
+    assert results[0] == {'index': 0, 'status': 'logged',
+                          'was_user_registered': True}
+    assert results[60]['was_user_registered'] is False
+    assert results[62] == {'index': 62, 'status': 'rejected',
+                           'message': 'Missing parameter: username'}
+    assert results[63]['status'] == 'rejected'
+    assert results[64] == {'index': 64, 'status': 'rejected',
+                           'message': 'Missing parameter: visit_time'}
+
+    assert visits_table.scan()['Count'] == 62
+    assert original_table.scan()['Count'] == 62
+    stored = visits_table.get_item(
+        Key={'username': 'new_user', 'visit_time': queued_at + 100})['Item']
+    assert stored['day_bucket'] == day_bucket('new_user', queued_at + 100)
+
+    # one email per unregistered user, however many visits they had
+    assert [message['username'] for _, message in email_queue.receive()] == ['new_user']
+
+
+@mock_dynamodb2
+def test_failed_visit_batch_closes_every_writer(monkeypatch):
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    log_visit_function = LogVisitFunction(
+        original_table, create_test_visit_table(dynamodbclient),
+        create_test_users_table(dynamodbclient), None,
+        email_queue=InMemoryEmailQueue())
+
+    flush, close = BulkWriter.flush, BulkWriter.close
+    closed = []
+
+    def failing_flush(writer):
+        if writer.table_name == 'visits':
+            raise BulkWriteError('throttled')
+        flush(writer)
+
+    def recorded_close(writer):
+        closed.append(writer.table_name)
+        close(writer)
+
+    monkeypatch.setattr(BulkWriter, 'flush', failing_flush)
+    monkeypatch.setattr(BulkWriter, 'close', recorded_close)
+
+    visits = [{'username': 'jmdanie234', 'visit_time': int(time.time())}]
+    response = log_visit_function.handle_log_visit_batch_request(
+        {'body': json.dumps({'visits': visits})}, None)
+
+    assert response['statusCode'] == 503
+    assert closed == ['visits', original_table.name]
+    # the other writer still flushed its batch
+    assert original_table.scan()['Count'] == 1
+
+
+@mock_dynamodb2
+def test_visit_batch_rejects_bad_batches():
+    dynamodbclient = create_dynamodb_client()
+    log_visit_function = LogVisitFunction(
+        create_original_table(dynamodbclient),
+        create_test_visit_table(dynamodbclient),
+        create_test_users_table(dynamodbclient), None,
+        email_queue=InMemoryEmailQueue())
+
+    for body in ['[]', '{}', json.dumps({'visits': [{'username': 'a'}] * 501})]:
+        response = log_visit_function.handle_log_visit_batch_request(
+            {'body': body}, None)
+        assert response['statusCode'] == 400
+
+
+@mock_dynamodb2
+def test_retried_visit_is_logged_once():
+    dynamodbclient = create_dynamodb_client()
+    original_table = create_original_table(dynamodbclient)
+    visits_table = create_test_visit_table(dynamodbclient)
+    users_table = create_test_users_table(dynamodbclient)
+    email_queue = InMemoryEmailQueue()
+    log_visit_function = LogVisitFunction(
+        original_table, visits_table, users_table, None,
+        email_queue=email_queue,
+        idempotency_store=IdempotencyStore(create_test_idempotency_table(dynamodbclient)))
+
+    request = dict(test_log_visit_with_location,
+                   httpMethod='POST', headers={'Idempotency-Key': 'kiosk-1-42'})
+    first = log_visit_function.handle_log_visit_request(request, None)
+    retry = log_visit_function.handle_log_visit_request(request, None)
+
+    assert first['statusCode'] == retry['statusCode'] == 200
+    assert first['body'] == retry['body']
+    assert visits_table.scan()['Count'] == 1
+    assert original_table.scan()['Count'] == 1
+    assert len(email_queue) == 1
@@ -1,4 +1,4 @@
-from quiz.quiz import QuizFunction
+from quiz.quiz import QuizFunction, QuizCatalogCache
 from responses import mock
 import pytest
 import os
@@ -129,3 +129,109 @@ def test_get_quiz_progress_fail():
         test_get_quiz_progress_fail_1, None)
 
     assert response['statusCode'] == 400
+
+
+@mock_dynamodb2
+def test_get_quiz_progress_ignores_other_users():
+    client = create_dynamodb_client()
+    quiz_list_table = create_test_quiz_list_table(client)
+    quiz_progress_table = create_test_quiz_progress_table(client)
+
+    quiz_list_table.put_item(Item={'quiz_id': 'quiz1'})
+    quiz_list_table.put_item(Item={'quiz_id': 'quiz2'})
+
+    username = test_get_quiz_progress_pass_1["pathParameters"]['username']
+
+    quiz_progress_table.put_item(
+        Item={'username': username, 'quiz_id': 'quiz1', 'state': 0})
+    quiz_progress_table.put_item(
+        Item={'username': 'other_user', 'quiz_id': 'quiz2', 'state': 1})
+
+    response = QuizFunction(quiz_list_table, quiz_progress_table, client).handle_quiz_request(
+        test_get_quiz_progress_pass_1, None)
+
+    assert response['statusCode'] == 200
+    assert sorted(json.loads(response['body']), key=lambda q: q['quiz_id']) == [
+        {'quiz_id': 'quiz1', 'state': 0},
+        {'quiz_id': 'quiz2', 'state': -1}
+    ]
+
+
+@mock_dynamodb2
+def test_quiz_catalog_cache_skips_catalog_reads():
+    client = create_dynamodb_client()
+    quiz_list_table = create_test_quiz_list_table(client)
+    quiz_progress_table = create_test_quiz_progress_table(client)
+
+    quiz_list_table.put_item(Item={'quiz_id': 'quiz1'})
+
+    cache = QuizCatalogCache(ttl_seconds=300)
+    quiz_function = QuizFunction(
+        quiz_list_table, quiz_progress_table, client, cache)
+
+    quiz_function.handle_quiz_request(test_get_quiz_progress_pass_1, None)
+    quiz_function.handle_quiz_request(test_get_quiz_progress_pass_1, None)
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+    calls = []
+    quiz_list_table.meta.client.meta.events.register(
+        'before-call.dynamodb.*', lambda **kwargs: calls.append(kwargs['model'].name))
+
+    # a quiz added behind the cache's back is read on its own, not by
+    # scanning the catalog again
+    quiz_list_table.put_item(Item={'quiz_id': 'quiz2'})
+    calls.clear()
+    assert quiz_function.does_quiz_exist('quiz2')
+    assert not quiz_function.does_quiz_exist('quiz3')
+    assert quiz_function.does_quiz_exist('quiz2')
+    assert quiz_function.does_quiz_exist('quiz1')
+    assert calls == ['GetItem', 'GetItem']
+    assert cache.stats() == {'hits': 3, 'misses': 3}
+
+    response = quiz_function.handle_quiz_request(
+        test_get_quiz_progress_pass_1, None)
+    assert len(json.loads(response['body'])) == 2
+    assert cache.stats() == {'hits': 4, 'misses': 3}
+
+
+@mock_dynamodb2
+def test_quiz_catalog_cache_expires():
+    client = create_dynamodb_client()
+    quiz_list_table = create_test_quiz_list_table(client)
+    quiz_progress_table = create_test_quiz_progress_table(client)
+
+    cache = QuizCatalogCache(ttl_seconds=0)
+    quiz_function = QuizFunction(
+        quiz_list_table, quiz_progress_table, client, cache)
+
+    quiz_function.handle_quiz_request(test_get_quiz_progress_pass_1, None)
+    quiz_function.handle_quiz_request(test_get_quiz_progress_pass_1, None)
+    assert cache.stats() == {'hits': 0, 'misses': 2}
+
+
+@mock_dynamodb2
+def test_submit_quiz_known_id_writes_once():
+    client = create_dynamodb_client()
+    quiz_list_table = create_test_quiz_list_table(client)
+    quiz_progress_table = create_test_quiz_progress_table(client)
+
+    # the quiz already exists but this container has never seen it
+    quiz_list_table.put_item(Item={'quiz_id': '3dPrinter', 'last_updated': 1})
+
+    quiz_function = QuizFunction(quiz_list_table, quiz_progress_table, client)
+
+    calls = []
+    quiz_list_table.meta.client.meta.events.register(
+        'before-call.dynamodb.*', lambda **kwargs: calls.append(kwargs['model'].name))
+
+    response = quiz_function.handle_quiz_request(test_submit_quiz_pass, None)
+    assert response['statusCode'] == 200
+    # the conditional write fails and leaves the existing item alone
+    assert calls == ['PutItem']
+
+    response = quiz_function.handle_quiz_request(test_submit_quiz_fail_2, None)
+    assert response['statusCode'] == 200
+    assert calls == ['PutItem']
+
+    assert quiz_list_table.get_item(Key={'quiz_id': '3dPrinter'})[
+        'Item']['last_updated'] == 1
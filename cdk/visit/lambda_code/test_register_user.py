@@ -1,4 +1,5 @@
 from register_user.register_user import RegisterUserFunction
+from lambda_utils.idempotency import IdempotencyStore
 from responses import mock
 import pytest
 import os
@@ -31,3 +32,38 @@ def test_visit_with_location():
     response = RegisterUserFunction(
         table, users_table, client).handle_register_user_request(test_register_user, None)
     assert response['statusCode'] == 200
+
+
+@mock_dynamodb2
+@pytest.mark.parametrize('legacy_write_mode', ['off', 'async'])
+def test_register_skips_legacy_table(legacy_write_mode, monkeypatch):
+    monkeypatch.setenv('LEGACY_WRITE_MODE', legacy_write_mode)
+    client = create_dynamodb_client()
+    table = create_original_table(client)
+    users_table = create_test_users_table(client)
+
+    response = RegisterUserFunction(
+        table, users_table, client).handle_register_user_request(test_register_user, None)
+    assert response['statusCode'] == 200
+
+    assert table.scan()['Count'] == 0
+    assert users_table.scan()['Count'] == 1
+
+
+@mock_dynamodb2
+def test_retried_registration_is_written_once():
+    client = create_dynamodb_client()
+    table = create_original_table(client)
+    users_table = create_test_users_table(client)
+    register_user_function = RegisterUserFunction(
+        table, users_table, client,
+        idempotency_store=IdempotencyStore(create_test_idempotency_table(client)))
+
+    request = dict(test_register_user, headers={'idempotency-key': 'abc'})
+    for _ in range(2):
+        response = register_user_function.handle_register_user_request(
+            request, None)
+        assert response['statusCode'] == 200
+
+    # the legacy table gets a new row per registration, so a retry shows
+    assert table.scan()['Count'] == 1
@@ -0,0 +1,62 @@
+""" An in-memory registration email queue for tests and benchmarks
+
+    InMemoryEmailQueue takes the place of SqsEmailQueue, and drain stands in
+    for the queue event source, so a test can drive log_visit and the email
+    sender directly.
+"""
+import collections
+import itertools
+import json
+
+from botocore.exceptions import ClientError
+
+
+class InMemoryEmailQueue():
+
+    def __init__(self):
+        self.messages = collections.OrderedDict()
+        self.in_flight = {}
+        self.handles = itertools.count()
+
+    def send(self, message):
+        self.messages[str(next(self.handles))] = json.dumps(message)
+
+    def receive(self, max_messages=10):
+        """
+        Up to max_messages (handle, message) pairs, left in flight until
+        they are deleted.
+        """
+        received = []
+        while self.messages and len(received) < max_messages:
+            handle, body = self.messages.popitem(last=False)
+            self.in_flight[handle] = body
+            received.append((handle, json.loads(body)))
+        return received
+
+    def delete(self, handles):
+        for handle in handles:
+            self.in_flight.pop(handle, None)
+
+    def __len__(self):
+        return len(self.messages) + len(self.in_flight)
+
+
+def drain(sender, queue, batch_size=10):
+    """
+    Send every request waiting on queue with sender (a
+    RegistrationEmailSender), batch_size messages at a time. A message whose
+    send failed is left in flight. Returns the number of emails sent.
+    """
+    sent = 0
+    while True:
+        batch = queue.receive(batch_size)
+        if not batch:
+            return sent
+        handled = []
+        for handle, message in batch:
+            try:
+                sent += sender.send(message['username'])
+            except ClientError:
+                continue
+            handled.append(handle)
+        queue.delete(handled)
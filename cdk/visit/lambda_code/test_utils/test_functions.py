@@ -50,11 +50,11 @@ def create_test_visit_table(client):
         TableName=table_name,
         KeySchema=[
             {
-                'AttributeName': 'visit_time',
+                'AttributeName': 'username',
                 'KeyType': 'HASH'  # Partition key
             },
             {
-                'AttributeName': 'username',
+                'AttributeName': 'visit_time',
                 'KeyType': 'RANGE'  # Sort key
             },
         ],
@@ -67,6 +67,30 @@ def create_test_visit_table(client):
                 'AttributeName': 'username',
                 'AttributeType': 'S'
             },
+            {
+                'AttributeName': 'day_bucket',
+                'AttributeType': 'S'
+            },
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'visits_by_day',
+                'KeySchema': [
+                    {
+                        'AttributeName': 'day_bucket',
+                        'KeyType': 'HASH'
+                    },
+                    {
+                        'AttributeName': 'visit_time',
+                        'KeyType': 'RANGE'
+                    },
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 5,
+                    'WriteCapacityUnits': 5
+                }
+            },
         ],
         ProvisionedThroughput={
             'ReadCapacityUnits': 5,
@@ -186,3 +210,98 @@ def create_test_quiz_progress_table(client):
     table.wait_until_exists()
 
     return table
+
+
+def create_test_visit_counts_table(client):
+    table_name = 'visit_counts'
+    resource = boto3.resource('dynamodb', region_name='us-east-1')
+
+    table = resource.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'location',
+                'KeyType': 'HASH'  # Partition key
+            },
+            {
+                'AttributeName': 'bucket',
+                'KeyType': 'RANGE'  # Sort key
+            },
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'location',
+                'AttributeType': 'S'
+            },
+            {
+                'AttributeName': 'bucket',
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+
+    table.wait_until_exists()
+
+    return table
+
+
+def create_test_idempotency_table(client):
+    table_name = 'idempotency'
+    resource = boto3.resource('dynamodb', region_name='us-east-1')
+
+    table = resource.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'idempotency_key',
+                'KeyType': 'HASH'  # Partition key
+            },
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'idempotency_key',
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+
+    table.wait_until_exists()
+
+    return table
+
+
+def create_test_email_sends_table(client):
+    table_name = 'email_sends'
+    resource = boto3.resource('dynamodb', region_name='us-east-1')
+
+    table = resource.create_table(
+        TableName=table_name,
+        KeySchema=[
+            {
+                'AttributeName': 'recipient',
+                'KeyType': 'HASH'  # Partition key
+            },
+        ],
+        AttributeDefinitions=[
+            {
+                'AttributeName': 'recipient',
+                'AttributeType': 'S'
+            },
+        ],
+        ProvisionedThroughput={
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    )
+
+    table.wait_until_exists()
+
+    return table
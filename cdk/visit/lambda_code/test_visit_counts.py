@@ -0,0 +1,135 @@
+from visit_counts.visit_counts import VisitCountsFunction
+from lambda_utils.visit_counts import query_counts, totals
+import pytest
+from moto import mock_dynamodb2
+
+from test_utils.test_functions import *
+
+
+def visit_record(event_name, visit_time, location, tool, username='jmdanie234'):
+    new_image = {
+        'visit_time': {'N': str(visit_time)},
+        'username': {'S': username},
+        'location': {'S': location},
+        'tool': {'S': tool} if tool else {'NULL': True},
+    }
+    return {
+        'eventName': event_name,
+        'eventSourceARN': 'arn:aws:dynamodb:us-east-1:123456789012:table/visits/stream/2024-01-01T00:00:00.000',
+        'dynamodb': {'NewImage': new_image,
+                     'SequenceNumber': str(visit_time)},
+    }
+
+
+# 2023-11-14 22:13:20 UTC
+VISIT_TIME = 1700000000
+
+
+@mock_dynamodb2
+def test_counts_visits_by_location_day_hour_and_tool():
+    client = create_dynamodb_client()
+    counts_table = create_test_visit_counts_table(client)
+    visit_counts_function = VisitCountsFunction(
+        counts_table, create_test_idempotency_table(client))
+
+    response = visit_counts_function.handle_stream_event({'Records': [
+        visit_record('INSERT', VISIT_TIME, 'Watt', 'Laser Cutter'),
+        visit_record('INSERT', VISIT_TIME + 60, 'Watt', 'Laser Cutter'),
+        visit_record('INSERT', VISIT_TIME + 3600, 'Watt', 'Laser Cutter'),
+        visit_record('INSERT', VISIT_TIME, 'Watt', None, username='jd'),
+        visit_record('INSERT', VISIT_TIME, 'Cooper', 'Visiting', username='jj'),
+        visit_record('MODIFY', VISIT_TIME, 'Watt', 'Laser Cutter'),
+        # the same visit twice in a batch
+        visit_record('INSERT', VISIT_TIME + 60, 'Watt', 'Laser Cutter'),
+    ]}, None)
+    assert response == {'batchItemFailures': []}
+
+    # a second batch adds to the same counter
+    visit_counts_function.handle_stream_event({'Records': [
+        visit_record('INSERT', VISIT_TIME + 120, 'Watt', 'Laser Cutter')]}, None)
+
+    counter = counts_table.get_item(Key={
+        'location': 'Watt', 'bucket': '2023-11-14#22#Laser Cutter'})['Item']
+    assert counter['visit_count'] == 3
+    assert counter['hour'] == 22
+
+    watt = query_counts(counts_table, 'Watt', '2023-11-14', '2023-11-15')
+    assert totals(watt, 'day') == {'2023-11-14': 5}
+    assert totals(watt, 'hour') == {22: 4, 23: 1}
+    assert totals(watt, 'tool') == {'Laser Cutter': 4, 'unknown': 1}
+    assert query_counts(counts_table, 'Watt', '2023-11-15', '2023-11-16') == []
+
+
+@mock_dynamodb2
+def test_counts_in_the_configured_time_zone(monkeypatch):
+    monkeypatch.setenv('VISIT_COUNTS_TIMEZONE', 'America/New_York')
+    client = create_dynamodb_client()
+    counts_table = create_test_visit_counts_table(client)
+
+    VisitCountsFunction(
+        counts_table, create_test_idempotency_table(client)).handle_stream_event({'Records': [
+        visit_record('INSERT', VISIT_TIME, 'Watt', 'Visiting')]}, None)
+
+    counts = query_counts(counts_table, 'Watt', '2023-11-14', '2023-11-14')
+    assert [(c['day'], c['hour']) for c in counts] == [('2023-11-14', 17)]
+
+
+@mock_dynamodb2
+def test_a_retried_batch_counts_each_visit_once():
+    client = create_dynamodb_client()
+    counts_table = create_test_visit_counts_table(client)
+    visit_counts_function = VisitCountsFunction(
+        counts_table, create_test_idempotency_table(client))
+
+    first = [visit_record('INSERT', VISIT_TIME + i, 'Watt', 'Visiting')
+             for i in range(3)]
+    visit_counts_function.handle_stream_event({'Records': first}, None)
+
+    # delivered again with a new visit to the same counter, and more than
+    # a transaction's worth of visits to another
+    retried = first + [visit_record('INSERT', VISIT_TIME + 3, 'Watt', 'Visiting')] + [
+        visit_record('INSERT', VISIT_TIME + 3600 + i, 'Watt', 'Visiting')
+        for i in range(30)]
+    assert visit_counts_function.handle_stream_event(
+        {'Records': retried}, None) == {'batchItemFailures': []}
+    assert visit_counts_function.handle_stream_event(
+        {'Records': retried}, None) == {'batchItemFailures': []}
+
+    watt = query_counts(counts_table, 'Watt', '2023-11-14', '2023-11-14')
+    assert totals(watt, 'hour') == {22: 4, 23: 30}
+
+
+@mock_dynamodb2
+def test_reports_the_first_visit_not_counted(monkeypatch):
+    client = create_dynamodb_client()
+    counts_table = create_test_visit_counts_table(client)
+    visit_counts_function = VisitCountsFunction(
+        counts_table, create_test_idempotency_table(client))
+
+    increment = VisitCountsFunction.increment
+
+    def fail_at_cooper(self, key, visits):
+        if key['location'] == 'Cooper':
+            raise RuntimeError('throttled')
+        return increment(self, key, visits)
+
+    monkeypatch.setattr(VisitCountsFunction, 'increment', fail_at_cooper)
+
+    records = [
+        visit_record('INSERT', VISIT_TIME, 'Watt', 'Visiting'),
+        visit_record('INSERT', VISIT_TIME + 1, 'Cooper', 'Visiting'),
+        visit_record('INSERT', VISIT_TIME + 2, 'Watt', 'Visiting'),
+        visit_record('INSERT', VISIT_TIME + 3, 'Makerspace', 'Visiting'),
+    ]
+    assert visit_counts_function.handle_stream_event({'Records': records}, None) == {
+        'batchItemFailures': [{'itemIdentifier': str(VISIT_TIME + 1)}]}
+
+    # the retry starts at the failure, and Watt is not counted again
+    monkeypatch.setattr(VisitCountsFunction, 'increment', increment)
+    assert visit_counts_function.handle_stream_event({'Records': records[1:]}, None) == {
+        'batchItemFailures': []}
+
+    for location in ('Watt', 'Cooper', 'Makerspace'):
+        counts = query_counts(counts_table, location, '2023-11-14', '2023-11-14')
+        assert totals(counts, 'day') == {
+            '2023-11-14': 2 if location == 'Watt' else 1}
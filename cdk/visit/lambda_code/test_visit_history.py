@@ -0,0 +1,182 @@
+from visit_history.visit_history import (VisitHistoryFunction, MAX_PAGE_SIZE,
+                                         MAX_RANGE_DAYS)
+from lambda_utils.visit_index import day_bucket
+import base64
+import json
+import pytest
+from moto import mock_dynamodb2
+
+from test_utils.test_functions import *
+
+# 2023-11-14 22:13:20 UTC
+VISIT_TIME = 1700000000
+
+
+def seed_visits(visits_table, count):
+    with visits_table.batch_writer() as batch:
+        for i in range(count):
+            visit_time = VISIT_TIME + i * 1800
+            username = f'user{i % 5}'
+            batch.put_item(Item={
+                'visit_time': visit_time,
+                'username': username,
+                'location': 'Cooper' if i % 2 else 'Watt',
+                'day_bucket': day_bucket(username, visit_time),
+            })
+
+
+def get_pages(visit_history_function, **parameters):
+    """
+    Follow next_cursor until the last page, returning every page.
+    """
+    pages = []
+    while True:
+        response = visit_history_function.handle_visit_history_request(
+            {'queryStringParameters': {k: str(v) for k, v in parameters.items()}}, None)
+        assert response['statusCode'] == 200
+        page = json.loads(response['body'])
+        pages.append(page)
+        if page['next_cursor'] is None:
+            return pages
+        parameters['cursor'] = page['next_cursor']
+
+
+@mock_dynamodb2
+def test_pages_through_a_time_range():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    seed_visits(visits_table, 200)
+    visit_history_function = VisitHistoryFunction(visits_table)
+
+    start, end = VISIT_TIME + 20 * 1800, VISIT_TIME + 150 * 1800
+    pages = get_pages(visit_history_function, start=start, end=end, limit=7)
+
+    visit_times = [v['visit_time'] for page in pages for v in page['visits']]
+    assert visit_times == [VISIT_TIME + i * 1800 for i in range(20, 151)]
+    assert all(page['count'] <= 7 for page in pages)
+
+    watt = get_pages(visit_history_function, start=start, end=end,
+                     location='Watt', limit=50)
+    assert [v['visit_time'] for page in watt for v in page['visits']] == [
+        VISIT_TIME + i * 1800 for i in range(20, 151) if i % 2 == 0]
+
+
+@mock_dynamodb2
+def test_pages_through_one_users_visits():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    seed_visits(visits_table, 100)
+    visit_history_function = VisitHistoryFunction(visits_table)
+
+    pages = get_pages(visit_history_function, username='user3', limit=6)
+    visits = [v for page in pages for v in page['visits']]
+    assert sorted(v['visit_time'] for v in visits) == [
+        VISIT_TIME + i * 1800 for i in range(100) if i % 5 == 3]
+    assert {v['username'] for v in visits} == {'user3'}
+
+    cooper = get_pages(visit_history_function, username='user3',
+                       location='Cooper', start=VISIT_TIME, end=VISIT_TIME + 50 * 1800)
+    assert sorted(v['visit_time'] for page in cooper for v in page['visits']) == [
+        VISIT_TIME + i * 1800 for i in range(51) if i % 5 == 3 and i % 2]
+
+
+@mock_dynamodb2
+@pytest.mark.parametrize('parameters', [
+    {},
+    {'start': str(VISIT_TIME)},
+    {'start': 'yesterday', 'end': str(VISIT_TIME)},
+    {'start': str(VISIT_TIME), 'end': str(VISIT_TIME), 'cursor': 'not a cursor'},
+    {'start': str(VISIT_TIME), 'end': str(VISIT_TIME + MAX_RANGE_DAYS * 86400 + 1)},
+])
+def test_rejects_bad_parameters(parameters):
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+
+    response = VisitHistoryFunction(visits_table).handle_visit_history_request(
+        {'queryStringParameters': parameters}, None)
+    assert response['statusCode'] == 400
+
+
+@mock_dynamodb2
+def test_caps_the_page_size():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    seed_visits(visits_table, MAX_PAGE_SIZE + 10)
+
+    response = VisitHistoryFunction(visits_table).handle_visit_history_request(
+        {'queryStringParameters': {'start': str(VISIT_TIME),
+                                   'end': str(VISIT_TIME + MAX_RANGE_DAYS * 86400),
+                                   'limit': str(MAX_PAGE_SIZE * 10)}}, None)
+    page = json.loads(response['body'])
+    assert page['count'] == MAX_PAGE_SIZE
+    assert page['next_cursor'] is not None
+
+
+@mock_dynamodb2
+def test_long_ranges_are_only_read_by_username():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    seed_visits(visits_table, 10)
+    visit_history_function = VisitHistoryFunction(visits_table)
+    parameters = {'start': str(VISIT_TIME - 365 * 86400), 'end': str(VISIT_TIME + 86400)}
+
+    response = visit_history_function.handle_visit_history_request(
+        {'queryStringParameters': parameters}, None)
+    assert response['statusCode'] == 400
+    assert f'{MAX_RANGE_DAYS} days' in json.loads(response['body'])['Message']
+
+    # one user's visits are a single query however long the range
+    pages = get_pages(visit_history_function, username='user1', **parameters)
+    assert [v['visit_time'] for page in pages for v in page['visits']] == [
+        VISIT_TIME + 1800, VISIT_TIME + 6 * 1800]
+
+
+def cursor_token(typed):
+    return base64.urlsafe_b64encode(json.dumps(typed).encode()).decode()
+
+
+def index_key(bucket, visit_time=VISIT_TIME):
+    return {'M': {'day_bucket': {'S': bucket}, 'visit_time': {'N': str(visit_time)},
+                  'username': {'S': 'user0'}}}
+
+
+@mock_dynamodb2
+@pytest.mark.parametrize('typed', [
+    {'M': {'day': {'N': '1'}, 'after': {'M': {}}}},
+    {'M': {'day': {'S': 'tuesday'}, 'after': {'M': {}}}},
+    {'M': {'day': {'S': '2023-10-01'}, 'after': {'M': {}}}},
+    {'M': {'day': {'S': '2023-11-14'}, 'after': {'L': []}}},
+    {'M': {'day': {'S': '2023-11-14'}, 'after': {'M': {'2023-11-14#9': index_key('2023-11-14#9')}}}},
+    {'M': {'day': {'S': '2023-11-14'}, 'after': {'M': {'2023-11-14#0': index_key('2023-11-15#0')}}}},
+    {'M': {'day': {'S': '2023-11-14'}, 'after': {'M': {'2023-11-14#0': {'S': 'key'}}}}},
+    {'M': {'day': {'S': '2023-11-14'}, 'after': {'M': {'2023-11-14#0': {'M': {
+        'day_bucket': {'S': '2023-11-14#0'}, 'visit_time': {'S': 'noon'},
+        'username': {'S': 'user0'}}}}}}},
+    {'M': {'username': {'S': 'user0'}, 'visit_time': {'N': str(VISIT_TIME)}}},
+    {'N': 'not a number'},
+])
+def test_rejects_malformed_cursors(typed):
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+
+    response = VisitHistoryFunction(visits_table).handle_visit_history_request(
+        {'queryStringParameters': {'start': str(VISIT_TIME),
+                                   'end': str(VISIT_TIME + 86400),
+                                   'cursor': cursor_token(typed)}}, None)
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'Message': 'cursor is not valid'}
+
+
+@mock_dynamodb2
+def test_user_cursor_must_be_of_the_same_user():
+    client = create_dynamodb_client()
+    visits_table = create_test_visit_table(client)
+    visit_history_function = VisitHistoryFunction(visits_table)
+
+    for typed in ({'M': {'username': {'S': 'user1'}, 'visit_time': {'N': str(VISIT_TIME)}}},
+                  {'M': {'username': {'S': 'user0'}, 'visit_time': {'S': 'noon'}}},
+                  {'M': {'day': {'S': '2023-11-14'}, 'after': {'M': {}}}}):
+        response = visit_history_function.handle_visit_history_request(
+            {'queryStringParameters': {'username': 'user0',
+                                       'cursor': cursor_token(typed)}}, None)
+        assert response['statusCode'] == 400
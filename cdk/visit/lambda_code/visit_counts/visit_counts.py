@@ -0,0 +1,191 @@
+import logging
+import os
+import time
+from zoneinfo import ZoneInfo
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+from lambda_utils import aws_clients
+from lambda_utils.instrumentation import instrumented
+from lambda_utils.visit_counts import counter_key
+
+
+class VisitCountsFunction():
+    """
+    Counts new visits into the visit counts table.
+
+    This lambda is subscribed to the visits table stream. For every new
+    visit it adds one to the counter for the visit's location, local day,
+    local hour and tool (see lambda_utils.visit_counts), so dashboards can
+    read counts without scanning the visits table.
+
+    Stream records are delivered again when a batch is retried, so every
+    visit is counted in a transaction with a marker item in the idempotency
+    table, keyed on the visit. The marker is put only if it is not there
+    yet, so a visit that was already counted cancels its own transaction
+    and is not counted twice. Markers expire after the stream's 24 hour
+    retention, when the record can no longer be delivered.
+
+    The visits of a batch that share a counter are counted together, in
+    transactions of up to MAX_VISITS_PER_TRANSACTION markers and one ADD.
+    If one of those is cancelled its visits are counted one at a time.
+
+    When a counter cannot be updated the batch stops, and the first visit
+    not yet counted is returned as a batchItemFailure, so the retry starts
+    there instead of at the start of the batch.
+
+    Like the other lambdas, the tables can be passed in so it can be tested
+    with moto.
+    """
+
+    # a transaction holds at most 25 items, one of which is the counter
+    MAX_VISITS_PER_TRANSACTION = 24
+
+    # the stream keeps records for 24 hours
+    MARKER_TTL_SECONDS = 86400
+
+    def __init__(self, counts_table, markers_table, clock=time.time):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.INFO)
+
+        self.deserializer = TypeDeserializer()
+        self.clock = clock
+
+        # days and hours are counted in the makerspace's time zone
+        self.timezone = ZoneInfo(os.environ.get('VISIT_COUNTS_TIMEZONE', 'UTC'))
+
+        if counts_table is None:
+            VISIT_COUNTS_TABLE_NAME = os.environ['VISIT_COUNTS_TABLE_NAME']
+            self.counts = aws_clients.LazyTable(VISIT_COUNTS_TABLE_NAME)
+        else:
+            self.counts = counts_table
+
+        if markers_table is None:
+            IDEMPOTENCY_TABLE_NAME = os.environ['IDEMPOTENCY_TABLE_NAME']
+            self.markers = aws_clients.LazyTable(IDEMPOTENCY_TABLE_NAME)
+        else:
+            self.markers = markers_table
+
+    def deserialize(self, image):
+        return {key: self.deserializer.deserialize(value)
+                for key, value in image.items()}
+
+    def marker(self, visit, expires_at):
+        return {'Put': {
+            'TableName': self.markers.name,
+            'Item': {
+                'idempotency_key': f"visit_counts#{visit['username']}#{visit['visit_time']}",
+                'expires_at': expires_at,
+            },
+            # TTL deletes lazily, so an expired marker can still be there
+            'ConditionExpression': 'attribute_not_exists(idempotency_key) '
+                                   'OR expires_at < :now',
+            'ExpressionAttributeValues': {':now': int(self.clock())},
+        }}
+
+    def increment(self, key, visits):
+        """
+        Count visits into the counter for key in one transaction, unless
+        one of them was counted before.
+        """
+        expires_at = int(self.clock()) + self.MARKER_TTL_SECONDS
+        self.counts.meta.client.transact_write_items(TransactItems=[
+            self.marker(visit, expires_at) for visit in visits] + [{'Update': {
+                'TableName': self.counts.name,
+                'Key': {'location': key['location'], 'bucket': key['bucket']},
+                'UpdateExpression': 'ADD visit_count :visits '
+                                    'SET #day = :day, #hour = :hour, tool = :tool',
+                'ExpressionAttributeNames': {'#day': 'day', '#hour': 'hour'},
+                'ExpressionAttributeValues': {
+                    ':visits': len(visits),
+                    ':day': key['day'],
+                    ':hour': key['hour'],
+                    ':tool': key['tool'],
+                },
+            }}])
+
+    def count(self, key, visits):
+        """
+        Count visits that were not counted before. Returns how many were.
+        """
+        try:
+            self.increment(key, visits)
+            return len(visits)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            if len(visits) == 1:
+                if not already_counted(e):
+                    raise
+                return 0
+
+        # some were counted before, by an earlier delivery of the batch
+        return sum(self.count(key, [visit]) for visit in visits)
+
+    def handle_stream_event(self, event, context):
+        """
+        Count every inserted visit in the stream batch. Returns the first
+        record that could not be counted, if any, as a batchItemFailure.
+        """
+        keys = {}
+        batches = {}
+        seen = set()
+        for record in event.get('Records', []):
+            # a MODIFY is a visit written again, which was already counted
+            if record['eventName'] != 'INSERT':
+                continue
+
+            visit = self.deserialize(record['dynamodb']['NewImage'])
+            # a transaction cannot put the same marker twice
+            if (visit['username'], visit['visit_time']) in seen:
+                continue
+            seen.add((visit['username'], visit['visit_time']))
+
+            key = counter_key(visit, self.timezone)
+            counter = (key['location'], key['bucket'])
+            keys[counter] = key
+            batches.setdefault(counter, []).append(
+                (record['dynamodb']['SequenceNumber'], visit))
+
+        chunks = [(counter, records[start:start + self.MAX_VISITS_PER_TRANSACTION])
+                  for counter, records in batches.items()
+                  for start in range(0, len(records), self.MAX_VISITS_PER_TRANSACTION)]
+
+        counted = 0
+        for index, (counter, records) in enumerate(chunks):
+            try:
+                counted += self.count(
+                    keys[counter], [visit for _, visit in records])
+            except Exception:
+                self.logger.exception('could not count visits into %s', counter)
+                # everything from here on is retried, and visits already
+                # counted are skipped by their markers
+                first = min((sequence_number
+                             for _, remaining in chunks[index:]
+                             for sequence_number, _ in remaining), key=int)
+                return {'batchItemFailures': [{'itemIdentifier': first}]}
+
+        self.logger.info('counted %d visits into %d counters',
+                         counted, len(batches))
+        return {'batchItemFailures': []}
+
+
+def already_counted(error):
+    """
+    Whether a cancelled transaction of one visit was cancelled by its
+    marker, which is the first item.
+    """
+    reasons = error.response.get('CancellationReasons')
+    if reasons:
+        return reasons[0].get('Code') == 'ConditionalCheckFailed'
+    return '[ConditionalCheckFailed' in error.response['Error']['Message']
+
+
+visit_counts_function = VisitCountsFunction(None, None)
+
+
+@instrumented('visit_counts')
+def handler(event, context):
+    # Triggered by the visits table stream
+    return visit_counts_function.handle_stream_event(event, context)
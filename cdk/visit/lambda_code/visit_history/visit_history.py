@@ -0,0 +1,208 @@
+import base64
+import binascii
+import json
+import logging
+import os
+from decimal import Decimal, DecimalException
+
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+from lambda_utils import aws_clients
+from lambda_utils.instrumentation import instrumented
+from lambda_utils.visit_index import check_cursor, query_page
+
+DEFAULT_PAGE_SIZE = 100
+# keeps every response well under the 6 MB lambda response limit
+MAX_PAGE_SIZE = 1000
+# a page of a time range reads every shard of each day until it fills up,
+# so a long, quiet range would cost thousands of queries for one page
+MAX_RANGE_DAYS = 31
+
+
+class BadRequest(Exception):
+    pass
+
+
+def json_value(value):
+    # numbers come back from DynamoDB as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class VisitHistoryFunction():
+    """
+    Reads visits back a page at a time, for `GET /visits`.
+
+    Query string parameters, all optional:
+
+        username  - only this user's visits, read from the visits table
+        location  - only visits at this location
+        start/end - seconds since epoch, inclusive
+        limit     - page size, at most MAX_PAGE_SIZE
+        cursor    - the next_cursor of the previous page
+
+    Without a username, start and end are required, at most MAX_RANGE_DAYS
+    apart, and the visits come from the visits_by_day index (see
+    lambda_utils.visit_index) oldest first.
+
+    Cursors are opaque to callers: base64 of the DynamoDB key to continue
+    from. Each page is read with queries bounded by the page size, so even
+    exporting every visit never holds more than a page in memory. API
+    Gateway compresses large responses for clients that accept gzip.
+
+    Like the other lambdas, the table can be passed in so it can be tested
+    with moto.
+    """
+
+    def __init__(self, visits_table):
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.INFO)
+
+        self.serializer = TypeSerializer()
+        self.deserializer = TypeDeserializer()
+
+        if visits_table is None:
+            VISITS_TABLE_NAME = os.environ["VISITS_TABLE_NAME"]
+            self.visits = aws_clients.LazyTable(VISITS_TABLE_NAME)
+        else:
+            self.visits = visits_table
+
+    def encode_cursor(self, cursor):
+        if cursor is None:
+            return None
+        # DynamoDB typed JSON keeps key numbers exact
+        typed = self.serializer.serialize(cursor)
+        return base64.urlsafe_b64encode(json.dumps(typed).encode()).decode()
+
+    def decode_cursor(self, token):
+        try:
+            typed = json.loads(base64.urlsafe_b64decode(token.encode()))
+            return self.deserializer.deserialize(typed)
+        except (binascii.Error, ValueError, TypeError, AttributeError,
+                DecimalException):
+            raise BadRequest('cursor is not valid')
+
+    def check_user_cursor(self, cursor, username):
+        """
+        A cursor of a user's visits is the visits table key to continue
+        after, which must be of the same user.
+        """
+        if not (isinstance(cursor, dict) and
+                set(cursor) == {'username', 'visit_time'} and
+                cursor['username'] == username and
+                isinstance(cursor['visit_time'], Decimal)):
+            raise BadRequest('cursor is not valid')
+
+    def int_parameter(self, parameters, name):
+        value = parameters.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise BadRequest(f'{name} must be an integer')
+
+    def user_page(self, username, location, start, end, limit, cursor):
+        """
+        A page of one user's visits, oldest first, continuing from the
+        LastEvaluatedKey of the previous page.
+        """
+        condition = Key('username').eq(username)
+        if start is not None or end is not None:
+            condition &= Key('visit_time').between(
+                start if start is not None else 0,
+                end if end is not None else 2 ** 53)
+
+        kwargs = {'KeyConditionExpression': condition, 'Limit': limit}
+        if location is not None:
+            kwargs['FilterExpression'] = Attr('location').eq(location)
+        if cursor is not None:
+            kwargs['ExclusiveStartKey'] = cursor
+
+        visits = []
+        while len(visits) < limit:
+            kwargs['Limit'] = limit - len(visits)
+            response = self.visits.query(**kwargs)
+            visits.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return visits, None
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        return visits, kwargs['ExclusiveStartKey']
+
+    def get_visits(self, parameters):
+        username = parameters.get('username')
+        location = parameters.get('location')
+        start = self.int_parameter(parameters, 'start')
+        end = self.int_parameter(parameters, 'end')
+
+        limit = self.int_parameter(parameters, 'limit') or DEFAULT_PAGE_SIZE
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        cursor = None
+        if parameters.get('cursor'):
+            cursor = self.decode_cursor(parameters['cursor'])
+
+        if username:
+            if cursor is not None:
+                self.check_user_cursor(cursor, username)
+            visits, cursor = self.user_page(
+                username, location, start, end, limit, cursor)
+        elif start is None or end is None:
+            raise BadRequest('start and end are required without a username')
+        elif end - start > MAX_RANGE_DAYS * 86400:
+            raise BadRequest(
+                f'start and end can be at most {MAX_RANGE_DAYS} days apart')
+        else:
+            if cursor is not None:
+                try:
+                    check_cursor(cursor, start, end)
+                except ValueError:
+                    raise BadRequest('cursor is not valid')
+            visits, cursor = query_page(
+                self.visits, start, end, location, limit, cursor)
+
+        return {
+            'visits': visits,
+            'count': len(visits),
+            'next_cursor': self.encode_cursor(cursor),
+        }
+
+    def handle_visit_history_request(self, request, context):
+        HEADERS = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Headers': 'Content-Type',
+            'Access-Control-Allow-Origin': os.environ["DOMAIN_NAME"],
+            'Access-Control-Allow-Methods': 'OPTIONS,GET'
+        }
+
+        if request is None:
+            request = {}
+
+        parameters = request.get('queryStringParameters') or {}
+
+        try:
+            page = self.get_visits(parameters)
+        except BadRequest as e:
+            return {
+                'headers': HEADERS,
+                'statusCode': 400,
+                'body': json.dumps({'Message': str(e)})
+            }
+
+        self.logger.info('returning %d visits', page['count'])
+        return {
+            'headers': HEADERS,
+            'statusCode': 200,
+            'body': json.dumps(page, default=json_value)
+        }
+
+
+visit_history_function = VisitHistoryFunction(None)
+
+
+@instrumented('visit_history')
+def handler(request, context):
+    # Read visits back for staff, e.g. to export them
+    return visit_history_function.handle_visit_history_request(request, context)
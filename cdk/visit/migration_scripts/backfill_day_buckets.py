@@ -0,0 +1,40 @@
+"""
+Gives the visits written before the visits_by_day index existed their
+day_bucket, so time range queries (GET /visits, the analytics export)
+find them.
+
+Run it once after deploying the index, against each stage:
+
+    VISITS_TABLE_NAME=... python backfill_day_buckets.py [--segments N]
+                                                        [--writers N]
+
+It only reads visits that still have no day_bucket, so if a run dies
+partway through, running it again finishes the job.
+"""
+import argparse
+import os
+import sys
+
+import boto3
+
+# the scan and write helpers are shared with the lambdas through their layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lambda_code', 'layer', 'python'))
+
+from lambda_utils.visit_index import backfill_day_buckets  # noqa: E402
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Give old visits the day_bucket of the visits_by_day index.')
+    parser.add_argument('--segments', type=int, default=4,
+                        help='number of parallel scan segments')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='number of batch writer threads')
+    args = parser.parse_args()
+
+    dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+    table = dynamodb.Table(os.environ['VISITS_TABLE_NAME'])
+
+    written = backfill_day_buckets(table, args.segments, args.writers)
+    print(f'Back-fill done, {written} visits given a day_bucket')
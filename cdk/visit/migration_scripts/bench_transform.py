@@ -0,0 +1,169 @@
+""" Benchmark for the transform stage of the migration
+
+    Transforms a synthetic legacy dump (visits and registrations in the
+    shape of the original table, plus a few malformed rows) with the old
+    per-row helpers, kept here as legacy_*, and with
+    legacy_transform.transform_rows, and prints rows/sec for each.
+    transform_rows also does work the old loop never did, like giving every
+    visit its visits_by_day bucket, so the rows/sec are not like for like.
+
+    The dump is built from a fixed seed by cycling through a pool of
+    distinct rows, so both runs see the same rows and generating them costs
+    next to nothing next to the transforms.
+
+    Run it from this directory:
+
+        python bench_transform.py [--rows N] [--distinct N]
+"""
+import argparse
+import contextlib
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+from typing import List, Tuple
+
+# the migration's helpers use the lambdas' shared layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lambda_code', 'layer', 'python'))
+
+from legacy_transform import RejectFile, transform_rows  # noqa: E402
+
+MAJORS = ['Computer Science', 'Mechanical Engineering', 'Art',
+          'Mathematical Sciences', 'Biosystems Engineering', 'Architecture']
+LOCATIONS = ['watt', 'cooper', 'cube']
+
+
+def legacy_rows(rows, seed=0):
+    """
+    Rows like the original table's: about one registration per ten visits,
+    and one malformed row in a thousand.
+    """
+    rng = random.Random(seed)
+    semester_start = datetime.datetime(2022, 1, 10, 8)
+    for i in range(rows):
+        moment = semester_start + datetime.timedelta(
+            seconds=rng.randint(0, 120 * 86400),
+            microseconds=rng.randint(1, 999999))
+        username = f'user{rng.randint(0, rows // 10)}'
+
+        if i % 1000 == 999:
+            yield {'PK': username, 'SK': 'not a timestamp'}
+        elif i % 10:
+            yield {'PK': str(int(moment.timestamp())), 'SK': username,
+                   'location': rng.choice(LOCATIONS)}
+        else:
+            majors = rng.sample(MAJORS, rng.randint(1, 2))
+            yield {'PK': username, 'SK': str(moment),
+                   'Grad_date': f'{rng.randint(2022, 2027)}-{rng.randint(1, 12):02d}-15',
+                   'DOB': '2001-01-01', 'firstName': 'First',
+                   'lastName': 'Last', 'Gender': 'Other',
+                   'Major': '[' + ','.join(f'{{"S":"{m}"}}' for m in majors) + ']',
+                   'Minor': rng.choice(MAJORS)}
+
+
+def legacy_dump(rows, pool):
+    return itertools.islice(itertools.cycle(pool), rows)
+
+
+def legacy_process_grad_date(grad_date: str) -> Tuple[str, int]:
+    year = grad_date[:4]
+    month = grad_date[5:7]
+    if month in ['04', '05', '06']:
+        semester = 'Spring'
+    elif month in ['07', '08', '09']:
+        semester = 'Summer'
+    elif month in ['11', '12', '01']:
+        semester = 'Fall'
+    else:
+        semester = "None"
+
+    return semester, int(year)
+
+
+def legacy_process_timestamp(timestamp: str) -> str:
+    return str(datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").timestamp())
+
+
+def legacy_get_cleaned_majors_or_minors(major_or_minor: str) -> List[str]:
+    if major_or_minor is None or len(major_or_minor) == 0:
+        return []
+
+    print(major_or_minor)
+
+    if major_or_minor[0] == '[':
+        major_or_minor = major_or_minor[1:-1]
+        list_of_vals = [val.split(":")[1][1:-2]
+                        for val in major_or_minor.split(',')]
+        return list_of_vals
+    else:
+        return major_or_minor.split(',')
+
+
+def legacy_transform(rows):
+    """
+    The old loop of the migration script, building each item with the
+    per-row helpers. It had no error handling, so malformed rows are
+    skipped here to let the run finish.
+    """
+    for row in rows:
+        try:
+            if row['PK'][0].isdigit():
+                yield {'visit_time': {'S': row['PK']},
+                       'username': {'S': row['SK'].lower()},
+                       'location': {'S': row.get('location', 'watt')}}
+            else:
+                grad_semester, grad_year = legacy_process_grad_date(
+                    row['Grad_date'])
+                majors = legacy_get_cleaned_majors_or_minors(row['Major'])
+                minors = legacy_get_cleaned_majors_or_minors(row['Minor'])
+                yield {'username': {'S': row['PK'].lower()},
+                       'register_time': {'N': legacy_process_timestamp(row['SK'])},
+                       'date_of_birth': {'S': row['DOB']},
+                       'first_name': {'S': row['firstName']},
+                       'gender': {'S': row['Gender']},
+                       'grad_semester': {'S': grad_semester},
+                       'grad_year': {'S': str(grad_year)},
+                       'last_name': {'S': row['lastName']},
+                       'majors': {'L': [{'S': major} for major in majors]},
+                       'minors': {'L': [{'S': minor} for minor in minors]}}
+        except (KeyError, ValueError):
+            continue
+
+
+def measure(transform, rows, pool):
+    start = time.perf_counter()
+    count = sum(1 for _ in transform(legacy_dump(rows, pool)))
+    elapsed = time.perf_counter() - start
+    return count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000,
+                        help='rows in the synthetic dump')
+    parser.add_argument('--distinct', type=int, default=100_000,
+                        help='distinct rows the dump cycles through')
+    args = parser.parse_args()
+
+    pool = list(legacy_rows(min(args.rows, args.distinct)))
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        legacy_count, legacy_time = measure(legacy_transform, args.rows, pool)
+
+    with RejectFile(os.devnull) as rejects:
+        count, streaming_time = measure(
+            lambda rows: transform_rows(rows, rejects), args.rows, pool)
+
+    print(f'{"transform":>10} {"rows":>9} {"rejected":>9} {"seconds":>8} {"rows/sec":>10}')
+    for label, rows, rejected, elapsed in [
+            ('legacy', legacy_count, args.rows - legacy_count, legacy_time),
+            ('streaming', count, rejects.count, streaming_time)]:
+        print(f'{label:>10} {rows:>9} {rejected:>9} {elapsed:>8.2f} '
+              f'{rows / elapsed:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
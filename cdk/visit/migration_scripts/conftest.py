@@ -0,0 +1,30 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+# The migration scripts use the lambdas' shared layer. Put it on the path
+# for the tests, as the scripts do when run.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lambda_code', 'layer', 'python'))
+
+
+@pytest.fixture
+def write_export(tmp_path):
+    """
+    Writes export files of rows of the original table, given as plain
+    dicts of strings, in DYNAMODB_JSON format. Returns their paths.
+    """
+    def write(*files):
+        paths = []
+        for number, rows in enumerate(files):
+            path = tmp_path / f'export-{number}.json.gz'
+            with gzip.open(path, 'wt', encoding='utf-8') as f:
+                for row in rows:
+                    item = {name: {'S': value} for name, value in row.items()}
+                    f.write(json.dumps({'Item': item}) + '\n')
+            paths.append(str(path))
+        return paths
+    return write
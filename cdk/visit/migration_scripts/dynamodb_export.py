@@ -0,0 +1,111 @@
+"""
+Reads a DynamoDB table export (DYNAMODB_JSON format) instead of the table.
+
+An export is a set of gzipped files with one item per line, like
+
+    {"Item": {"PK": {"S": "jmdanie234"}, "SK": {"S": "2022-04-11 ..."}}}
+
+either on local disk or in S3. Migrating from an export uses none of the
+source table's read capacity.
+
+Example:
+
+    files = export_files('s3://bucket/AWSDynamoDB/0123-abcd/data/')
+    for item in ExportReader(files).items():
+        ...
+"""
+from typing import List, Optional
+import gzip
+import io
+import json
+import os
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+S3_SCHEME = 's3://'
+
+
+def split_s3_url(url: str):
+    bucket, _, key = url[len(S3_SCHEME):].partition('/')
+    return bucket, key
+
+
+def export_files(location: str, s3_client=None) -> List[str]:
+    """
+    The data files of an export, in a stable order.
+
+    Args:
+        location: A local .gz file or a directory holding them, or an
+            s3://bucket/key URL of a file or a prefix holding them.
+    """
+    if location.startswith(S3_SCHEME):
+        s3_client = s3_client or boto3.client('s3')
+        bucket, prefix = split_s3_url(location)
+        paginator = s3_client.get_paginator('list_objects_v2')
+        files = [f'{S3_SCHEME}{bucket}/{obj["Key"]}'
+                 for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+                 for obj in page.get('Contents', [])
+                 if obj['Key'].endswith('.gz')]
+    elif os.path.isdir(location):
+        files = [os.path.join(directory, name)
+                 for directory, _, names in os.walk(location)
+                 for name in names if name.endswith('.gz')]
+    else:
+        files = [location]
+
+    if not files:
+        raise ValueError(f'no export files found at {location}')
+    return sorted(files)
+
+
+class ExportReader():
+    """
+    Reads the items of export files one line at a time, decompressing as it
+    goes, so neither a file nor the export is ever held in memory.
+
+    Each file is treated like a segment of a ParallelScanner, so progress
+    can be saved in the same Checkpoint: `cursors` maps each file's index to
+    {'line': lines read} or DONE, and `completed` counts the items read.
+    """
+
+    DONE = 'DONE'
+
+    def __init__(self, files: List[str], start_keys: Optional[dict] = None,
+                 s3_client=None):
+        self.files = files
+        self.total_segments = len(files)
+        self.cursors = dict(start_keys or {})
+        self.completed = 0
+        self.s3_client = s3_client
+        self.deserializer = TypeDeserializer()
+
+    def open(self, path: str):
+        if path.startswith(S3_SCHEME):
+            self.s3_client = self.s3_client or boto3.client('s3')
+            bucket, key = split_s3_url(path)
+            body = self.s3_client.get_object(Bucket=bucket, Key=key)['Body']
+            return io.TextIOWrapper(gzip.GzipFile(fileobj=body),
+                                    encoding='utf-8')
+        return gzip.open(path, 'rt', encoding='utf-8')
+
+    def item(self, line: str) -> dict:
+        return {name: self.deserializer.deserialize(value)
+                for name, value in json.loads(line)['Item'].items()}
+
+    def items(self):
+        for segment, path in enumerate(self.files):
+            cursor = self.cursors.get(segment)
+            if cursor == self.DONE:
+                continue
+            skip = int(cursor['line']) if cursor else 0
+
+            with self.open(path) as lines:
+                for line_number, line in enumerate(lines, start=1):
+                    if line_number <= skip or not line.strip():
+                        continue
+                    yield self.item(line)
+                    self.completed += 1
+                    self.cursors[segment] = {'line': line_number}
+
+            self.cursors[segment] = self.DONE
@@ -0,0 +1,212 @@
+"""
+The transform stage of the migrations: turns rows of the original table
+into items for the visits and users tables.
+
+Rows stream through transform_rows one at a time, so a dump of any size can
+be transformed without holding it in memory. A row that cannot be
+transformed is written to a reject file with the error instead of stopping
+the migration.
+
+Example:
+
+    with RejectFile('rejects.jsonl') as rejects:
+        for kind, item in transform_rows(rows, rejects):
+            ...
+"""
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
+import datetime
+import json
+import re
+
+from lambda_utils.visit_index import day_bucket
+
+VISIT = 'visit'
+USER = 'user'
+
+# 2022-04-11 03:14:50.800970, the format str(datetime.now()) produces
+TIMESTAMP = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?$')
+
+# YYYY-MM-DD
+GRAD_DATE = re.compile(r'(\d{4})-(\d{2})')
+
+# one value of a list saved as DynamoDB JSON, e.g. [{"S":"Math"},{"S":"Art"}]
+LIST_VALUE = re.compile(r':\s*"([^"]*)"')
+
+SEMESTERS = {
+    '04': 'Spring', '05': 'Spring', '06': 'Spring',
+    '07': 'Summer', '08': 'Summer', '09': 'Summer',
+    '11': 'Fall', '12': 'Fall', '01': 'Fall',
+}
+
+
+@lru_cache(maxsize=4096)
+def hour_start(year: int, month: int, day: int, hour: int) -> int:
+    """
+    Seconds since epoch at the start of an hour, in local time like
+    datetime.timestamp(). Visits cluster in a few thousand distinct hours,
+    and daylight saving changes happen on the hour, so caching whole hours
+    is exact.
+    """
+    return int(datetime.datetime(year, month, day, hour).timestamp())
+
+
+def process_timestamp(timestamp: str) -> str:
+    """
+    Convert timestamp from ISO Format to Seconds Since Epoch
+    Example: 2022-04-11 03:14:50.800970
+    """
+    match = TIMESTAMP.match(timestamp)
+    if match is None:
+        raise ValueError(f'unrecognized timestamp {timestamp!r}')
+
+    year, month, day, hour, minute, second, fraction = match.groups()
+    seconds = hour_start(int(year), int(month), int(day), int(hour)) + \
+        int(minute) * 60 + int(second)
+    microseconds = int(fraction.ljust(6, '0')) if fraction else 0
+    return str(seconds + microseconds / 1e6)
+
+
+@lru_cache(maxsize=1024)
+def process_grad_date(grad_date: str) -> Tuple[str, int]:
+    """
+    Infers the graduation semester and year from grad_date
+
+    grad_date: str
+        The graduation date in the format 'YYYY-MM-DD'
+
+    Returns:
+        A tuple of the semester and year.
+    """
+    match = GRAD_DATE.match(grad_date)
+    if match is None:
+        raise ValueError(f'unrecognized graduation date {grad_date!r}')
+
+    year, month = match.groups()
+    return SEMESTERS.get(month, 'None'), int(year)
+
+
+def get_cleaned_majors_or_minors(major_or_minor: Optional[str]) -> List[str]:
+    """
+    Cleans the major or minor string.
+
+    Args:
+        major_or_minor: The major or minor string to clean.
+
+    Returns:
+        A cleaned major or minor string.
+    """
+    if not major_or_minor:
+        return []
+
+    if major_or_minor[0] == '[':
+        return LIST_VALUE.findall(major_or_minor)
+    return major_or_minor.split(',')
+
+
+def to_visit_item(row: dict) -> dict:
+    """
+    Convert a visit row of the original table (PK = visit time,
+    SK = username) into an item for the visits table.
+    """
+    # visits were first keyed by str(datetime.now()), later by epoch seconds
+    visit_time = row['PK'] if row['PK'].isdigit() else \
+        process_timestamp(row['PK'])
+    location = row['location'] if 'location' in row else 'watt'
+    username = row['SK'].lower()
+    return {'visit_time': {'N': visit_time},
+            'username': {'S': username},
+            'location': {'S': location},
+            'day_bucket': {'S': day_bucket(username, visit_time)}}
+
+
+def to_user_item(row: dict) -> dict:
+    """
+    Convert a registration row of the original table (PK = username,
+    SK = registration time) into an item for the users table.
+    """
+    grad_semester, grad_year = process_grad_date(row['Grad_date'])
+    majors = get_cleaned_majors_or_minors(
+        row['Major']) if 'Major' in row else ["a", "b"]
+
+    minors = get_cleaned_majors_or_minors(
+        row['Minor']) if 'Minor' in row else ["a", "b"]
+
+    updated_registration_time = process_timestamp(row['SK'])
+
+    return {'username': {'S': row['PK'].lower()},
+            'register_time': {'N': updated_registration_time},
+            'date_of_birth': {'S': row['DOB']},
+            'first_name': {'S': row['firstName']},
+            'gender': {'S': row['Gender']},
+            'grad_semester': {'S': grad_semester},
+            'grad_year': {'S': str(grad_year)},
+            'last_name': {'S': row['lastName']},
+            'majors': {'L': [{'S': major} for major in majors]},
+            'minors': {'L': [{'S': minor} for minor in minors]}}
+
+
+class RejectFile():
+    """
+    Rows that failed to transform, one JSON object per line holding the row
+    and the error.
+    """
+
+    def __init__(self, path: str, mode: str = 'w'):
+        self.path = path
+        self.file = open(path, mode)
+        self.count = 0
+
+    def write(self, row: dict, error: Exception):
+        self.file.write(json.dumps(
+            {'row': row, 'error': f'{type(error).__name__}: {error}'},
+            default=str) + '\n')
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def truncate(self, offset: int, count: int):
+        """
+        Drop everything written after offset, when count rows had been
+        written, so a resumed migration can reject those rows again.
+        """
+        self.file.truncate(offset)
+        self.file.seek(offset)
+        self.count = count
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+def transform_rows(rows: Iterable[dict],
+                   rejects: Optional[RejectFile] = None) -> Iterator[Tuple[str, dict]]:
+    """
+    Transform rows of the original table as they are read.
+
+    Yields:
+        (VISIT, item) or (USER, item) for every row that transformed. Rows
+        that did not are written to rejects, or dropped if it is None.
+    """
+    for row in rows:
+        try:
+            # If PK starts with a digit it is a timestamp, so this is a visit
+            if row['PK'][0].isdigit():
+                kind, item = VISIT, to_visit_item(row)
+            else:
+                kind, item = USER, to_user_item(row)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            if rejects is not None:
+                rejects.write(row, e)
+            continue
+        yield kind, item
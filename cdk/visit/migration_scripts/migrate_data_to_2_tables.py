@@ -1,11 +1,42 @@
 """
 This script will migrate data from the original table to the two
 new tables.
+
+Usage:
+
+    python migrate_data_to_2_tables.py [--export PATH] [--segments N]
+                                       [--writers N] [--checkpoint FILE]
+                                       [--resume] [--dry-run] [--rejects FILE]
+
+Progress is saved to the checkpoint file every few thousand rows. If a run
+dies partway through (expired credentials, throttling), running again with
+--resume continues from the last checkpoint instead of from the first row.
+--dry-run reads and transforms every row and reports the counts without
+writing anything. Rows that cannot be transformed are written to the
+rejects file rather than stopping the migration. A dry run writes its
+rejects to a file of its own, so it never touches those of a real run
+waiting to be resumed.
+
+With --export the rows come from a DynamoDB JSON export of the original
+table, on local disk or in S3, and the table itself is never read.
 """
-from typing import Tuple, List
+from typing import Optional
+import argparse
 import boto3
+import json
 import os
-import datetime
+import sys
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+# the scan and write helpers are shared with the lambdas through their layer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'lambda_code', 'layer', 'python'))
+
+from lambda_utils.bulk_writer import BulkWriter  # noqa: E402
+from lambda_utils.dynamodb import ParallelScanner  # noqa: E402
+from dynamodb_export import ExportReader, export_files  # noqa: E402
+from legacy_transform import VISIT, RejectFile, transform_rows  # noqa: E402
 
 
 def generate_role_arn() -> str:
@@ -33,130 +64,300 @@ def get_table(table_name: str) -> boto3.resources.base.ServiceResource:
     return table
 
 
-def get_all_data(table: boto3.resources.base.ServiceResource) -> list:
+def get_all_data(table: boto3.resources.base.ServiceResource,
+                 total_segments: int = 4,
+                 start_keys: Optional[dict] = None) -> ParallelScanner:
     """
     Get all data from a table.
 
+    The table is read with a parallel scan split into total_segments
+    segments, following LastEvaluatedKey so tables larger than one 1 MB page
+    are read completely. Items are yielded as they arrive rather than
+    collected, so memory use does not grow with the table.
+
     Args:
         table: The table to get data from.
+        total_segments: How many segments to scan in parallel.
+        start_keys: Segment cursors saved by an earlier run to resume from.
 
     Returns:
-        A list of all data from the table.
+        A scanner; its items() iterates over all data from the table and
+        its cursors record how far each segment has got.
     """
-    response = table.scan()
-    return response['Items']
+    return ParallelScanner(table, total_segments=total_segments,
+                           start_keys=start_keys)
 
 
-def process_grad_date(grad_date: str) -> Tuple[str, int]:
+class Checkpoint():
+    """
+    The progress of a migration, saved as JSON in a local file.
+
+    cursors holds the cursor of each segment of the source (see
+    ParallelScanner and ExportReader). Checkpoints are only saved when every
+    row read so far is behind the cursors, so rows_written counts exactly
+    the rows before them, and rejects_offset is how long the rejects file
+    was then. A resumed run starts from the cursors and cuts the rejects
+    file back to rejects_offset, so no row is counted or rejected twice.
     """
-    Infers the graduation semester and year from grad_date
-
-    grad_date: str
-        The graduation date in the format 'YYYY-MM-DD'
 
-    Returns:
-        A tuple of the semester and year.
+    def __init__(self, path: str, source: str, total_segments: int,
+                 cursors: Optional[dict] = None, rows_written: int = 0,
+                 rows_rejected: int = 0, rejects_offset: int = 0):
+        self.path = path
+        self.source = source
+        self.total_segments = total_segments
+        self.cursors = cursors or {}
+        self.rows_written = rows_written
+        self.rows_rejected = rows_rejected
+        self.rejects_offset = rejects_offset
+
+    @classmethod
+    def load(cls, path: str, source: str, total_segments: int) -> 'Checkpoint':
+        with open(path) as f:
+            saved = json.load(f)
+
+        # cursors are only meaningful for the same segmentation of the source
+        if saved['source'] != source:
+            raise ValueError(
+                f'{path} was saved migrating {saved["source"]}, not {source}')
+        if saved['total_segments'] != total_segments:
+            raise ValueError(
+                f'{path} was saved with {saved["total_segments"]} segments, '
+                f'not {total_segments}')
+
+        deserializer = TypeDeserializer()
+        cursors = {}
+        for segment, cursor in saved['cursors'].items():
+            if cursor != ParallelScanner.DONE:
+                cursor = {name: deserializer.deserialize(value)
+                          for name, value in cursor.items()}
+            cursors[int(segment)] = cursor
+
+        return cls(path, source, total_segments, cursors,
+                   saved['rows_written'], saved.get('rows_rejected', 0),
+                   saved.get('rejects_offset', 0))
+
+    def save(self, cursors: dict, rows_written: int, rows_rejected: int = 0,
+             rejects_offset: int = 0):
+        self.cursors = dict(cursors)
+        self.rows_written = rows_written
+        self.rows_rejected = rows_rejected
+        self.rejects_offset = rejects_offset
+
+        # keys may hold numbers, which plain JSON would turn into floats
+        serializer = TypeSerializer()
+        saved_cursors = {}
+        for segment, cursor in self.cursors.items():
+            if cursor != ParallelScanner.DONE:
+                cursor = {name: serializer.serialize(value)
+                          for name, value in cursor.items()}
+            saved_cursors[str(segment)] = cursor
+
+        # write then rename, so a crash mid-save keeps the last checkpoint
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'source': self.source,
+                       'total_segments': self.total_segments,
+                       'cursors': saved_cursors,
+                       'rows_written': rows_written,
+                       'rows_rejected': rows_rejected,
+                       'rejects_offset': rejects_offset}, f)
+        os.replace(temp_path, self.path)
+
+
+# where rows rejected by real runs and by dry runs go, unless --rejects is given
+REJECTS = 'migration_rejects.jsonl'
+DRY_RUN_REJECTS = 'migration_rejects.dry_run.jsonl'
+
+
+def open_rejects(path: str, dry_run: bool = False,
+                 resumed: Optional[Checkpoint] = None) -> RejectFile:
     """
-    year = grad_date[:4]
-    month = grad_date[5:7]
-    if month in ['04', '05', '06']:
-        semester = 'Spring'
-    elif month in ['07', '08', '09']:
-        semester = 'Summer'
-    elif month in ['11', '12', '01']:
-        semester = 'Fall'
-    else:
-        semester = "None"
+    The rejects file of a run. A resumed real run keeps the rows rejected
+    before its checkpoint, and rejects the rows after it again; any other
+    run starts the file afresh.
+    """
+    if dry_run or resumed is None:
+        return RejectFile(path, 'w')
 
-    return semester, int(year)
+    if not os.path.exists(path) or os.path.getsize(path) < resumed.rejects_offset:
+        raise ValueError(
+            f'{path} is missing rejects saved in the checkpoint, resume '
+            f'with the rejects file of the interrupted run')
+    rejects = RejectFile(path, 'a')
+    rejects.truncate(resumed.rejects_offset, resumed.rows_rejected)
+    return rejects
 
 
-def process_timestamp(timestamp: str) -> str:
+class DryRunWriter():
     """
-    Convert timestamp from ISO Format to Seconds Since Epoch
-    Example: 2022-04-11 03:14:50.800970
+    Stands in for a BulkWriter in --dry-run mode, counting rows instead of
+    writing them.
     """
-    return str(datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").timestamp())
 
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.written = 0
 
-def get_cleaned_majors_or_minors(major_or_minor: str) -> List[str]:
-    """
-    Cleans the major or minor string.
+    def put(self, item: dict):
+        self.written += 1
 
-    Args:
-        major_or_minor: The major or minor string to clean.
+    def flush(self):
+        pass
 
-    Returns:
-        A cleaned major or minor string.
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+    def stats(self) -> dict:
+        return {'table': self.table_name, 'transformed': self.written}
+
+
+def migrate(scanner, visits_writer, users_writer,
+            checkpoint: Optional[Checkpoint] = None,
+            checkpoint_every: int = 5000,
+            rejects: Optional[RejectFile] = None) -> int:
     """
-    if major_or_minor is None or len(major_or_minor) == 0:
-        return []
+    Write every row the scanner (a ParallelScanner or ExportReader) reads
+    to the visits or users table. Rows that cannot be transformed go to
+    rejects.
 
-    print(major_or_minor)
+    If a checkpoint is given, the writers are flushed and the scan cursors
+    saved to it about every checkpoint_every rows, and once more at the end.
 
-    if major_or_minor[0] == '[':
-        major_or_minor = major_or_minor[1:-1]
-        list_of_vals = [val.split(":")[1][1:-2]
-                        for val in major_or_minor.split(',')]
-        return list_of_vals
-    else:
-        return major_or_minor.split(',')
+    Returns:
+        The number of rows written, which leaves out the rejected rows and
+        includes those written by the runs the checkpoint was resumed from.
+    """
+    rows_before = checkpoint.rows_written if checkpoint else 0
+    rows_put = 0
+    rows_read = 0
+
+    def read():
+        nonlocal rows_read
+        for row in scanner.items():
+            rows_read += 1
+            yield row
+
+    def save():
+        # only save cursors once everything before them is written
+        visits_writer.flush()
+        users_writer.flush()
+        if rejects is None:
+            checkpoint.save(scanner.cursors, rows_before + rows_put)
+        else:
+            rejects.flush()
+            checkpoint.save(scanner.cursors, rows_before + rows_put,
+                            rejects.count, rejects.tell())
+
+    checkpoint_due = False
+    with visits_writer, users_writer:
+        for kind, item in transform_rows(read(), rejects):
+            # The row of this item is not behind the cursors yet. Every row
+            # read before it is once the scanner has finished its page (with
+            # an export, after every row), and then the counts match the
+            # cursors exactly.
+            if checkpoint_due and scanner.completed == rows_read - 1:
+                save()
+                checkpoint_due = False
+
+            if kind == VISIT:
+                visits_writer.put(item)
+            else:
+                users_writer.put(item)
+            rows_put += 1
+
+            if checkpoint and rows_put % checkpoint_every == 0:
+                checkpoint_due = True
+
+        if checkpoint:
+            save()
+    return rows_before + rows_put
 
 
 # This part runs the migration
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Migrate the original table into the visits and users tables.')
+    parser.add_argument('--export',
+                        help='migrate from this DynamoDB JSON export (a local '
+                             'file or directory, or an s3:// URL) instead of '
+                             'scanning the original table')
+    parser.add_argument('--segments', type=int, default=4,
+                        help='number of parallel scan segments')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='number of batch writer threads per table')
+    parser.add_argument('--checkpoint', default='migration_checkpoint.json',
+                        help='file progress is saved to')
+    parser.add_argument('--checkpoint-every', type=int, default=5000,
+                        help='rows between checkpoints')
+    parser.add_argument('--rejects',
+                        help='file rows that fail to transform are written '
+                             f'to, {REJECTS} or for a dry run {DRY_RUN_REJECTS} '
+                             'by default')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the last checkpoint')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='transform and count rows without writing them')
+    args = parser.parse_args()
+    if args.rejects is None:
+        args.rejects = DRY_RUN_REJECTS if args.dry_run else REJECTS
+
     client = boto3.client('sts')
     response = client.assume_role(
         RoleArn=generate_role_arn(),
         RoleSessionName="data_migration_session")
 
-    original_table_name = os.environ["ORIGINAL_TABLE_NAME"]
     visits_table_name = os.environ["VISITS_TABLE_NAME"]
     users_table_name = os.environ["USERS_TABLE_NAME"]
 
-    original_table = get_table(original_table_name)
-    visits_table = get_table(visits_table_name)
-    users_table = get_table(users_table_name)
-
-    # Get all users from the original_table
-    original_data = get_all_data(original_table)
+    if args.export:
+        # the export's files take the place of scan segments
+        export = export_files(args.export)
+        source, total_segments = args.export, len(export)
+    else:
+        source, total_segments = os.environ["ORIGINAL_TABLE_NAME"], args.segments
 
-    visits = []
-    users = []
+    resumed = None
+    if args.resume:
+        checkpoint = resumed = Checkpoint.load(
+            args.checkpoint, source, total_segments)
+        print(f'Resuming after {checkpoint.rows_written} rows')
+    else:
+        checkpoint = Checkpoint(args.checkpoint, source, total_segments)
 
-    dynamodbclient = boto3.client('dynamodb', region_name='us-east-1')
-    # Iterate over the table. If PK is a timestamp, this is a visit
-    for row in original_data:
-        if row['PK'][0].isdigit():
-            location = row['location'] if 'location' in row else 'watt'
-            visits.append(
-                {'visit_time': {'S': row['PK']}, 'username': {'S': row['SK'].lower()}, 'location': {'S': location}})
-        else:
-            grad_semester, grad_year = process_grad_date(row['Grad_date'])
-            majors = get_cleaned_majors_or_minors(
-                row['Major']) if 'Major' in row else ["a", "b"]
-
-            minors = get_cleaned_majors_or_minors(
-                row['Minor']) if 'Minor' in row else ["a", "b"]
-
-            updated_registration_time = process_timestamp(row['SK'])
-
-            users.append({'username': {'S': row['PK'].lower()},
-                          'register_time': {'N': updated_registration_time},
-                          'date_of_birth': {'S': row['DOB']},
-                          'first_name': {'S': row['firstName']},
-                          'gender': {'S': row['Gender']},
-                          'grad_semester': {'S': grad_semester},
-                          'grad_year': {'S': str(grad_year)},
-                          'last_name': {'S': row['lastName']},
-                          'majors': {'L': [{'S': major} for major in majors]},
-                          'minors': {'L': [{'S': minor} for minor in minors]}})
-
-    for visit in visits:
-        dynamodbclient.put_item(Item=visit, TableName=visits_table_name)
-
-    for user in users:
-        print(user)
-        dynamodbclient.put_item(Item=user, TableName=users_table_name)
-
-    print("Migration Done! :-)")
+    if args.export:
+        scanner = ExportReader(export, checkpoint.cursors)
+    else:
+        # Get all users from the original_table
+        scanner = get_all_data(get_table(source), args.segments,
+                               checkpoint.cursors)
+
+    if args.dry_run:
+        # a dry run must not move the checkpoint of a real run
+        visits_writer = DryRunWriter(visits_table_name)
+        users_writer = DryRunWriter(users_table_name)
+        checkpoint = None
+    else:
+        dynamodbclient = boto3.client('dynamodb', region_name='us-east-1')
+        visits_writer = BulkWriter(dynamodbclient, visits_table_name,
+                                   threads=args.writers,
+                                   key_names=['username', 'visit_time'])
+        users_writer = BulkWriter(dynamodbclient, users_table_name,
+                                  threads=args.writers,
+                                  key_names=['username'])
+
+    with open_rejects(args.rejects, args.dry_run, resumed) as rejects:
+        rows = migrate(scanner, visits_writer, users_writer,
+                       checkpoint, args.checkpoint_every, rejects)
+
+    print(visits_writer.stats())
+    print(users_writer.stats())
+    print(f'{rejects.count} rows rejected, see {args.rejects}')
+
+    if args.dry_run:
+        print(f"Dry run done, {rows} rows transformed")
+    else:
+        print(f"Migration Done! :-) {rows} rows written")
@@ -0,0 +1,90 @@
+from decimal import Decimal
+import gzip
+
+import boto3
+import pytest
+from moto import mock_s3
+
+from dynamodb_export import ExportReader, export_files
+
+
+def usernames(items):
+    return [item['SK'] for item in items]
+
+
+def visits(*usernames):
+    return [{'PK': str(1650000000 + number), 'SK': username}
+            for number, username in enumerate(usernames)]
+
+
+def test_export_files_lists_the_data_files_in_order(tmp_path, write_export):
+    files = write_export(visits('a'), visits('b'))
+    (tmp_path / 'manifest-summary.json').write_text('{}')
+
+    assert export_files(str(tmp_path)) == files
+    assert export_files(files[1]) == [files[1]]
+    (tmp_path / 'empty').mkdir()
+    with pytest.raises(ValueError, match='no export files'):
+        export_files(str(tmp_path / 'empty'))
+
+
+def test_reader_deserializes_gzipped_items(tmp_path):
+    path = tmp_path / 'export.json.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write('{"Item": {"username": {"S": "jmdanie234"}, '
+                '"visit_time": {"N": "1650000000.5"}, '
+                '"majors": {"L": [{"S": "Art"}]}}}\n')
+        f.write('\n')
+
+    reader = ExportReader([str(path)])
+
+    assert list(reader.items()) == [{'username': 'jmdanie234',
+                                     'visit_time': Decimal('1650000000.5'),
+                                     'majors': ['Art']}]
+    assert reader.completed == 1
+    assert reader.cursors == {0: ExportReader.DONE}
+
+
+def test_reader_cursors_follow_the_consumer(write_export):
+    files = write_export(visits('a', 'b', 'c'), visits('d'))
+    reader = ExportReader(files)
+    items = reader.items()
+
+    next(items)
+    next(items)
+    # the second item is not behind the cursor until the next is asked for
+    assert reader.cursors == {0: {'line': 1}}
+    assert reader.completed == 1
+
+    assert usernames(items) == ['c', 'd']
+    assert reader.cursors == {0: ExportReader.DONE, 1: ExportReader.DONE}
+    assert reader.completed == 4
+
+
+def test_reader_resumes_from_cursors(write_export):
+    files = write_export(visits('a', 'b'), visits('c', 'd', 'e'),
+                         visits('f'))
+
+    reader = ExportReader(files, {0: ExportReader.DONE, 1: {'line': 1}})
+
+    assert usernames(reader.items()) == ['d', 'e', 'f']
+    assert reader.completed == 3
+
+
+@mock_s3
+def test_reader_streams_files_from_s3(write_export):
+    s3 = boto3.client('s3', region_name='us-east-1')
+    s3.create_bucket(Bucket='exports')
+    for number, path in enumerate(write_export(visits('a'), visits('b', 'c'))):
+        with open(path, 'rb') as f:
+            s3.put_object(Bucket='exports', Body=f.read(),
+                          Key=f'AWSDynamoDB/0123/data/{number}.json.gz')
+    s3.put_object(Bucket='exports', Key='AWSDynamoDB/0123/manifest.json',
+                  Body=b'{}')
+
+    files = export_files('s3://exports/AWSDynamoDB/0123/', s3)
+
+    assert files == ['s3://exports/AWSDynamoDB/0123/data/0.json.gz',
+                     's3://exports/AWSDynamoDB/0123/data/1.json.gz']
+    assert usernames(ExportReader(files, s3_client=s3).items()) == \
+        ['a', 'b', 'c']
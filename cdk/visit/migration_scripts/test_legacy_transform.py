@@ -0,0 +1,86 @@
+import datetime
+import json
+
+from legacy_transform import (USER, VISIT, RejectFile, process_grad_date,
+                              process_timestamp, transform_rows)
+
+
+REGISTRATION = {'PK': 'JMDanie234', 'SK': '2022-04-11 03:14:50.800970',
+                'Grad_date': '2024-05-15', 'DOB': '2000-01-01',
+                'firstName': 'John', 'lastName': 'Daniel', 'Gender': 'Male',
+                'Major': '[{"S":"Mathematical Sciences"},{"S":"Art"}]',
+                'Minor': 'Business Administration'}
+
+
+def test_process_timestamp_is_local_seconds_since_epoch():
+    expected = datetime.datetime(2022, 4, 11, 3, 14, 50, 800970).timestamp()
+
+    assert float(process_timestamp('2022-04-11 03:14:50.800970')) == \
+        expected
+    assert float(process_timestamp('2022-04-11 03:14:50')) == int(expected)
+
+
+def test_process_grad_date():
+    assert process_grad_date('2024-05-15') == ('Spring', 2024)
+    assert process_grad_date('2023-12-20') == ('Fall', 2023)
+    assert process_grad_date('2023-03-01') == ('None', 2023)
+
+
+def test_transform_rows_splits_visits_and_registrations():
+    rows = [{'PK': '1650000000', 'SK': 'JMDanie234', 'location': 'cooper'},
+            {'PK': '2022-04-11 03:14:50.800970', 'SK': 'leejohn'},
+            REGISTRATION]
+
+    [(first_kind, first), (second_kind, second), (third_kind, third)] = \
+        list(transform_rows(rows))
+
+    assert first_kind == second_kind == VISIT
+    assert first == {'visit_time': {'N': '1650000000'},
+                     'username': {'S': 'jmdanie234'},
+                     'location': {'S': 'cooper'},
+                     'day_bucket': {'S': first['day_bucket']['S']}}
+    assert first['day_bucket']['S'].startswith('2022-04-15#')
+    # the oldest visits have no location, and were all at Watt
+    assert second['location'] == {'S': 'watt'}
+    assert second['visit_time'] == \
+        {'N': process_timestamp('2022-04-11 03:14:50.800970')}
+
+    assert third_kind == USER
+    assert third['username'] == {'S': 'jmdanie234'}
+    assert third['grad_semester'] == {'S': 'Spring'}
+    assert third['grad_year'] == {'S': '2024'}
+    assert third['majors'] == {'L': [{'S': 'Mathematical Sciences'},
+                                     {'S': 'Art'}]}
+    assert third['minors'] == {'L': [{'S': 'Business Administration'}]}
+
+
+def test_transform_rows_writes_rejects_and_carries_on(tmp_path):
+    path = str(tmp_path / 'rejects.jsonl')
+    no_grad_date = dict(REGISTRATION)
+    del no_grad_date['Grad_date']
+    bad_time = dict(REGISTRATION, SK='not a timestamp')
+    rows = [{'PK': '1650000000', 'SK': 'jmdanie234'},
+            bad_time,
+            {'PK': '', 'SK': 'leejohn'},
+            no_grad_date,
+            {'PK': '1650000100', 'SK': 'leejohn'}]
+
+    with RejectFile(path) as rejects:
+        items = list(transform_rows(rows, rejects))
+
+    assert [item['username']['S'] for _, item in items] == \
+        ['jmdanie234', 'leejohn']
+    assert rejects.count == 3
+    with open(path) as f:
+        rejected = [json.loads(line) for line in f]
+    assert [reject['row'] for reject in rejected] == rows[1:4]
+    assert rejected[0]['error'].startswith('ValueError: ')
+    assert rejected[1]['error'].startswith('IndexError: ')
+    assert rejected[2]['error'] == "KeyError: 'Grad_date'"
+
+
+def test_transform_rows_without_rejects_drops_bad_rows():
+    rows = [{'PK': 'leejohn', 'SK': 'not a timestamp'},
+            {'PK': '1650000000', 'SK': 'jmdanie234'}]
+
+    assert [kind for kind, _ in transform_rows(rows)] == [VISIT]
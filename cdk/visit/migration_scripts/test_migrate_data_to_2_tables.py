@@ -0,0 +1,159 @@
+from decimal import Decimal
+import json
+import pytest
+
+from dynamodb_export import ExportReader
+from legacy_transform import RejectFile
+from migrate_data_to_2_tables import (DRY_RUN_REJECTS, REJECTS, Checkpoint,
+                                      DryRunWriter, migrate, open_rejects)
+
+
+def rows(count, malformed=()):
+    """
+    count visit rows of the original table, with the rows numbered in
+    malformed (from 1) replaced by rows that cannot be transformed.
+    """
+    return [{'PK': 'user', 'SK': 'not a timestamp'} if number in malformed
+            else {'PK': str(1650000000 + number), 'SK': f'user{number}'}
+            for number in range(1, count + 1)]
+
+
+class CrashingWriter(DryRunWriter):
+    """
+    Dies on the crash_at'th put, like a run whose credentials expired.
+    """
+
+    def __init__(self, table_name, crash_at):
+        super().__init__(table_name)
+        self.crash_at = crash_at
+
+    def put(self, item):
+        if self.written + 1 == self.crash_at:
+            raise RuntimeError('ExpiredTokenException')
+        super().put(item)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = Checkpoint(path, 'original', 3)
+    cursors = {0: {'PK': '1650000000', 'visit_time': Decimal('1650000000.5')},
+               1: 'DONE',
+               2: {'line': 7}}
+    checkpoint.save(cursors, 120, rows_rejected=2, rejects_offset=311)
+
+    loaded = Checkpoint.load(path, 'original', 3)
+
+    assert loaded.cursors == cursors
+    assert isinstance(loaded.cursors[0]['visit_time'], Decimal)
+    assert (loaded.rows_written, loaded.rows_rejected,
+            loaded.rejects_offset) == (120, 2, 311)
+
+
+def test_checkpoint_of_another_source_or_segmentation_is_refused(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    Checkpoint(path, 'original', 4).save({0: 'DONE'}, 10)
+
+    with pytest.raises(ValueError, match='migrating original, not other'):
+        Checkpoint.load(path, 'other', 4)
+    with pytest.raises(ValueError, match='4 segments, not 8'):
+        Checkpoint.load(path, 'original', 8)
+
+
+def test_checkpoint_without_rejects_loads(tmp_path):
+    # checkpoints saved before the rejects were tracked
+    path = tmp_path / 'checkpoint.json'
+    path.write_text(json.dumps({'source': 'original', 'total_segments': 1,
+                                'cursors': {'0': {'line': {'N': '5'}}},
+                                'rows_written': 5}))
+
+    loaded = Checkpoint.load(str(path), 'original', 1)
+
+    assert loaded.cursors == {0: {'line': 5}}
+    assert (loaded.rows_rejected, loaded.rejects_offset) == (0, 0)
+
+
+def test_rows_written_leaves_out_rejects(tmp_path, write_export):
+    files = write_export(rows(10, malformed={3, 7}))
+    visits, users = DryRunWriter('visits'), DryRunWriter('users')
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), 'export', 1)
+
+    with RejectFile(str(tmp_path / 'rejects.jsonl')) as rejects:
+        written = migrate(ExportReader(files), visits, users, checkpoint,
+                          checkpoint_every=2, rejects=rejects)
+
+    assert written == visits.written + users.written == 8
+    assert rejects.count == 2
+    assert checkpoint.rows_written == 8
+    assert checkpoint.cursors == {0: 'DONE'}
+
+
+def test_resume_writes_and_rejects_every_row_once(tmp_path, write_export):
+    files = write_export(rows(10, malformed={3, 7}))
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    rejects_path = str(tmp_path / 'rejects.jsonl')
+
+    # the first run dies after the second reject, past its last checkpoint
+    first = CrashingWriter('visits', crash_at=6)
+    with RejectFile(rejects_path) as rejects:
+        with pytest.raises(RuntimeError):
+            migrate(ExportReader(files), first, DryRunWriter('users'),
+                    Checkpoint(checkpoint_path, 'export', 1),
+                    checkpoint_every=2, rejects=rejects)
+    assert rejects.count == 2
+
+    checkpoint = Checkpoint.load(checkpoint_path, 'export', 1)
+    second = DryRunWriter('visits')
+    with open_rejects(rejects_path, resumed=checkpoint) as rejects:
+        written = migrate(ExportReader(files, checkpoint.cursors), second,
+                          DryRunWriter('users'), checkpoint,
+                          checkpoint_every=2, rejects=rejects)
+
+    # the checkpoint was after row 5, so rows 6, 8, 9 and 10 are left
+    assert second.written == 4
+    assert written == checkpoint.rows_written == 8
+    assert rejects.count == 2
+    with open(rejects_path) as f:
+        assert len(f.readlines()) == 2
+
+
+def test_dry_run_between_a_real_run_and_its_resume(tmp_path, write_export):
+    files = write_export(rows(10, malformed={3, 7}))
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+    rejects_path = str(tmp_path / REJECTS)
+
+    with open_rejects(rejects_path) as rejects:
+        with pytest.raises(RuntimeError):
+            migrate(ExportReader(files), CrashingWriter('visits', crash_at=6),
+                    DryRunWriter('users'),
+                    Checkpoint(checkpoint_path, 'export', 1),
+                    checkpoint_every=2, rejects=rejects)
+
+    # a dry run, with no checkpoint, rejects into its own file
+    with open_rejects(str(tmp_path / DRY_RUN_REJECTS), dry_run=True) as rejects:
+        migrate(ExportReader(files), DryRunWriter('visits'),
+                DryRunWriter('users'), None, rejects=rejects)
+    assert rejects.count == 2
+
+    checkpoint = Checkpoint.load(checkpoint_path, 'export', 1)
+    with open_rejects(rejects_path, resumed=checkpoint) as rejects:
+        written = migrate(ExportReader(files, checkpoint.cursors),
+                          DryRunWriter('visits'), DryRunWriter('users'),
+                          checkpoint, checkpoint_every=2, rejects=rejects)
+
+    assert written == 8
+    with open(rejects_path) as f:
+        rejected = [json.loads(line) for line in f]
+    assert [reject['row'] for reject in rejected] == [
+        {'PK': 'user', 'SK': 'not a timestamp'}] * 2
+
+
+def test_resume_refuses_a_rejects_file_shorter_than_its_checkpoint(tmp_path):
+    rejects_path = tmp_path / REJECTS
+    rejects_path.write_text('{"row": {}, "error": "KeyError: \'PK\'"}\n')
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'), 'export', 1,
+                            rows_rejected=3, rejects_offset=300)
+
+    with pytest.raises(ValueError, match='missing rejects'):
+        open_rejects(str(rejects_path), resumed=checkpoint)
+    # and leaves it as it was
+    assert len(rejects_path.read_text()) < 300